@@ -187,16 +187,69 @@
 #     import uvicorn
 #     uvicorn.run(app, host="0.0.0.0", port=8000)
 
+import asyncio
 import os
-import shutil
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse
+import re
+import uuid
+from contextlib import asynccontextmanager
+from functools import lru_cache, partial
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
 
 # Ensure this import works in your project structure
-from scripts.run_pipeline import run_custom_pipeline
-
-app = FastAPI()
+# (cheap: the heavy stage modules are imported on first use / in lifespan)
+from scripts.run_pipeline import run_custom_pipeline, load_config, preload_pipeline, resolve
+from scripts.metrics import stage, QUEUE_DEPTH, CONTENT_TYPE, render_metrics
+from scripts.job_queue import get_queue
+from scripts.validate import ValidationError
+from scripts.storage import shard_dir, record_files, compaction_loop, get_index
+from scripts.progress import BUS, current_job, format_sse
+from scripts.staged_pipeline import StagedPipeline, is_staged
+from scripts.admission import AdmissionController, LaneFull
+from scripts.export import FORMATS as EXPORT_FORMATS, MEDIA_TYPES as EXPORT_MEDIA_TYPES
+from scripts.workspace import job_workspace, sweep_loop
+from scripts.serials import allocate_serial
+
+
+@asynccontextmanager
+async def lifespan(app):
+    cfg = load_config()
+    startup_cfg = cfg.get("startup") or {}
+    if startup_cfg.get("preload", True):
+        # Warm pandas/openpyxl/google-genai in the background so the server
+        # accepts connections immediately after boot
+        asyncio.get_running_loop().run_in_executor(None, preload_pipeline)
+
+    # Retention / compression of old shards (scripts/storage.py)
+    compaction = None
+    if (cfg.get("storage") or {}).get("background_compaction", True):
+        compaction = asyncio.create_task(compaction_loop(cfg))
+
+    # Scratch of crashed or timed-out jobs (scripts/workspace.py)
+    sweeper = asyncio.create_task(sweep_loop(cfg))
+
+    # pipeline.mode: staged → shared stage pools for /api/process-docs
+    app.state.staged_pipeline = None
+    if is_staged(cfg):
+        app.state.staged_pipeline = StagedPipeline(cfg, allocate=take_serial)
+        await app.state.staged_pipeline.start()
+
+    # admission: bounded per-lane queues in front of /api/process-docs
+    app.state.admission = AdmissionController.from_config(cfg, sequential=not is_staged(cfg))
+    yield
+    if compaction:
+        compaction.cancel()
+    sweeper.cancel()
+    if app.state.staged_pipeline is not None:
+        await app.state.staged_pipeline.stop(drain=False)
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -207,89 +260,549 @@ app.add_middleware(
 
 # Root Directory Setup
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-INPUT_DIR = os.path.join(BASE_DIR, "data", "input")
-STATE_DIR = os.path.join(BASE_DIR, "state")
-SERIAL_FILE = os.path.join(STATE_DIR, "serial_tracker.txt")
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+PIPELINE_LOCK = asyncio.Lock()
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
 # --- HELPER FUNCTIONS ---
 
-def get_initial_serial():
+def take_serial(requested: str = None, job_id: str = None) -> str:
+    """
+    Serial of a job entering the Excel stage, after extraction and
+    validation, from the counter shared by every entry point
+    (scripts/serials.py). Announced on the job's progress stream.
+    """
+    serial = allocate_serial(load_config(), requested)
+    if job_id:
+        BUS.publish(job_id, "serial", serial_number=serial)
+    return serial
+
+class TimedFileResponse(FileResponse):
+    """
+    FileResponse that records the time spent streaming the workbook back
+    to the client as the "response" stage.
     """
-    Reads the last saved serial number.
-    Uses .zfill(4) to ensure it returns '0888' instead of '888'.
+    async def __call__(self, scope, receive, send):
+        with stage("response"):
+            await super().__call__(scope, receive, send)
+
+def profiling_requested(request: Request) -> bool:
     """
-    if os.path.exists(SERIAL_FILE):
-        with open(SERIAL_FILE, "r") as f:
-            content = f.read().strip()
-            if content:
-                # Force it to be at least 4 digits (e.g., "888" -> "0888")
-                return content.zfill(4)
-    return "0888"
-
-def increment_serial_tracker(used_serial: str):
+    Per-request opt-in: `X-Profile: 1` header or `?profile=1` query flag.
+    """
+    flag = request.headers.get("x-profile") or request.query_params.get("profile") or ""
+    return flag.strip().lower() in ("1", "true", "yes", "on")
+
+def in_memory_requested(request: Request, default_mode: str) -> bool:
+    """
+    `?in_memory=1` / `X-Output-Mode: memory` build the workbook in memory;
+    otherwise delivery.mode from config.yaml decides.
+    """
+    flag = request.query_params.get("in_memory")
+    if flag is not None:
+        return flag.strip().lower() in ("1", "true", "yes", "on")
+    mode = request.headers.get("x-output-mode") or default_mode or "disk"
+    return mode.strip().lower() == "memory"
+
+def output_format_requested(request: Request, default_format: str) -> str:
     """
-    Increments the serial number and maintains the leading zeros.
+    `?format=json|csv` / `X-Output-Format: json` return the per-sheet data
+    instead of a workbook (see scripts/export.py); otherwise delivery.format
+    from config.yaml decides.
     """
-    os.makedirs(STATE_DIR, exist_ok=True)
+    fmt = request.query_params.get("format") or request.headers.get("x-output-format") or default_format or "xlsx"
+    return fmt.strip().lower()
+
+def lane_requested(request: Request) -> Optional[str]:
+    """
+    Admission lane from `X-Lane: urgent` or `?lane=urgent` (None → the
+    configured default lane).
+    """
+    lane = request.query_params.get("lane") or request.headers.get("x-lane")
+    return lane.strip().lower() if lane else None
+
+def archive_workbook(cfg: dict, output_dir: str, filename: str, data: bytes, job_id: str = None):
+    """Writes an in-memory workbook to data/output after the response went out."""
     try:
-        # 1. Convert to int to add 1
-        next_val = int(used_serial) + 1
-        
-        # 2. Convert back to string and add leading zeros (4 digits total)
-        next_serial = str(next_val).zfill(4)
-        
-        with open(SERIAL_FILE, "w") as f:
-            f.write(next_serial)
-    except ValueError:
-        # If user typed non-numeric text, do not crash, just pass
-        pass
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, filename)
+        with stage("archive"):
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+        record_files(cfg, {"output": path}, os.path.splitext(filename)[0], job_id)
+        download_url = f"/api/process-docs/{job_id}/download" if job_id else None
+    except Exception as e:
+        print(f"   ! Warning: Could not archive {filename}: {e}")
+        download_url = None
+    if job_id:
+        BUS.publish(job_id, "done", filename=filename, download_url=download_url)
 
 # --- ENDPOINTS ---
 
+@app.middleware("http")
+async def admit_uploads(request: Request, call_next):
+    """
+    Admission for /api/process-docs (see scripts/admission.py). FastAPI
+    reads the whole multipart body before the handler or its dependencies
+    run, so the place in the lane is taken here: a full lane answers 429
+    before the PDFs are uploaded. The handler finds the ticket in
+    request.state.
+    """
+    admission = getattr(request.app.state, "admission", None)
+    if admission is None or request.method != "POST" or request.url.path != "/api/process-docs":
+        return await call_next(request)
+
+    lane = lane_requested(request)
+    if lane and lane not in admission.lanes:
+        return JSONResponse({"detail": f"lane must be one of: {', '.join(admission.lanes)}"}, status_code=400)
+    try:
+        ticket = admission.admit(lane)
+    except LaneFull as e:
+        # The form (and its job_id) is not read; X-Job-Id names the job instead
+        job_id = request.headers.get("x-job-id")
+        if job_id and JOB_ID_PATTERN.match(job_id):
+            BUS.publish(job_id, "failed", status_code=429, error=str(e))
+        return JSONResponse({"detail": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+
+    request.state.admission_ticket = ticket
+    try:
+        return await call_next(request)
+    finally:
+        # Also frees the place of a request rejected before the handler ran
+        ticket.release()
+
 @app.post("/api/process-docs")
 async def process_documents(
-    # This calls the helper function immediately to pre-fill the UI
-    serial_number: str = Form(default=get_initial_serial()), 
+    request: Request,
+    # Defaults to the next serial of the shared counter, taken after validation
+    serial_number: str = Form(default=None),
+    # Optional client-chosen ID, so the client can open the progress stream
+    # (GET /api/process-docs/{job_id}/events) before the upload finishes;
+    # also accepted as an X-Job-Id header, which a 429 reaches as well
+    job_id: str = Form(default=None),
     invoice: UploadFile = File(...),
     packing_list: UploadFile = File(...)
 ):
+    job_id = job_id or request.headers.get("x-job-id")
+    if job_id and not JOB_ID_PATTERN.match(job_id):
+        raise HTTPException(status_code=400, detail="job_id must be 1-64 letters, digits, '-' or '_'")
+    job_id = job_id or uuid.uuid4().hex
+
+    delivery = load_config().get("delivery") or {}
+    output_format = output_format_requested(request, delivery.get("format", "xlsx"))
+    if output_format != "xlsx" and output_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: xlsx, {', '.join(EXPORT_FORMATS)}")
+
+    # Place in the lane's queue, taken by admit_uploads before the upload
+    ticket = getattr(request.state, "admission_ticket", None)
+
+    # Counted as queued until the pipeline actually starts on this request
+    QUEUE_DEPTH.inc(queue="api")
+    queued = True
+    # Stages of this request (and its threadpool calls) report to job_id
+    job_token = current_job.set(job_id)
+    BUS.publish(job_id, "accepted")
+    workspace = None
     try:
-        # 1. Prepare input directory
-        os.makedirs(INPUT_DIR, exist_ok=True)
-
-        inv_filename = os.path.basename(invoice.filename)
-        pl_filename = os.path.basename(packing_list.filename)
-
-        invoice_path = os.path.join(INPUT_DIR, inv_filename)
-        pl_path = os.path.join(INPUT_DIR, pl_filename)
-
-        # 2. Save uploaded files
-        with open(invoice_path, "wb") as buffer:
-            shutil.copyfileobj(invoice.file, buffer)
-
-        with open(pl_path, "wb") as buffer:
-            shutil.copyfileobj(packing_list.file, buffer)
-
-        # 3. Run pipeline
-        # CHANGE: Passed serial_number to the pipeline to ensure output matches input
-        final_excel_path = run_custom_pipeline(invoice_path, pl_path, serial_number)
-
-        if not os.path.exists(final_excel_path):
-            raise HTTPException(status_code=500, detail="Pipeline failed to create output.")
-
-        # 4. Increment serial for NEXT time (preserving the leading zero)
-        increment_serial_tracker(serial_number)
+        cfg = load_config()
+
+        # 1. The job's own scratch directory for uploads and intermediates
+        # (RAM-backed when available, see scripts/workspace.py); removed
+        # when the request ends, whatever the outcome
+        with job_workspace(cfg, job_id) as workspace:
+            # 2. Save uploaded files
+            with stage("upload"):
+                invoice_path = workspace.save_upload(invoice.filename, invoice.file)
+                pl_path = workspace.save_upload(packing_list.filename, packing_list.file)
+
+            # 3. Run pipeline
+            # CHANGE: Passed serial_number to the pipeline to ensure output matches input
+            delivery = cfg.get("delivery") or {}
+            # Exports are always built in memory
+            in_memory = in_memory_requested(request, delivery.get("mode", "disk")) or output_format != "xlsx"
+            if ticket is not None:
+                # Urgent lanes are served first; per-lane concurrency limits apply
+                await ticket.wait()
+            staged = getattr(request.app.state, "staged_pipeline", None)
+            if staged is not None:
+                # Staged mode: extraction overlaps other jobs' Excel work; the
+                # serial is taken when this job reaches the Excel stage
+                QUEUE_DEPTH.dec(queue="api")
+                queued = False
+                BUS.publish(job_id, "started", serial_number=serial_number)
+                result = await staged.run(
+                    invoice_path, pl_path, serial_number, job_id=job_id, in_memory=in_memory,
+                    output_format=output_format, work_dir=workspace.path,
+                    profile=profiling_requested(request),
+                )
+            else:
+                # One shipment at a time per API process (scale out via /api/jobs);
+                # the serial is taken once the extraction passed validation
+                async with PIPELINE_LOCK:
+                    QUEUE_DEPTH.dec(queue="api")
+                    queued = False
+                    BUS.publish(job_id, "started", serial_number=serial_number)
+
+                    # The pipeline runs in the threadpool so the event loop keeps serving
+                    # progress streams and other requests meanwhile
+                    result = await run_in_threadpool(
+                        run_custom_pipeline,
+                        invoice_path,
+                        pl_path,
+                        serial_number,
+                        job_id=job_id,
+                        profile=profiling_requested(request),
+                        work_dir=workspace.path,
+                        in_memory=in_memory,
+                        output_format=output_format,
+                        allocate=partial(take_serial, job_id=job_id),
+                    )
+
+            if in_memory:
+                filename, data = result
+                # Inputs (and intermediates, per workspace.promote) into data/
+                workspace.promote(cfg, os.path.splitext(filename)[0])
+
+                # Archive after the response has been sent, or not at all
+                # ("done" is published once the archive exists, see archive_workbook)
+                background = None
+                if delivery.get("archive", "async") == "async":
+                    output_dir = shard_dir(resolve(cfg["base_dir"], cfg["data"]["output"]["final_excel_dir"]), cfg)
+                    background = BackgroundTask(archive_workbook, cfg, output_dir, filename, data, job_id)
+                else:
+                    BUS.publish(job_id, "done", filename=filename, download_url=None)
+                return Response(
+                    content=data,
+                    media_type=EXPORT_MEDIA_TYPES.get(output_format, XLSX_MEDIA_TYPE),
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Job-Id": job_id},
+                    background=background,
+                )
+
+            if not os.path.exists(result):
+                raise HTTPException(status_code=500, detail="Pipeline failed to create output.")
+
+            # The workbook leaves the scratch directory before it is removed
+            nomor_aju = os.path.splitext(os.path.basename(result))[0]
+            final_excel_path = workspace.promote(cfg, nomor_aju)["output"][0]
+        BUS.publish(
+            job_id, "done", filename=os.path.basename(final_excel_path),
+            download_url=f"/api/process-docs/{job_id}/download",
+        )
 
         # 5. Return output file
-        return FileResponse(
+        return TimedFileResponse(
             path=final_excel_path,
             filename=os.path.basename(final_excel_path),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={"X-Job-Id": job_id},
         )
 
+    except ValidationError as e:
+        # Bad extraction: rejected before any workbook was built or serial used
+        print("Validation failed:", str(e))
+        BUS.publish(job_id, "failed", status_code=422, error=str(e))
+        raise HTTPException(status_code=422, detail={"message": str(e), "issues": e.issues})
     except Exception as e:
         print("Error:", str(e))
+        if workspace is not None and workspace.expired:
+            # sweep() reclaimed the scratch of a job past workspace.timeout_seconds
+            detail = f"Job exceeded workspace.timeout_seconds ({e})"
+            BUS.publish(job_id, "failed", status_code=504, error=detail)
+            raise HTTPException(status_code=504, detail=detail)
+        BUS.publish(job_id, "failed", status_code=500, error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        current_job.reset(job_token)
+        if queued:
+            QUEUE_DEPTH.dec(queue="api")
+        if ticket is not None:
+            ticket.release()
+
+
+# --- PROGRESS STREAM ---
+# Server-Sent Events for one job: "accepted", "started" (with the requested
+# serial), "stage" (start/end/error with seconds), "serial" (the allocated
+# one, after validation), then "done" with the download link or "failed".
+#
+#   const events = new EventSource(`/api/process-docs/${jobId}/events`);
+#   events.addEventListener("done", e => location = JSON.parse(e.data).download_url);
+
+@app.get("/api/process-docs/{job_id}/events")
+async def job_events(job_id: str):
+    if not JOB_ID_PATTERN.match(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job_id")
+
+    async def stream():
+        async for entry in BUS.subscribe(job_id):
+            yield format_sse(entry)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/process-docs/{job_id}/download")
+def job_download(job_id: str):
+    """The archived workbook (or export) of a finished job (link sent in the "done" event)."""
+    files = [f for f in get_index(load_config()).find_job(job_id) if f["kind"] == "output"]
+    if not files or files[-1]["status"] != "live" or not os.path.exists(files[-1]["path"]):
+        raise HTTPException(status_code=404, detail="No archived workbook for this job")
+    path = files[-1]["path"]
+    extension = os.path.splitext(path)[1]
+    return TimedFileResponse(
+        path=path,
+        filename=os.path.basename(path),
+        media_type=EXPORT_MEDIA_TYPES.get({".json": "json", ".zip": "csv"}.get(extension), XLSX_MEDIA_TYPE),
+        headers={"X-Job-Id": job_id},
+    )
+
+
+# --- SHARED QUEUE (WORKER MODE) ---
+# Jobs submitted here are processed by `python -m scripts.worker` on any node.
+
+@lru_cache(maxsize=None)
+def get_job_queue():
+    return get_queue(load_config())
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(
+    request: Request,
+    serial_number: str = Form(default=None),
+    invoice: UploadFile = File(...),
+    packing_list: UploadFile = File(...)
+):
+    with stage("upload"):
+        invoice_bytes = await invoice.read()
+        packing_bytes = await packing_list.read()
+
+    # The queue backends block (SQLite locks, Redis round trips): keep them
+    # off the event loop. The serial is allocated by the worker.
+    queue = await run_in_threadpool(get_job_queue)
+    job_id = await run_in_threadpool(
+        queue.enqueue,
+        os.path.basename(invoice.filename),
+        invoice_bytes,
+        os.path.basename(packing_list.filename),
+        packing_bytes,
+        serial_number=serial_number,
+        options={"profile": profiling_requested(request)},
+    )
+    QUEUE_DEPTH.set(await run_in_threadpool(queue.depth), queue="shared")
+    return {
+        "job_id": job_id,
+        "status_url": f"/api/jobs/{job_id}",
+        "result_url": f"/api/jobs/{job_id}/result",
+    }
+
+
+@app.get("/api/jobs/{job_id}")
+def job_status(job_id: str):
+    status = get_job_queue().status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return status
+
+
+@app.get("/api/jobs/{job_id}/result")
+def job_result(job_id: str):
+    queue = get_job_queue()
+    status = queue.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if status["status"] == "failed":
+        raise HTTPException(status_code=500, detail=status["error"])
+
+    result = queue.result(job_id)
+    if result is None:
+        raise HTTPException(status_code=409, detail=f"Job is {status['status']}")
+
+    filename, data = result
+    return Response(
+        content=data,
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Job-Id": job_id},
+    )
+
+
+# --- REPLAY ---
+# Rebuilds workbooks from stored extractions (see scripts/replay.py). A
+# replay can cover months of shipments, so it runs in the background:
+# POST returns a job ID at once, GET /api/replay/{job_id} (or the job's
+# events stream) reports the results when it is done.
+
+# Running replays (a reference keeps the tasks from being collected)
+REPLAY_TASKS = set()
+
+
+class ReplayRequest(BaseModel):
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    customer: Optional[str] = None
+    nomor_aju: Optional[List[str]] = None
+    job_ids: Optional[List[str]] = None
+    workers: Optional[int] = None
+
+
+async def run_replay(job_id: str, body: ReplayRequest):
+    from scripts.replay import replay
+
+    current_job.set(job_id)
+    try:
+        with stage("replay"):
+            results = await run_in_threadpool(
+                replay,
+                body.date_from,
+                body.date_to,
+                body.customer,
+                body.nomor_aju,
+                body.job_ids,
+                workers=body.workers,
+            )
+    except Exception as e:
+        print(f"❌ Replay {job_id} failed: {e}")
+        BUS.publish(job_id, "failed", error=str(e))
+        return
+    failed = sum(1 for r in results if "error" in r)
+    BUS.publish(job_id, "done", rebuilt=len(results) - failed, failed=failed, results=results)
+
+
+@app.post("/api/replay", status_code=202)
+async def replay_shipments(body: ReplayRequest):
+    if not any([body.date_from, body.date_to, body.customer, body.nomor_aju, body.job_ids]):
+        raise HTTPException(status_code=400, detail="Give at least one filter")
+
+    job_id = uuid.uuid4().hex
+    BUS.publish(job_id, "accepted")
+    task = asyncio.create_task(run_replay(job_id, body))
+    REPLAY_TASKS.add(task)
+    task.add_done_callback(REPLAY_TASKS.discard)
+    return {
+        "job_id": job_id,
+        "status_url": f"/api/replay/{job_id}",
+        "events_url": f"/api/process-docs/{job_id}/events",
+    }
+
+
+@app.get("/api/replay/{job_id}")
+def replay_status(job_id: str):
+    if not JOB_ID_PATTERN.match(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job_id")
+    events = [e for e in BUS.history(job_id) if e["event"] in ("accepted", "done", "failed")]
+    if not events:
+        # Unknown, or finished longer ago than the progress bus keeps events
+        raise HTTPException(status_code=404, detail="Unknown replay job")
+    last = events[-1]
+    if last["event"] == "done":
+        return {"job_id": job_id, "status": "done", "rebuilt": last["rebuilt"], "failed": last["failed"],
+                "results": last["results"]}
+    if last["event"] == "failed":
+        return {"job_id": job_id, "status": "failed", "error": last["error"]}
+    return {"job_id": job_id, "status": "running"}
+
+
+# --- AMENDMENTS ---
+# Field-level corrections to an archived workbook (see scripts/amend.py).
+
+class AmendRequest(BaseModel):
+    # Workbook to amend: a job ID or its NOMOR AJU
+    job_id: Optional[str] = None
+    nomor_aju: Optional[str] = None
+    # Changes
+    serial_number: Optional[str] = None
+    new_nomor_aju: Optional[str] = None
+    header: Optional[Dict[str, Any]] = None
+    customer: Optional[str] = None
+    barang: Optional[List[Dict[str, Any]]] = None
+
+
+@app.post("/api/amend")
+def amend_pib(body: AmendRequest):
+    from scripts.amend import AmendmentConflict, AmendmentError, amend
+
+    if not body.job_id and not body.nomor_aju:
+        raise HTTPException(status_code=400, detail="Give job_id or nomor_aju")
+    changes = {
+        "serial_number": body.serial_number,
+        "nomor_aju": body.new_nomor_aju,
+        "header": body.header,
+        "customer": body.customer,
+        "barang": body.barang,
+    }
+    if not any(changes.values()):
+        raise HTTPException(status_code=400, detail="No changes given")
+
+    try:
+        with stage("amend"):
+            result = amend(changes, job_id=body.job_id, nomor_aju=body.nomor_aju)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except AmendmentConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except AmendmentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return Response(
+        content=result["data"],
+        media_type=XLSX_MEDIA_TYPE,
+        headers={
+            "Content-Disposition": f'attachment; filename="{result["filename"]}"',
+            "X-Job-Id": result["job_id"] or "",
+            "X-Nomor-Aju": result["nomor_aju"] or "",
+        },
+    )
+
+
+@app.get("/api/admission")
+def admission_status(request: Request):
+    """Lane limits and the jobs currently waiting / running in each lane."""
+    admission = getattr(request.app.state, "admission", None)
+    if admission is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission.snapshot()}
+
+
+@app.get("/api/ledger")
+def ledger_report(by: str = "day", date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """Gemini tokens, latency, uploads and retries aggregated per day / customer / model / call / job."""
+    from scripts.ledger import GROUPINGS, get_ledger
+
+    if by not in GROUPINGS:
+        raise HTTPException(status_code=400, detail=f"by must be one of: {', '.join(GROUPINGS)}")
+    ledger = get_ledger(load_config())
+    if ledger is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "by": by,
+        "budget": ledger.budget,
+        "rows": ledger.report(by, date_from, date_to),
+        "over_budget": [job["job_id"] for job in ledger.over_budget(date_from, date_to)],
+    }
+
+
+@app.get("/api/ledger/{job_id}")
+def ledger_job_calls(job_id: str):
+    """Every Gemini call booked to one job."""
+    from scripts.ledger import get_ledger
+
+    ledger = get_ledger(load_config())
+    calls = ledger.calls(job_id) if ledger is not None else []
+    if not calls:
+        raise HTTPException(status_code=404, detail="No Gemini calls recorded for this job")
+    return {"job_id": job_id, "calls": calls}
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus scrape endpoint: per-stage latency histograms, in-flight
+    gauges, queue depth, reference cache hit/miss and error counters.
+    """
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
 
 
 if __name__ == "__main__":
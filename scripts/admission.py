@@ -0,0 +1,186 @@
+import asyncio
+import math
+import time
+from collections import deque
+
+from scripts.metrics import ADMISSION_JOBS, ADMISSION_REJECTED
+
+# --------------------------------------------------
+# ADMISSION CONTROL FOR /api/process-docs
+# --------------------------------------------------
+# Every upload used to be accepted and attempted at once. Here a request
+# first takes a place in its lane's queue (bounded: a full lane answers 429
+# with Retry-After, before the PDFs are read; see admit_uploads in main.py)
+# and then waits for a slot:
+#
+#   - at most max_active jobs run at the same time (1 in sequential mode,
+#     where the pipeline handles one shipment at a time anyway)
+#   - each lane runs at most `concurrency` of them
+#   - a free slot goes to the first lane, in config order, that has a job
+#     waiting and is below its own limit, so urgent same-day clearances
+#     jump ahead of bulk backlog submissions
+#
+# Keeping a lane's concurrency below max_active reserves the remaining slots
+# for the others. The lane comes from `X-Lane: urgent` or `?lane=urgent`.
+#
+# config.yaml:
+#   admission:
+#     enabled: true
+#     max_active: 6
+#     default_lane: standard
+#     retry_after_seconds: 30
+#     lanes:
+#       urgent:   {concurrency: 2, max_queue: 10}
+#       standard: {concurrency: 4, max_queue: 20}
+#       bulk:     {concurrency: 2, max_queue: 50}
+
+DEFAULT_LANES = {
+    "urgent": {"concurrency": 2, "max_queue": 10},
+    "standard": {"concurrency": 4, "max_queue": 20},
+    "bulk": {"concurrency": 2, "max_queue": 50},
+}
+
+
+class LaneFull(Exception):
+    def __init__(self, lane, retry_after):
+        super().__init__(f"The '{lane}' lane is full, retry in {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Lane:
+    def __init__(self, name, concurrency, max_queue):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.waiting = deque()
+        self.active = 0
+        self.avg_seconds = None   # moving average of the time a slot is held
+
+
+class Ticket:
+    """A request's place in a lane: wait() for the slot, release() when done."""
+
+    def __init__(self, controller, lane):
+        self.controller = controller
+        self.lane = lane
+        self.future = asyncio.get_running_loop().create_future()
+        self.started = None
+        self.released = False
+
+    async def wait(self):
+        try:
+            await asyncio.shield(self.future)
+        except asyncio.CancelledError:
+            # Client gone while waiting; release() gives the slot back if it
+            # was granted in the meantime
+            self.release()
+            raise
+        self.started = time.monotonic()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """Lives in the event loop; not thread-safe (the API is single-loop)."""
+
+    def __init__(self, lanes=None, max_active=None, default_lane=None, retry_after_seconds=30):
+        lanes = lanes or DEFAULT_LANES
+        self.lanes = {
+            name: Lane(name, spec.get("concurrency", 1), spec.get("max_queue", 0))
+            for name, spec in lanes.items()
+        }
+        self.max_active = max(1, int(max_active or sum(l.concurrency for l in self.lanes.values())))
+        self.default_lane = default_lane or next(iter(self.lanes))
+        if self.default_lane not in self.lanes:
+            raise ValueError(f"admission.default_lane '{self.default_lane}' is not one of {list(self.lanes)}")
+        self.retry_after_seconds = retry_after_seconds
+        self.active = 0
+
+    @classmethod
+    def from_config(cls, cfg, sequential=False):
+        """None when admission control is disabled."""
+        settings = (cfg or {}).get("admission") or {}
+        if not settings.get("enabled", False):
+            return None
+        max_active = 1 if sequential else settings.get("max_active")
+        return cls(
+            settings.get("lanes"),
+            max_active,
+            settings.get("default_lane"),
+            settings.get("retry_after_seconds", 30),
+        )
+
+    def admit(self, lane=None):
+        """Reserves a place in the lane's queue; raises LaneFull (or KeyError for an unknown lane)."""
+        lane = self.lanes[lane or self.default_lane]
+        free_slot = lane.active < lane.concurrency and self.active < self.max_active
+        if len(lane.waiting) >= lane.max_queue and not free_slot:
+            retry_after = self.retry_after(lane)
+            ADMISSION_REJECTED.inc(lane=lane.name)
+            raise LaneFull(lane.name, retry_after)
+        ticket = Ticket(self, lane)
+        lane.waiting.append(ticket)
+        self._update_gauges(lane)
+        self._dispatch()
+        return ticket
+
+    def retry_after(self, lane):
+        """
+        Seconds until a place is likely to free up: the jobs ahead divided
+        by the lane's concurrency, times its average job time.
+        """
+        if lane.avg_seconds is None:
+            return int(self.retry_after_seconds)
+        ahead = len(lane.waiting) + lane.active
+        seconds = lane.avg_seconds * ahead / min(lane.concurrency, self.max_active)
+        return max(1, math.ceil(min(seconds, 3600)))
+
+    def _dispatch(self):
+        while self.active < self.max_active:
+            for lane in self.lanes.values():
+                if lane.waiting and lane.active < lane.concurrency:
+                    ticket = lane.waiting.popleft()
+                    ticket.future.set_result(None)
+                    lane.active += 1
+                    self.active += 1
+                    self._update_gauges(lane)
+                    break
+            else:
+                return
+
+    def _release(self, ticket):
+        lane = ticket.lane
+        if ticket.future.done():
+            lane.active -= 1
+            self.active -= 1
+            if ticket.started is not None:
+                seconds = time.monotonic() - ticket.started
+                lane.avg_seconds = seconds if lane.avg_seconds is None else 0.8 * lane.avg_seconds + 0.2 * seconds
+        else:
+            lane.waiting.remove(ticket)
+            ticket.future.cancel()
+        self._update_gauges(lane)
+        self._dispatch()
+
+    def _update_gauges(self, lane):
+        ADMISSION_JOBS.set(len(lane.waiting), lane=lane.name, state="waiting")
+        ADMISSION_JOBS.set(lane.active, lane=lane.name, state="active")
+
+    def snapshot(self):
+        return {
+            "max_active": self.max_active,
+            "active": self.active,
+            "lanes": {
+                name: {
+                    "concurrency": lane.concurrency,
+                    "max_queue": lane.max_queue,
+                    "active": lane.active,
+                    "waiting": len(lane.waiting),
+                }
+                for name, lane in self.lanes.items()
+            },
+        }
@@ -0,0 +1,416 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from io import BytesIO
+
+from scripts.metrics import stage
+from scripts.run_pipeline import load_config, load_material_index, resolve
+from scripts.storage import LIVE, get_index, record_files, shard_dir
+
+# --------------------------------------------------
+# AMENDMENTS
+# --------------------------------------------------
+# Corrects an archived PIB workbook in place of a full rerun: the workbook
+# of a job ID / NOMOR AJU is loaded, the field changes are written and only
+# the post-processing they affect is repeated (NOMOR AJU propagation, date
+# copy, HS lookup of a changed line, customer match), then excel_fix.
+# Gemini is not called. A new NOMOR AJU must not belong to another live
+# workbook; a requested serial goes through the shared counter so later jobs
+# do not reuse it, and the workbook it replaces is marked superseded.
+#
+# changes:
+#   {"serial_number": "0912",            NOMOR AJU with this serial (same prefix/date)
+#    "nomor_aju": "0000270106942026...",  or an explicit NOMOR AJU
+#    "header": {"TANGGAL PERNYATAAN": "2026-10-19"},
+#    "customer": "PT NEW CUSTOMER",       re-matched against the customer list
+#    "barang": [{"seri": 3, "HS": "39012000", "JUMLAH SATUAN": 120}]}
+#
+# A changed URAIAN / KODE BARANG without an HS gets its HS from the material
+# master / HS list again. The amended workbook is archived in today's output
+# shard and every amendment is appended to state/amendments.jsonl.
+#
+#   python -m scripts.amend 000027010694202610190000391 --serial 0912
+#   python -m scripts.amend --job <job_id> --barang 3:HS=39012000 --header "TANGGAL PERNYATAAN=2026-10-19"
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+LOG_PATH = os.path.join(ROOT_DIR, "state", "amendments.jsonl")
+
+PROPAGATED_SHEETS = ("DOKUMEN", "PENGANGKUT", "BARANG")
+
+
+class AmendmentError(ValueError):
+    """Changes that do not fit the workbook (unknown column, BARANG line, ...)."""
+
+
+class AmendmentConflict(AmendmentError):
+    """The new NOMOR AJU already belongs to another live workbook."""
+
+
+def renumber(nomor_aju, serial_number):
+    """NOMOR AJU with its 6-digit serial replaced."""
+    nomor_aju = str(nomor_aju or "").strip()
+    if len(nomor_aju) < 26:
+        raise AmendmentError(f"Cannot change the serial of NOMOR AJU '{nomor_aju}'")
+    try:
+        serial = int(serial_number)
+    except (TypeError, ValueError):
+        raise AmendmentError(f"serial_number must be numeric, got '{serial_number}'")
+    return f"{nomor_aju[:-6]}{serial:06d}"
+
+
+# --------------------------------------------------
+# CHANGES
+# --------------------------------------------------
+def set_nomor_aju(wb, nomor_aju):
+    """HEADER, ENTITAS (every row, as text) and the stamped rows of the other sheets."""
+    from scripts.excel_postprocess import get_col_indices, is_filled, read_columns, write_columns
+
+    if "HEADER" in wb.sheetnames:
+        ws = wb["HEADER"]
+        cols = get_col_indices(ws)
+        if "NOMOR AJU" in cols:
+            ws.cell(2, cols["NOMOR AJU"]).value = nomor_aju
+
+    if "ENTITAS" in wb.sheetnames:
+        ws = wb["ENTITAS"]
+        cols = get_col_indices(ws)
+        if "NOMOR AJU" in cols:
+            for r in range(2, ws.max_row + 1):
+                cell = ws.cell(r, cols["NOMOR AJU"])
+                cell.value = None
+                cell.data_type = "s"
+                cell.value = str(nomor_aju)
+
+    for sheet in PROPAGATED_SHEETS:
+        if sheet not in wb.sheetnames:
+            continue
+        ws = wb[sheet]
+        cols = get_col_indices(ws)
+        frame, _ = read_columns(ws, cols, ["NOMOR AJU"])
+        if "NOMOR AJU" in frame:
+            write_columns(ws, cols, {"NOMOR AJU": (nomor_aju, is_filled(frame["NOMOR AJU"]))})
+
+
+def set_header(wb, fields):
+    from scripts.excel_postprocess import format_date, get_col_indices, is_filled, read_columns, write_columns
+
+    ws = wb["HEADER"]
+    cols = get_col_indices(ws)
+    for name, value in fields.items():
+        if name not in cols:
+            raise AmendmentError(f"HEADER has no column '{name}'")
+        if name == "NOMOR AJU":
+            raise AmendmentError("Change NOMOR AJU with serial_number / nomor_aju")
+        if name == "TANGGAL PERNYATAAN":
+            value = format_date(value)
+        ws.cell(2, cols[name]).value = value
+
+    # The statement date is copied to every document line
+    if "TANGGAL PERNYATAAN" in fields and "DOKUMEN" in wb.sheetnames:
+        ws = wb["DOKUMEN"]
+        cols = get_col_indices(ws)
+        frame, _ = read_columns(ws, cols, ["TANGGAL DOKUMEN"])
+        if "TANGGAL DOKUMEN" in frame:
+            tanggal = format_date(fields["TANGGAL PERNYATAAN"])
+            write_columns(ws, cols, {"TANGGAL DOKUMEN": (tanggal, is_filled(frame["TANGGAL DOKUMEN"]))})
+
+
+def set_customer(wb, name, customer_ref_path):
+    """Re-runs the customer (KODE ENTITAS 8) match of process_customs_excel for a new name."""
+    from scripts.excel_postprocess import apply_customer, customer_names, get_col_indices, load_customers
+
+    ws = wb["ENTITAS"]
+    cols = get_col_indices(ws)
+    if "KODE ENTITAS" not in cols or "NAMA ENTITAS" not in cols:
+        raise AmendmentError("ENTITAS has no KODE ENTITAS / NAMA ENTITAS column")
+    rows = [
+        r for r in range(2, ws.max_row + 1)
+        if str(ws.cell(r, cols["KODE ENTITAS"]).value or "").strip() == "8"
+    ]
+    if not rows:
+        raise AmendmentError("ENTITAS has no customer row (KODE ENTITAS 8)")
+
+    df_customers = load_customers(customer_ref_path)
+    ref_names = customer_names(df_customers)
+    matched = None
+    for r in rows:
+        ws.cell(r, cols["NAMA ENTITAS"]).value = name
+        matched = apply_customer(ws, cols, r, name, df_customers, ref_names)
+    if not matched:
+        print(f"   ! Warning: '{name}' is not in the customer list; only NAMA ENTITAS was changed")
+    return matched
+
+
+def set_barang(wb, lines, lookup_hs):
+    """
+    lines: [{"seri": n, column: value, ...}]. lookup_hs(kode_barang, uraian)
+    resolves the HS of a line whose URAIAN / KODE BARANG changed.
+    """
+    from scripts.excel_postprocess import get_col_indices
+
+    ws = wb["BARANG"]
+    cols = get_col_indices(ws)
+    if "SERI BARANG" not in cols:
+        raise AmendmentError("BARANG has no SERI BARANG column")
+    rows = {}
+    for r in range(2, ws.max_row + 1):
+        seri = ws.cell(r, cols["SERI BARANG"]).value
+        if seri not in (None, ""):
+            rows[str(seri).strip()] = r
+
+    for line in lines:
+        fields = dict(line)
+        seri = str(fields.pop("seri", "")).strip()
+        if seri not in rows:
+            raise AmendmentError(f"BARANG has no line with SERI BARANG {seri or '(missing)'}")
+        r = rows[seri]
+        for name, value in fields.items():
+            if name not in cols or name in ("SERI BARANG", "NOMOR AJU"):
+                raise AmendmentError(f"BARANG column '{name}' cannot be amended")
+            ws.cell(r, cols[name]).value = value
+
+        if {"URAIAN", "KODE BARANG"} & fields.keys() and "HS" not in fields and "HS" in cols:
+            kode = ws.cell(r, cols["KODE BARANG"]).value if "KODE BARANG" in cols else None
+            hs = lookup_hs(kode, ws.cell(r, cols["URAIAN"]).value if "URAIAN" in cols else None)
+            if hs is not None:
+                ws.cell(r, cols["HS"]).value = hs
+            else:
+                print(f"   ! Warning: No HS found for BARANG line {seri}; HS left unchanged")
+
+
+class HsLookup:
+    """Material master first, then the HS list; both loaded on first use."""
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.hs_code_ref = resolve(cfg["base_dir"], cfg["data"]["reference"]["hs_code"])
+        self._loaded = False
+
+    def __call__(self, kode_barang, uraian):
+        from scripts.excel_postprocess import load_hs_map
+
+        if not self._loaded:
+            self.material_index = load_material_index(self.cfg, self.cfg["base_dir"], self.hs_code_ref)
+            self.hs_map = load_hs_map(self.hs_code_ref)
+            self._loaded = True
+        if self.material_index is not None:
+            entry = self.material_index.lookup(kode_barang, uraian)
+            if entry and entry.get("hs"):
+                return entry["hs"]
+        return self.hs_map.get(str(uraian or "").strip())
+
+
+def current_nomor_aju(wb):
+    """
+    NOMOR AJU of an archived workbook. ENTITAS keeps it as text; the other
+    sheets may hold it as a number after excel_fix, which loses digits.
+    """
+    from scripts.excel_postprocess import get_col_indices
+
+    for sheet in ("ENTITAS", "HEADER"):
+        if sheet not in wb.sheetnames:
+            continue
+        cols = get_col_indices(wb[sheet])
+        value = wb[sheet].cell(2, cols["NOMOR AJU"]).value if "NOMOR AJU" in cols else None
+        if isinstance(value, str) and value.strip():
+            return value.strip()
+    return None
+
+
+def amend_workbook(source, changes, cfg=None, nomor_aju=None):
+    """
+    Applies `changes` to the workbook at `source` (path or file-like) whose
+    NOMOR AJU is `nomor_aju` (read from the workbook when not given).
+    Returns (filename, bytes, previous NOMOR AJU, new NOMOR AJU).
+    """
+    from openpyxl import load_workbook
+    from scripts.excel_fix import fix_entitas_nomor_aju_to_text
+    from scripts.json_to_excel import output_filename
+
+    cfg = cfg or load_config()
+    known = {"serial_number", "nomor_aju", "header", "customer", "barang"}
+    unknown = set(k for k, v in changes.items() if v not in (None, {}, [])) - known
+    if unknown:
+        raise AmendmentError(f"Unknown change(s): {', '.join(sorted(unknown))}")
+    if changes.get("serial_number") and changes.get("nomor_aju"):
+        raise AmendmentError("Give serial_number or nomor_aju, not both")
+
+    with stage("amend_load"):
+        wb = load_workbook(source)
+    for sheet, key in (("HEADER", "header"), ("ENTITAS", "customer"), ("BARANG", "barang")):
+        if changes.get(key) and sheet not in wb.sheetnames:
+            raise AmendmentError(f"The workbook has no {sheet} sheet")
+
+    previous = nomor_aju or current_nomor_aju(wb)
+
+    with stage("amend_apply"):
+        nomor_aju = previous
+        if changes.get("serial_number"):
+            nomor_aju = renumber(previous, changes["serial_number"])
+        elif changes.get("nomor_aju"):
+            nomor_aju = str(changes["nomor_aju"]).strip()
+        if nomor_aju != previous or changes.get("serial_number") or changes.get("nomor_aju"):
+            # Also rewrites copies excel_fix turned into (rounded) numbers
+            set_nomor_aju(wb, nomor_aju)
+        if changes.get("header"):
+            set_header(wb, changes["header"])
+        if changes.get("customer"):
+            customer_ref = resolve(cfg["base_dir"], cfg["data"]["reference"]["customer_list"])
+            set_customer(wb, changes["customer"], customer_ref)
+        if changes.get("barang"):
+            set_barang(wb, changes["barang"], HsLookup(cfg))
+
+    with stage("excel_fix"):
+        populated = BytesIO()
+        wb.save(populated)
+        populated.seek(0)
+        data = fix_entitas_nomor_aju_to_text(populated, BytesIO()).getvalue()
+    return output_filename(nomor_aju), data, previous, nomor_aju
+
+
+def find_workbook(cfg, job_id=None, nomor_aju=None):
+    """Latest live archived workbook of a job / NOMOR AJU as an index row, or None."""
+    index = get_index(cfg)
+    files = index.find_job(job_id) if job_id else index.find(nomor_aju)
+    files = [
+        f for f in files
+        if f["kind"] == "output" and f["status"] == LIVE and f["path"].endswith(".xlsx") and os.path.exists(f["path"])
+    ]
+    return files[-1] if files else None
+
+
+def check_nomor_aju_free(cfg, nomor_aju, source):
+    """Raises AmendmentConflict when a live workbook other than `source` has this NOMOR AJU."""
+    taken = [
+        f for f in get_index(cfg).find(nomor_aju)
+        if f["kind"] == "output" and f["status"] == LIVE and f["path"] != source and os.path.exists(f["path"])
+    ]
+    if taken:
+        owner = taken[-1]["job_id"] or os.path.basename(taken[-1]["path"])
+        raise AmendmentConflict(f"NOMOR AJU {nomor_aju} is already used by {owner}")
+
+
+def amend(changes, job_id=None, nomor_aju=None, cfg=None, log_path=LOG_PATH):
+    """
+    Amends the archived workbook of job_id / nomor_aju and archives the
+    result. Returns {job_id, nomor_aju, previous_nomor_aju, filename, output, data}.
+    Raises FileNotFoundError when there is no archived workbook and
+    AmendmentConflict when the new NOMOR AJU belongs to another one.
+    """
+    cfg = cfg or load_config()
+    found = find_workbook(cfg, job_id, nomor_aju)
+    if found is None:
+        raise FileNotFoundError(f"No archived workbook for {'job ' + job_id if job_id else nomor_aju}")
+    job_id = job_id or found["job_id"]
+
+    print(f"\n--- Amending {os.path.basename(found['path'])} ---")
+    filename, data, previous, new_nomor_aju = amend_workbook(found["path"], changes, cfg, found["nomor_aju"])
+    if new_nomor_aju != previous:
+        check_nomor_aju_free(cfg, new_nomor_aju, found["path"])
+    if changes.get("serial_number"):
+        from scripts.serials import allocate_serial
+
+        allocate_serial(cfg, changes["serial_number"])  # moves the counter past it
+
+    output_dir = shard_dir(resolve(cfg["base_dir"], cfg["data"]["output"]["final_excel_dir"]), cfg)
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, filename)
+    with stage("archive"):
+        with open(f"{output_path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{output_path}.tmp", output_path)
+    record_files(cfg, {"output": output_path}, new_nomor_aju, job_id)
+    if previous:
+        get_index(cfg).supersede(previous, output_path)
+
+    try:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "job_id": job_id,
+                "source": found["path"],
+                "output": output_path,
+                "previous_nomor_aju": previous,
+                "nomor_aju": new_nomor_aju,
+                "changes": changes,
+            }, ensure_ascii=False, default=str) + "\n")
+    except OSError as e:
+        print(f"   ! Warning: Could not log amendment: {e}")
+
+    print(f"Amendment Complete. Output: {output_path}")
+    return {
+        "job_id": job_id,
+        "nomor_aju": new_nomor_aju,
+        "previous_nomor_aju": previous,
+        "filename": filename,
+        "output": output_path,
+        "data": data,
+    }
+
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+def _value(text):
+    """Numbers as numbers; codes with leading zeros (HS, KODE) stay text."""
+    if text[:1] != "0" or text[:2] == "0." or text == "0":
+        for cast in (int, float):
+            try:
+                return cast(text)
+            except ValueError:
+                pass
+    return text
+
+
+def _pair(text):
+    name, sep, value = text.partition("=")
+    if not sep or not name.strip():
+        raise argparse.ArgumentTypeError(f"expected COLUMN=VALUE, got '{text}'")
+    return name.strip(), _value(value)
+
+
+def _barang(text):
+    seri, sep, rest = text.partition(":")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected SERI:COLUMN=VALUE, got '{text}'")
+    name, value = _pair(rest)
+    return seri.strip(), name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Amend an archived PIB workbook without rerunning the pipeline.")
+    parser.add_argument("nomor_aju", nargs="?", help="NOMOR AJU of the workbook")
+    parser.add_argument("--job", help="job ID instead of a NOMOR AJU")
+    parser.add_argument("--serial", help="new serial number (NOMOR AJU keeps its prefix and date)")
+    parser.add_argument("--new-nomor-aju", help="explicit new NOMOR AJU")
+    parser.add_argument("--header", type=_pair, action="append", default=[], help="COLUMN=VALUE on HEADER")
+    parser.add_argument("--customer", help="new customer name (re-matched against the customer list)")
+    parser.add_argument("--barang", type=_barang, action="append", default=[], help="SERI:COLUMN=VALUE on BARANG")
+    args = parser.parse_args(argv)
+    if not args.nomor_aju and not args.job:
+        parser.error("give a NOMOR AJU or --job")
+
+    lines = {}
+    for seri, name, value in args.barang:
+        lines.setdefault(seri, {"seri": seri})[name] = value
+    changes = {
+        "serial_number": args.serial,
+        "nomor_aju": args.new_nomor_aju,
+        "header": dict(args.header),
+        "customer": args.customer,
+        "barang": list(lines.values()),
+    }
+    try:
+        result = amend(changes, job_id=args.job, nomor_aju=args.nomor_aju)
+    except (AmendmentError, FileNotFoundError) as e:
+        print(f"❌ {e}")
+        return 1
+    print(f"✅ {result['previous_nomor_aju']} → {result['nomor_aju']}: {result['output']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import re
+import sys
+import time
+import uuid
+
+from tqdm import tqdm
+
+from scripts.run_pipeline import load_config, resolve
+from scripts.serials import allocate_serial
+from scripts.staged_pipeline import StagedPipeline
+from scripts.storage import shard_dir
+
+# --------------------------------------------------
+# BATCH DRIVER
+# --------------------------------------------------
+# Processes every invoice / packing-list pair under a directory tree on the
+# staged pipeline (scripts/staged_pipeline.py): Gemini extractions run in
+# I/O threads while earlier pairs are built into workbooks by CPU processes.
+#
+#   python -m scripts.batch data/input/2026-01 --io-workers 8 --cpu-workers 4
+#
+# Pairs are matched per folder by the text after the INV / PL prefix
+# ("INV SID0276864 ….pdf" ↔ "PL SID0276864 ….pdf"); a folder holding exactly
+# one invoice and one packing list is paired regardless of names.
+#
+# Progress is appended to a checkpoint file (default: .batch_checkpoint.jsonl
+# in the input directory). Re-running the same command skips finished pairs
+# and re-uses the serial already given to a pair that was interrupted.
+# Serials come from the shared counter (scripts/serials.py) when a pair
+# reaches the Excel stage, so a pair rejected by validation does not use
+# one; pipeline output goes to <checkpoint>.log.
+# Workbooks go to --output-dir, intermediate JSON to today's shard of
+# data/intermediate (both are indexed, see scripts/storage.py).
+
+# The prefix must end at a separator/digit ("PLASTIC.pdf" is not a packing list)
+INVOICE_PREFIX = re.compile(r"^(INV|INVOICE)(?=[\s_\-.\d]|$)[\s_\-.]*", re.IGNORECASE)
+PACKING_PREFIX = re.compile(r"^(PL|PACKING[\s_\-]*LIST)(?=[\s_\-.\d]|$)[\s_\-.]*", re.IGNORECASE)
+
+CHECKPOINT_NAME = ".batch_checkpoint.jsonl"
+
+DONE = "done"
+FAILED = "failed"
+STARTED = "started"
+
+
+# --------------------------------------------------
+# DISCOVERY
+# --------------------------------------------------
+def _pair_key(filename, prefix):
+    stem = os.path.splitext(filename)[0]
+    match = prefix.match(stem)
+    return stem[match.end():].strip().upper() if match else None
+
+
+def discover_pairs(root):
+    """Returns [(key, invoice_path, packing_path)] sorted by key."""
+    pairs = []
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        invoices, packings = {}, {}
+        for name in files:
+            if not name.lower().endswith(".pdf"):
+                continue
+            inv_key = _pair_key(name, INVOICE_PREFIX)
+            pl_key = _pair_key(name, PACKING_PREFIX)
+            if inv_key is not None:
+                invoices[inv_key] = os.path.join(folder, name)
+            elif pl_key is not None:
+                packings[pl_key] = os.path.join(folder, name)
+
+        rel = os.path.relpath(folder, root)
+        if len(invoices) == 1 and len(packings) == 1:
+            (key, invoice), (_, packing) = next(iter(invoices.items())), next(iter(packings.items()))
+            matched = [(key, invoice, packing)]
+        else:
+            matched = [(key, invoices[key], packings[key]) for key in invoices if key in packings]
+            for key in sorted(set(invoices) ^ set(packings)):
+                print(f"   ! Warning: No partner found for '{key}' in {rel}")
+
+        for key, invoice, packing in matched:
+            key = key if rel == "." else f"{rel}/{key}"
+            pairs.append((key, invoice, packing))
+    return sorted(pairs)
+
+
+# --------------------------------------------------
+# CHECKPOINT
+# --------------------------------------------------
+def load_checkpoint(path):
+    """Latest entry per pair key; a torn last line (crash mid-write) is ignored."""
+    state = {}
+    if not os.path.exists(path):
+        return state
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            state[entry["key"]] = entry
+    return state
+
+
+def append_checkpoint(f, key, status, **fields):
+    entry = dict(key=key, status=status, at=time.time(), **fields)
+    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+    return entry
+
+
+# --------------------------------------------------
+# DRIVER
+# --------------------------------------------------
+def checkpoint_allocator(cfg, checkpoint, jobs):
+    """
+    Staged pipeline allocator: the serial of a pair entering the Excel stage
+    (the one from the checkpoint when resuming), recorded as "started" so an
+    interrupted run re-uses it. jobs maps job_id → {key, invoice, packing}.
+    """
+    def allocate(requested, job_id=None):
+        job = jobs[job_id]
+        job["serial"] = requested or allocate_serial(cfg)
+        append_checkpoint(
+            checkpoint, job["key"], STARTED, serial=job["serial"], invoice=job["invoice"], packing=job["packing"]
+        )
+        return job["serial"]
+    return allocate
+
+
+async def _run_pairs(pipeline, pending, state, checkpoint, bar, jobs, counts):
+    async def settle(job, future):
+        try:
+            output = await future
+            append_checkpoint(checkpoint, job["key"], DONE, serial=job.get("serial"), output=output)
+            counts[DONE] += 1
+        except Exception as e:
+            append_checkpoint(checkpoint, job["key"], FAILED, serial=job.get("serial"), error=str(e))
+            counts[FAILED] += 1
+            tqdm.write(f"❌ {job['key']}: {e}", file=sys.stderr)
+        bar.update(1)
+
+    # submit() waits while the extraction queue is full; the serial is
+    # handed out later, by checkpoint_allocator
+    waiters = []
+    for key, invoice, packing in pending:
+        job_id = uuid.uuid4().hex
+        jobs[job_id] = job = {"key": key, "invoice": invoice, "packing": packing}
+        future = await pipeline.submit(invoice, packing, state.get(key, {}).get("serial"), job_id=job_id)
+        waiters.append(asyncio.create_task(settle(job, future)))
+    await asyncio.gather(*waiters)
+
+
+def run_batch(root, io_workers=None, cpu_workers=None, checkpoint_path=None, output_dir=None, retry_failed=True):
+    cfg = load_config()
+    base_dir = cfg["base_dir"]
+    output_dir = output_dir or shard_dir(resolve(base_dir, cfg["data"]["output"]["final_excel_dir"]), cfg)
+    checkpoint_path = checkpoint_path or os.path.join(root, CHECKPOINT_NAME)
+    log_path = f"{os.path.splitext(checkpoint_path)[0]}.log"
+
+    pairs = discover_pairs(root)
+    state = load_checkpoint(checkpoint_path)
+    skip = {DONE} if retry_failed else {DONE, FAILED}
+    pending = [pair for pair in pairs if state.get(pair[0], {}).get("status") not in skip]
+    print(f"--- {len(pairs)} pair(s) found, {len(pairs) - len(pending)} already processed ---")
+
+    counts = {DONE: 0, FAILED: 0}
+    jobs = {}
+
+    async def drive():
+        pipeline = StagedPipeline(
+            cfg, io_workers=io_workers, cpu_workers=cpu_workers, output_dir=output_dir, log_path=log_path,
+            allocate=checkpoint_allocator(cfg, checkpoint, jobs),
+        )
+        async with pipeline:
+            await _run_pairs(pipeline, pending, state, checkpoint, bar, jobs, counts)
+
+    # Keep the pipeline's step-by-step output away from the progress bar
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+            open(log_path, "a", buffering=1, encoding="utf-8") as log, \
+            contextlib.redirect_stdout(log), \
+            tqdm(total=len(pairs), initial=len(pairs) - len(pending), unit="pair", file=sys.stderr) as bar:
+        asyncio.run(drive())
+
+    print(f"✅ {counts[DONE]} processed, {counts[FAILED]} failed (log: {log_path})")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process every invoice / packing-list pair under a directory.")
+    parser.add_argument("input_dir")
+    parser.add_argument("--io-workers", type=int, help="parallel extractions (default: pipeline.io_workers)")
+    parser.add_argument("--cpu-workers", type=int, help="parallel workbook processes (default: pipeline.cpu_workers)")
+    parser.add_argument("--checkpoint", help=f"progress file (default: <input_dir>/{CHECKPOINT_NAME})")
+    parser.add_argument("--output-dir", help="default: data.output.final_excel_dir")
+    parser.add_argument("--skip-failed", action="store_true", help="do not retry pairs that failed before")
+    parser.add_argument("--list", action="store_true", help="only print the discovered pairs")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"not a directory: {args.input_dir}")
+
+    if args.list:
+        for key, invoice, packing in discover_pairs(args.input_dir):
+            print(f"{key}\n    {invoice}\n    {packing}")
+        return 0
+
+    counts = run_batch(
+        args.input_dir,
+        io_workers=args.io_workers,
+        cpu_workers=args.cpu_workers,
+        checkpoint_path=args.checkpoint,
+        output_dir=args.output_dir,
+        retry_failed=not args.skip_failed,
+    )
+    return 1 if counts[FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
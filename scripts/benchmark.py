@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from scripts.synthetic import (
+    make_extraction,
+    make_customer_reference,
+    make_hs_reference,
+    stub_extractor,
+)
+
+# --------------------------------------------------
+# STAGE BENCHMARK (NO GEMINI)
+# --------------------------------------------------
+# Times json_to_excel, process_customs_excel and
+# fix_entitas_nomor_aju_to_text individually and end to end against
+# PIB_TEMPLATE.xlsx, using synthetic payloads and reference files.
+#
+#   python -m scripts.benchmark --barang 200 --repeat 5
+#   python -m scripts.benchmark --save-baseline
+#
+# Every run is appended to state/benchmarks/results.jsonl. A run is flagged
+# as a regression when a stage median exceeds the stored baseline by more
+# than --tolerance (exit code 1).
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+TEMPLATE_PATH = os.path.join(ROOT_DIR, "data", "templates", "PIB_TEMPLATE.xlsx")
+BENCH_DIR = os.path.join(ROOT_DIR, "state", "benchmarks")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results.jsonl")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+STAGES = ["json_to_excel", "process_customs_excel", "excel_fix", "end_to_end"]
+
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def run_benchmark(barang=10, dokumen=3, customers=50, hs_rows=250, repeat=3, template_path=TEMPLATE_PATH):
+    """
+    Runs every stage `repeat` times on a fresh synthetic shipment and returns
+    {stage: [seconds, ...]}. All files live in a temporary directory.
+    """
+    # Imported here so `--help` stays instant
+    from scripts.pdf_to_json import save_to_json
+    from scripts.json_to_excel import json_to_excel
+    from scripts.excel_postprocess import process_customs_excel
+    from scripts.excel_fix import fix_entitas_nomor_aju_to_text
+
+    timings = {name: [] for name in STAGES}
+
+    with tempfile.TemporaryDirectory(prefix="inabata_bench_") as tmp:
+        customer_ref = make_customer_reference(os.path.join(tmp, "customers.xlsx"), customers)
+        hs_ref = make_hs_reference(os.path.join(tmp, "hs.xlsx"), hs_rows, barang)
+        tracker = os.path.join(tmp, "serial_tracker.txt")
+        out_dir = os.path.join(tmp, "output")
+        payload = make_extraction(barang, dokumen, customers)
+        extract = stub_extractor(payload)
+
+        for i in range(repeat):
+            serial = str(1 + i).zfill(4)
+            json_path = save_to_json(extract(), output_dir=os.path.join(tmp, "intermediate"))
+
+            # Individual stages, each on its own copy of the previous output
+            seconds, populated = _timed(
+                json_to_excel, json_path, template_path,
+                user_serial=serial, output_dir=out_dir, tracker_path=tracker,
+            )
+            timings["json_to_excel"].append(seconds)
+
+            post = os.path.join(tmp, f"post_{i}.xlsx")
+            shutil.copyfile(populated, post)
+            seconds, _ = _timed(process_customs_excel, post, customer_ref, hs_ref)
+            timings["process_customs_excel"].append(seconds)
+
+            fixed = os.path.join(tmp, f"fix_{i}.xlsx")
+            shutil.copyfile(post, fixed)
+            seconds, _ = _timed(fix_entitas_nomor_aju_to_text, fixed)
+            timings["excel_fix"].append(seconds)
+
+            # End to end, same order as run_custom_pipeline with the stub extractor
+            started = time.perf_counter()
+            data = extract()
+            e2e_json = save_to_json(data, output_dir=os.path.join(tmp, "intermediate"))
+            e2e_xlsx = json_to_excel(
+                e2e_json, template_path,
+                user_serial=serial, output_dir=os.path.join(tmp, "e2e"), tracker_path=tracker,
+            )
+            e2e_xlsx = process_customs_excel(e2e_xlsx, customer_ref, hs_ref)
+            fix_entitas_nomor_aju_to_text(e2e_xlsx)
+            timings["end_to_end"].append(time.perf_counter() - started)
+
+    return timings
+
+
+def summarize(timings):
+    return {
+        name: {
+            "median": statistics.median(values),
+            "min": min(values),
+            "max": max(values),
+        }
+        for name, values in timings.items()
+        if values
+    }
+
+
+def compare(summary, baseline, tolerance):
+    """Returns a list of (stage, current, baseline) medians above tolerance."""
+    regressions = []
+    for name, stats in summary.items():
+        base = baseline.get("summary", {}).get(name)
+        if not base:
+            continue
+        if stats["median"] > base["median"] * (1 + tolerance):
+            regressions.append((name, stats["median"], base["median"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Excel stages with synthetic shipments.")
+    parser.add_argument("--barang", type=int, default=10, help="BARANG rows per shipment")
+    parser.add_argument("--dokumen", type=int, default=3, help="DOKUMEN rows per shipment")
+    parser.add_argument("--customers", type=int, default=50, help="rows in the customer master")
+    parser.add_argument("--hs-rows", type=int, default=250, help="rows in the HS table")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--results", default=RESULTS_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args(argv)
+
+    params = {
+        "barang": args.barang,
+        "dokumen": args.dokumen,
+        "customers": args.customers,
+        "hs_rows": args.hs_rows,
+        "repeat": args.repeat,
+    }
+    print(f"\n--- Stage Benchmark {params} ---")
+    summary = summarize(run_benchmark(**params))
+
+    for name, stats in summary.items():
+        print(f"   > {name:<22} median {stats['median'] * 1000:9.1f} ms  "
+              f"(min {stats['min'] * 1000:.1f}, max {stats['max'] * 1000:.1f})")
+
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "params": params,
+        "summary": summary,
+    }
+    os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=4)
+        print(f"✅ Baseline saved → {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("   ! No baseline stored yet (run with --save-baseline)")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("params") != params:
+        print(f"   ! Baseline was recorded with different parameters: {baseline.get('params')}")
+
+    regressions = compare(summary, baseline, args.tolerance)
+    for name, current, base in regressions:
+        print(f"❌ REGRESSION {name}: {current * 1000:.1f} ms vs baseline {base * 1000:.1f} ms")
+    if not regressions:
+        print("✅ No regressions against baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,44 +5,43 @@
 
 import os
 import pandas as pd
-from openpyxl import load_workbook
 
-def fix_entitas_nomor_aju_to_text(input_excel):
-    if not os.path.isfile(input_excel):
+# input_excel may be a path or a file-like buffer (in-memory output mode);
+# output_excel defaults to overwriting input_excel and may be a buffer too.
+def fix_entitas_nomor_aju_to_text(input_excel, output_excel=None):
+    if isinstance(input_excel, (str, os.PathLike)) and not os.path.isfile(input_excel):
         raise FileNotFoundError(f"Input file not found: {input_excel}")
 
-    output_excel = input_excel  # overwrite same file
-
-    wb = load_workbook(input_excel)
-    sheet_names = wb.sheetnames
+    if output_excel is None:
+        output_excel = input_excel  # overwrite same file
 
+    # Parse the workbook once; every sheet is read from the same ExcelFile
     sheets = {}
-    for sheet in sheet_names:
-        if sheet == "ENTITAS":
-            # Existing logic for ENTITAS
-            df = pd.read_excel(
-                input_excel,
-                sheet_name=sheet,
-                dtype={
-                    "NOMOR AJU": str,
-                    "NOMOR IDENTITAS": str
-                }
-            )
-        elif sheet == "HEADER":
-            # FIX: Use converters to force Column C (index 2) and F (index 5) to str
-            # This preserves '050900' as '050900'
-            df = pd.read_excel(
-                input_excel,
-                sheet_name=sheet,
-                converters={
-                    2: str,  # Column C
-                    5: str   # Column F
-                }
-            )
-        else:
-            df = pd.read_excel(input_excel, sheet_name=sheet)
-
-        sheets[sheet] = df
+    with pd.ExcelFile(input_excel, engine="openpyxl") as xls:
+        for sheet in xls.sheet_names:
+            if sheet == "ENTITAS":
+                # Existing logic for ENTITAS
+                df = xls.parse(
+                    sheet,
+                    dtype={
+                        "NOMOR AJU": str,
+                        "NOMOR IDENTITAS": str
+                    }
+                )
+            elif sheet == "HEADER":
+                # FIX: Use converters to force Column C (index 2) and F (index 5) to str
+                # This preserves '050900' as '050900'
+                df = xls.parse(
+                    sheet,
+                    converters={
+                        2: str,  # Column C
+                        5: str   # Column F
+                    }
+                )
+            else:
+                df = xls.parse(sheet)
+
+            sheets[sheet] = df
 
     with pd.ExcelWriter(output_excel, engine="xlsxwriter") as writer:
         for sheet, df in sheets.items():
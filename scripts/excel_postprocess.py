@@ -265,13 +265,16 @@
 
     # ---------------------- Modification Date 
 import os
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
 from difflib import get_close_matches
-from itertools import cycle
 from datetime import datetime
 from openpyxl.cell.cell import Cell
 
+from scripts.metrics import CUSTOMER_MATCHES, record_cache
+from scripts.ref_snapshot import snapshot_for
+
 # --------------------------------------------------
 # HELPERS
 # --------------------------------------------------
@@ -295,48 +298,330 @@ def format_date(value):
         return value
 
 
+# --------------------------------------------------
+# COLUMN HELPERS (DOKUMEN / PENGANGKUT / BARANG)
+# --------------------------------------------------
+# These sheets grow with the shipment, so they are read once into column
+# arrays, transformed as whole columns and written back in one pass.
+#
+# openpyxl has no bulk access for a workbook being edited:
+# iter_rows(values_only=True) calls ws.cell() per position, which creates a
+# cell for every empty one, and each Cell.value assignment re-checks the
+# string. So reads look values up in openpyxl's cell store (ws._cells,
+# {(row, col): Cell}; openpyxl is pinned in requirements.txt) and each
+# distinct string is checked once. Creating the cells that get written
+# remains the main cost of the pass. Sheets without a cell store (the
+# export's TableSheet) go through cell() as before.
+
+DOC_CODES = np.array([380, 217, 630], dtype=object)
+
+
+def read_columns(ws, cols, names=None):
+    """
+    Returns ({header: object array of data-row values}, number of data rows)
+    for the requested headers only.
+    """
+    max_row = ws.max_row
+    n_rows = max(max_row - 1, 0)
+    cells = getattr(ws, "_cells", None)
+    frame = {}
+    for name in (names or cols):
+        if name not in cols:
+            continue
+        col = cols[name]
+        values = np.empty(n_rows, dtype=object)
+        if cells is None:
+            values[:] = [ws.cell(r, col).value for r in range(2, max_row + 1)]
+        else:
+            values[:] = [
+                cell.value if (cell := cells.get((r, col))) is not None else None
+                for r in range(2, max_row + 1)
+            ]
+        frame[name] = values
+    return frame, n_rows
+
+
+_truthy = np.frompyfunc(bool, 1, 1)
+
+
+def is_filled(values):
+    """Vectorized `if value:` (None, "" and 0 count as empty)."""
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+    return _truthy(values).astype(bool)
+
+
+def running_seri(mask):
+    """1, 2, 3 ... numbering over the rows selected by mask."""
+    return np.cumsum(mask).astype(object)
+
+
+def write_columns(ws, cols, updates):
+    """
+    Writes {header: (values, mask)} back to ws. `values` is either a scalar
+    broadcast to every masked row or an array aligned with the data rows.
+    """
+    cells = getattr(ws, "_cells", None)
+    strings = {}
+    for name, (values, mask) in updates.items():
+        col = cols[name]
+        rows = (np.flatnonzero(mask) + 2).tolist()
+        if np.ndim(values) == 0:
+            picked = [values] * len(rows)
+        else:
+            picked = np.asarray(values, dtype=object)[mask].tolist()
+        for r, value in zip(rows, picked):
+            cell = cells.get((r, col)) if cells is not None else None
+            if cell is None:
+                cell = ws.cell(r, col)
+            if cells is None or type(value) is not str:
+                cell.value = value
+            elif value in strings:
+                cell._value, cell.data_type = strings[value]
+            else:
+                # openpyxl's string checks and type inference, once per string
+                cell.value = value
+                strings[value] = (cell._value, cell.data_type)
+
+
+# The *_updates functions take the column arrays of the headers they read
+# plus `cols` (every header present on the sheet) and return the
+# {header: (values, mask)} changes for write_columns.
+
+def dokumen_updates(frame, cols, n_rows, nomor_aju, tanggal):
+    # Process any non-empty row (frame holds every DOKUMEN column)
+    filled = np.zeros(n_rows, dtype=bool)
+    for values in frame.values():
+        filled |= is_filled(values)
+
+    updates = {}
+    if nomor_aju and "NOMOR AJU" in cols:
+        updates["NOMOR AJU"] = (nomor_aju, filled)
+    if tanggal and "TANGGAL DOKUMEN" in cols:
+        updates["TANGGAL DOKUMEN"] = (tanggal, filled)
+    if "KODE DOKUMEN" in cols:
+        # 380 / 217 / 630 repeating over the non-empty rows
+        codes = DOC_CODES[(running_seri(filled).astype(int) - 1) % len(DOC_CODES)]
+        updates["KODE DOKUMEN"] = (codes, filled)
+    return updates
+
+
+def pengangkut_updates(frame, cols, n_rows, nomor_aju):
+    if "NAMA PENGANGKUT" not in cols:
+        return {}
+    filled = is_filled(frame["NAMA PENGANGKUT"])
+
+    updates = {}
+    if "SERI" in cols:
+        updates["SERI"] = (running_seri(filled), filled)
+    if "NOMOR AJU" in cols and nomor_aju:
+        updates["NOMOR AJU"] = (nomor_aju, filled)
+    if "NOMOR PENGANGKUT" in cols:
+        updates["NOMOR PENGANGKUT"] = ("-", filled)
+    return updates
+
+
+# BARANG column → material master field
+MASTER_FIELDS = {"HS": "hs", "URAIAN": "uraian", "KODE SATUAN": "kode_satuan"}
+
+
+def material_updates(frame, cols, n_rows, filled, material_index, override=False):
+    """
+    Resolves HS, canonical URAIAN and KODE SATUAN from the material master
+    for every known material. Without `override` only empty cells are filled.
+    """
+    kode = frame.get("KODE BARANG", np.full(n_rows, None, dtype=object))
+    entries = np.full(n_rows, None, dtype=object)
+    rows = np.flatnonzero(filled)
+    for r in rows.tolist():
+        entries[r] = material_index.lookup(kode[r], frame["URAIAN"][r])
+    known = np.array([entry is not None for entry in entries], dtype=bool)
+    record_cache("material", True, count=int(known.sum()))
+    record_cache("material", False, count=int((filled & ~known).sum()))
+
+    updates = {}
+    if not known.any():
+        return updates
+    for column, field in MASTER_FIELDS.items():
+        if column not in cols:
+            continue
+        values = np.full(n_rows, None, dtype=object)
+        for r in np.flatnonzero(known).tolist():
+            values[r] = entries[r][field]
+        mask = known & is_filled(values)
+        if not override:
+            mask &= ~is_filled(frame[column])
+        if mask.any():
+            updates[column] = (values, mask)
+    return updates
+
+
+def barang_updates(frame, cols, n_rows, nomor_aju, hs_map, material_index=None, override_master=False):
+    if "URAIAN" not in cols:
+        return {}
+    uraian = frame["URAIAN"]
+    filled = is_filled(uraian)
+
+    updates = {}
+    if "SERI BARANG" in cols:
+        updates["SERI BARANG"] = (running_seri(filled), filled)
+    if nomor_aju and "NOMOR AJU" in cols:
+        updates["NOMOR AJU"] = (nomor_aju, filled)
+
+    # Material master first: known materials never reach the fuzzy HS lookup
+    if material_index is not None:
+        master = material_updates(frame, cols, n_rows, filled, material_index, override_master)
+        frame = dict(frame)
+        for column, (values, mask) in master.items():
+            frame[column] = np.where(mask, values, frame[column])
+        uraian = frame["URAIAN"]
+        updates.update(master)
+
+    # Lookup HS Code if missing
+    if "HS" in cols:
+        needs_hs = filled & ~is_filled(frame["HS"])
+        if needs_hs.any():
+            keys = np.char.strip(uraian[needs_hs].astype(str))
+            # dict.get keeps the reference values' own types (no NaN/float upcast)
+            found = np.array([hs_map.get(key) for key in keys.tolist()], dtype=object)
+            hits = np.array([value is not None for value in found], dtype=bool)
+            record_cache("hs_code", True, count=int(hits.sum()))
+            record_cache("hs_code", False, count=int((~hits).sum()))
+
+            hs_values = np.array(frame["HS"], dtype=object)
+            hs_values[needs_hs] = found
+            hs_mask = updates["HS"][1].copy() if "HS" in updates else np.zeros(n_rows, dtype=bool)
+            hs_mask[np.flatnonzero(needs_hs)[hits]] = True
+            updates["HS"] = (hs_values, hs_mask)
+    return updates
+
+
+# --------------------------------------------------
+# REFERENCES
+# --------------------------------------------------
+# load_* serve the compiled reference snapshot (scripts/ref_snapshot.py)
+# when it covers the file, otherwise parse the spreadsheet with read_*.
+def read_customers(customer_ref_path):
+    df_customers = pd.read_excel(customer_ref_path)
+    df_customers.columns = df_customers.columns.astype(str).str.strip()
+    return df_customers
+
+
+def read_hs_map(hs_code_path):
+    df_hs = pd.read_excel(hs_code_path)
+    return dict(
+        zip(
+            df_hs["URAIAN"].astype(str).str.strip(),
+            df_hs["HS"]
+        )
+    )
+
+
+def read_customer_o2(customer_ref_path):
+    # Cell O2 of the customer list's first sheet (goes to ENTITAS L2)
+    wb_cust_ref = load_workbook(customer_ref_path, data_only=True)
+    try:
+        return wb_cust_ref.active["O2"].value
+    finally:
+        wb_cust_ref.close()
+
+
+def load_customers(customer_ref_path):
+    """
+    Customer list as a DataFrame, or the snapshot's CustomerTable (empty
+    DataFrame when unreadable).
+    """
+    snapshot = snapshot_for("customer_list", customer_ref_path)
+    if snapshot is not None:
+        return snapshot.customers
+    try:
+        return read_customers(customer_ref_path)
+    except Exception as e:
+        print(f"   ! Warning: Could not read Customer Ref: {e}")
+        return pd.DataFrame()
+
+
+def load_hs_map(hs_code_path):
+    """{URAIAN: HS} from the HS code list (empty when unreadable)."""
+    snapshot = snapshot_for("hs_code", hs_code_path)
+    if snapshot is not None:
+        return snapshot.hs_map
+    try:
+        return read_hs_map(hs_code_path)
+    except Exception as e:
+        print(f"   ! Warning: Could not read HS Code Ref: {e}")
+        return {}
+
+
+def load_customer_o2(customer_ref_path):
+    snapshot = snapshot_for("customer_list", customer_ref_path)
+    if snapshot is not None:
+        return snapshot.customer_o2
+    return read_customer_o2(customer_ref_path)
+
+
+def customer_names(customers):
+    """NAMA ENTITAS values to fuzzy-match against."""
+    if isinstance(customers, pd.DataFrame):
+        return customers["NAMA ENTITAS"].dropna().astype(str).tolist() if not customers.empty else []
+    return customers.names
+
+
+def customer_row(customers, name):
+    """First reference row named `name` (a Series, or a dict from the snapshot)."""
+    if isinstance(customers, pd.DataFrame):
+        return customers[customers["NAMA ENTITAS"] == name].iloc[0]
+    return customers.row(name)
+
+
+def apply_customer(ws, cols, r, name, df_customers, ref_names):
+    """
+    Fuzzy-matches a customer name against the customer list and copies the
+    matching reference row into ENTITAS row r. Returns the matched name or None.
+    """
+    match = get_close_matches(str(name), ref_names, n=1, cutoff=0.6)
+    CUSTOMER_MATCHES.inc(result="matched" if match else "unmatched")
+    if not match:
+        return None
+    ref_row = customer_row(df_customers, match[0])
+    for col_name, col_idx in cols.items():
+        if col_name in ref_row:
+            ws.cell(r, col_idx).value = ref_row[col_name]
+    return match[0]
+
+
 # --------------------------------------------------
 # CORE BUSINESS LOGIC
 # --------------------------------------------------
-# We updated the arguments here to match what run_pipeline.py sends
-def process_customs_excel(input_excel_path, customer_ref_path, hs_code_path):
-    
+# We updated the arguments here to match what run_pipeline.py sends.
+# material_index (scripts.material_master) resolves known materials before
+# the HS lookup; override_master lets it replace values Gemini extracted.
+# input_excel_path may also be an openpyxl Workbook (in-memory output mode)
+# or a scripts.export.TableBook: it is updated in place and returned instead
+# of being saved.
+def process_customs_excel(input_excel_path, customer_ref_path, hs_code_path, material_index=None, override_master=False):
+    in_memory = not isinstance(input_excel_path, (str, os.PathLike))
+
     # ---------- VALIDATION ----------
-    print(f"   > Processing: {os.path.basename(input_excel_path)}")
+    print(f"   > Processing: {'workbook in memory' if in_memory else os.path.basename(input_excel_path)}")
     
     # Check if files exist
-    for path, label in [
-        (input_excel_path, "Generated Excel"),
+    checks = [
         (customer_ref_path, "Customer Reference"),
         (hs_code_path, "HS Code Reference"),
-    ]:
+    ]
+    if not in_memory:
+        checks.insert(0, (input_excel_path, "Generated Excel"))
+    for path, label in checks:
         if not os.path.exists(path):
             raise FileNotFoundError(f"{label} file not found → {path}")
 
     # Load the Excel generated in Step 2
-    wb = load_workbook(input_excel_path)
+    wb = input_excel_path if in_memory else load_workbook(input_excel_path)
 
     # ---------- LOAD REFERENCES ----------
-    # Load Customer List
-    try:
-        df_customers = pd.read_excel(customer_ref_path)
-        df_customers.columns = df_customers.columns.astype(str).str.strip()
-    except Exception as e:
-        print(f"   ! Warning: Could not read Customer Ref: {e}")
-        df_customers = pd.DataFrame()
-
-    # Load HS Code List
-    try:
-        df_hs = pd.read_excel(hs_code_path)
-        hs_map = dict(
-            zip(
-                df_hs["URAIAN"].astype(str).str.strip(),
-                df_hs["HS"]
-            )
-        )
-    except Exception as e:
-        print(f"   ! Warning: Could not read HS Code Ref: {e}")
-        hs_map = {}
+    df_customers = load_customers(customer_ref_path)
+    hs_map = load_hs_map(hs_code_path)
 
     header_nomor_aju = None
     header_tanggal_pernyataan = None
@@ -382,10 +667,7 @@ def process_customs_excel(input_excel_path, customer_ref_path, hs_code_path):
         # 1. Custom Logic: Fill L2 from Customer Reference O2
         # We load the reference workbook again with openpyxl to target cell 'O2' precisely
         try:
-            wb_cust_ref = load_workbook(customer_ref_path, data_only=True)
-            ws_cust_ref = wb_cust_ref.active  # Assuming data is on the first/active sheet
-            cust_ref_value = ws_cust_ref["O2"].value
-            wb_cust_ref.close()
+            cust_ref_value = load_customer_o2(customer_ref_path)
 
             # Assign to ENTITAS L2 (Column L, Row 2)
             # Setting .value preserves existing formatting (borders, fonts, etc.)
@@ -396,7 +678,7 @@ def process_customs_excel(input_excel_path, customer_ref_path, hs_code_path):
 
         # 2. Existing Row Processing Logic
         if not df_customers.empty:
-            ref_names = df_customers["NAMA ENTITAS"].dropna().astype(str).tolist()
+            ref_names = customer_names(df_customers)
 
             hardcoded_7 = {
                 "NOMOR IDENTITAS": "0010694040059000000000",
@@ -419,13 +701,7 @@ def process_customs_excel(input_excel_path, customer_ref_path, hs_code_path):
                 if kode == "8":
                     name = ws.cell(r, cols.get("NAMA ENTITAS")).value
                     if name:
-                        # Fuzzy match the customer name
-                        match = get_close_matches(str(name), ref_names, n=1, cutoff=0.6)
-                        if match:
-                            ref_row = df_customers[df_customers["NAMA ENTITAS"] == match[0]].iloc[0]
-                            for col_name, col_idx in cols.items():
-                                if col_name in ref_row.index:
-                                    ws.cell(r, col_idx).value = ref_row[col_name]
+                        apply_customer(ws, cols, r, name, df_customers, ref_names)
 
                 # Logic for Sender (Kode 7)
                 elif kode == "7":
@@ -464,19 +740,8 @@ def process_customs_excel(input_excel_path, customer_ref_path, hs_code_path):
     if "DOKUMEN" in wb.sheetnames:
         ws = wb["DOKUMEN"]
         cols = get_col_indices(ws)
-        doc_cycle = cycle([380, 217, 630])
-
-        for r in range(2, ws.max_row + 1):
-            # Process any non-empty row
-            if any(ws.cell(r, c).value for c in cols.values()):
-                if header_nomor_aju and "NOMOR AJU" in cols:
-                    ws.cell(r, cols["NOMOR AJU"]).value = header_nomor_aju
-
-                if header_tanggal_pernyataan and "TANGGAL DOKUMEN" in cols:
-                    ws.cell(r, cols["TANGGAL DOKUMEN"]).value = header_tanggal_pernyataan
-
-                if "KODE DOKUMEN" in cols:
-                    ws.cell(r, cols["KODE DOKUMEN"]).value = next(doc_cycle)
+        frame, n_rows = read_columns(ws, cols)
+        write_columns(ws, cols, dokumen_updates(frame, cols, n_rows, header_nomor_aju, header_tanggal_pernyataan))
 
     # ---------------------------------------------------------
     # SHEET: PENGANGKUT (NEW)
@@ -484,21 +749,8 @@ def process_customs_excel(input_excel_path, customer_ref_path, hs_code_path):
     if "PENGANGKUT" in wb.sheetnames:
         ws = wb["PENGANGKUT"]
         cols = get_col_indices(ws)
-        counter = 1
-        
-        # Ensure the main column exists to avoid errors
-        if "NAMA PENGANGKUT" in cols:
-            for row in range(2, ws.max_row + 1):
-                nama_pengangkut = ws.cell(row=row, column=cols["NAMA PENGANGKUT"]).value
-                
-                if nama_pengangkut:
-                    if "SERI" in cols:
-                        ws.cell(row=row, column=cols["SERI"]).value = counter
-                        counter += 1
-                    if "NOMOR AJU" in cols and header_nomor_aju:
-                        ws.cell(row=row, column=cols["NOMOR AJU"]).value = header_nomor_aju
-                    if "NOMOR PENGANGKUT" in cols:
-                        ws.cell(row=row, column=cols["NOMOR PENGANGKUT"]).value = "-"
+        frame, n_rows = read_columns(ws, cols, ["NAMA PENGANGKUT"])
+        write_columns(ws, cols, pengangkut_updates(frame, cols, n_rows, header_nomor_aju))
         print("   > Processed PENGANGKUT sheet.")
 
     # ---------------------------------------------------------
@@ -507,29 +759,17 @@ def process_customs_excel(input_excel_path, customer_ref_path, hs_code_path):
     if "BARANG" in wb.sheetnames:
         ws = wb["BARANG"]
         cols = get_col_indices(ws)
-        counter = 1
-
-        for r in range(2, ws.max_row + 1):
-            uraian = ws.cell(r, cols.get("URAIAN")).value
-            if uraian:
-                if "SERI BARANG" in cols:
-                    ws.cell(r, cols["SERI BARANG"]).value = counter
-                    counter += 1
-
-                if header_nomor_aju and "NOMOR AJU" in cols:
-                    ws.cell(r, cols["NOMOR AJU"]).value = header_nomor_aju
-
-                # Lookup HS Code if missing
-                if "HS" in cols: 
-                    current_hs = ws.cell(r, cols["HS"]).value
-                    if not current_hs:
-                        key = str(uraian).strip()
-                        if key in hs_map:
-                            ws.cell(r, cols["HS"]).value = hs_map[key]
+        frame, n_rows = read_columns(ws, cols, ["KODE BARANG", "URAIAN", "HS", "KODE SATUAN"])
+        write_columns(ws, cols, barang_updates(
+            frame, cols, n_rows, header_nomor_aju, hs_map, material_index, override_master
+        ))
 
     # ---------------------------------------------------------
     # SAVE OUTPUT (Overwrite the intermediate file)
     # ---------------------------------------------------------
+    if in_memory:
+        return wb
+
     # We overwrite the input file so the "final" file contains the updates
     wb.save(input_excel_path)
     return input_excel_path
@@ -0,0 +1,307 @@
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sys
+import threading
+import zipfile
+from datetime import date, datetime
+
+from scripts.metrics import stage
+
+# --------------------------------------------------
+# DIRECT CSV / JSON EXPORT
+# --------------------------------------------------
+# Downstream systems that read the shipment data programmatically do not
+# need an .xlsx: building the workbook, the post-process pass over openpyxl
+# cells and the excel_fix pandas round trip are most of the Excel stages'
+# cost. Here the same steps run on plain tables instead:
+#
+#   - the template's HEADER / ENTITAS / DOKUMEN / PENGANGKUT / BARANG cells
+#     are read once per process and copied per job (TableBook)
+#   - assign_nomor_aju, fill_sheet and process_customs_excel run on that copy
+#     unchanged; TableBook answers the part of the openpyxl API they use
+#   - the result is written as JSON or as a zip with one CSV per sheet
+#
+# NOMOR AJU, ENTITAS NOMOR IDENTITAS and the HEADER office codes (columns C
+# and F) are always emitted as text, like excel_fix does for the workbook,
+# so '050900' and 26-digit NOMOR AJU values survive. Empty rows are dropped.
+# Headers the template repeats (HEADER ASURANSI, KODE GUDANG ASAL/TUJUAN)
+# are named ASURANSI, ASURANSI.1 ... as in the workbook.
+#
+# JSON: {"nomor_aju": ..., "sheets": {"HEADER": {"columns": [...], "rows": [[...]]}, ...}}
+# CSV:  <NOMOR AJU>.zip holding HEADER.csv, ENTITAS.csv, ... (UTF-8, header row first)
+#
+# Usage: python -m scripts.export data/intermediate/<file>.json --format csv --serial 512
+
+EXPORT_SHEETS = ["HEADER", "ENTITAS", "DOKUMEN", "PENGANGKUT", "BARANG"]
+FORMATS = ("json", "csv")
+MEDIA_TYPES = {"json": "application/json", "csv": "application/zip"}
+
+# Columns kept as text, by sheet: header names, and (HEADER) 0-based positions
+TEXT_COLUMNS = {
+    "ENTITAS": {"NOMOR AJU", "NOMOR IDENTITAS"},
+}
+TEXT_POSITIONS = {
+    "HEADER": {2, 5},
+}
+
+
+class TableCell:
+    __slots__ = ("value", "data_type")
+
+    def __init__(self, value=None):
+        self.value = value
+        self.data_type = "n"
+
+
+class TableSheet:
+    """Rows of TableCell; grows on write like an openpyxl worksheet."""
+
+    def __init__(self, title, rows):
+        self.title = title
+        self._rows = [[TableCell(v) for v in row] for row in rows]
+        self._max_column = max((len(row) for row in rows), default=0)
+
+    @property
+    def max_row(self):
+        return len(self._rows)
+
+    @property
+    def max_column(self):
+        return self._max_column
+
+    def cell(self, row, column):
+        while len(self._rows) < row:
+            self._rows.append([])
+        cells = self._rows[row - 1]
+        while len(cells) < column:
+            cells.append(TableCell())
+        self._max_column = max(self._max_column, column)
+        return cells[column - 1]
+
+    def __getitem__(self, coordinate):
+        from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+        letters, row = coordinate_from_string(coordinate)
+        return self.cell(row, column_index_from_string(letters))
+
+    def values(self):
+        width = self._max_column
+        for cells in self._rows:
+            row = [c.value for c in cells]
+            yield row + [None] * (width - len(row))
+
+
+class TableBook:
+    def __init__(self, sheets):
+        self._sheets = {name: TableSheet(name, rows) for name, rows in sheets.items()}
+
+    @property
+    def sheetnames(self):
+        return list(self._sheets)
+
+    def __getitem__(self, name):
+        return self._sheets[name]
+
+
+_snapshots = {}
+_snapshot_lock = threading.Lock()
+
+
+def template_snapshot(template_path):
+    """The export sheets' cell values, read from the template once per process."""
+    key = (template_path, os.path.getmtime(template_path))
+    with _snapshot_lock:
+        if key not in _snapshots:
+            from openpyxl import load_workbook
+
+            with stage("template_load"):
+                wb = load_workbook(template_path, read_only=True)
+                _snapshots[key] = {
+                    name: [list(row) for row in wb[name].iter_rows(values_only=True)]
+                    for name in EXPORT_SHEETS
+                    if name in wb.sheetnames
+                }
+                wb.close()
+        return _snapshots[key]
+
+
+def new_table_book(template_path):
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"Template not found → {template_path}")
+    return TableBook(template_snapshot(template_path))
+
+
+# --------------------------------------------------
+# VALUE NORMALISATION
+# --------------------------------------------------
+def plain_value(value):
+    """JSON/CSV-safe python value: numpy scalars unwrapped, NaN → None, dates as ISO text."""
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, datetime) and value == datetime.combine(value.date(), datetime.min.time()):
+        return value.date().isoformat()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def as_text(value):
+    if value is None or value == "":
+        return value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def unique_columns(columns):
+    """
+    Repeated headers get .1, .2 ... like pandas gives them in the workbook
+    (excel_fix reads and rewrites every sheet), e.g. HEADER ASURANSI.1.
+    """
+    seen, result = set(), []
+    for name in columns:
+        unique, n = name, 0
+        while unique in seen:
+            n += 1
+            unique = f"{name}.{n}"
+        seen.add(unique)
+        result.append(unique)
+    return result
+
+
+def sheet_table(ws):
+    rows = list(ws.values())
+    if not rows:
+        return {"columns": [], "rows": []}
+    header = rows[0]
+    while header and header[-1] is None:
+        header = header[:-1]
+    width = len(header)
+    columns = [str(h).strip() if h is not None else "" for h in header]
+
+    text_idx = set(TEXT_POSITIONS.get(ws.title, ()))
+    text_idx |= {i for i, name in enumerate(columns) if name in TEXT_COLUMNS.get(ws.title, ()) or name == "NOMOR AJU"}
+    columns = unique_columns(columns)
+
+    data = []
+    for row in rows[1:]:
+        values = [plain_value(v) for v in row[:width]]
+        if all(v is None or v == "" for v in values):
+            continue
+        for i in text_idx:
+            values[i] = as_text(values[i])
+        data.append(values)
+    return {"columns": columns, "rows": data}
+
+
+# --------------------------------------------------
+# BUILD
+# --------------------------------------------------
+def export_tables(wb):
+    return {name: sheet_table(wb[name]) for name in EXPORT_SHEETS if name in wb.sheetnames}
+
+
+def export_filename(nomor_aju, fmt):
+    from scripts.json_to_excel import output_filename
+
+    return os.path.splitext(output_filename(nomor_aju))[0] + (".json" if fmt == "json" else ".zip")
+
+
+def serialize(tables, nomor_aju, fmt):
+    if fmt == "json":
+        payload = {"nomor_aju": nomor_aju, "sheets": tables}
+        return json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, table in tables.items():
+            text = io.StringIO()
+            writer = csv.writer(text)
+            writer.writerow(table["columns"])
+            writer.writerows(["" if v is None else v for v in row] for row in table["rows"])
+            zf.writestr(f"{name}.csv", text.getvalue())
+    return buffer.getvalue()
+
+
+def build_export(cfg, extracted, tracker_path, fmt, serial_number=None, nomor_aju=None):
+    """
+    Steps 2-3 of the pipeline on plain tables. Returns (filename, bytes) with
+    filename <NOMOR AJU>.json or <NOMOR AJU>.zip.
+    """
+    from scripts.json_to_excel import assign_nomor_aju, fill_sheet
+    from scripts.excel_postprocess import process_customs_excel
+    from scripts.run_pipeline import excel_references
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}' (expected one of {', '.join(FORMATS)})")
+
+    template, customer_ref, hs_code_ref, material_index, override_master = excel_references(cfg)
+
+    print(f"...Running Step 2: Populating tables ({fmt} export)")
+    with stage("template_fill"):
+        wb = new_table_book(template)
+        generated_nomor_aju = assign_nomor_aju(wb, serial_number, tracker_path, nomor_aju)
+        for sheet_name, content in extracted.items():
+            fill_sheet(wb, sheet_name, content)
+
+    print("...Running Step 3: Post-Processing")
+    with stage("postprocess"):
+        process_customs_excel(
+            wb,
+            customer_ref,
+            hs_code_ref,
+            material_index=material_index,
+            override_master=override_master,
+        )
+
+    print("...Running Step 4: Export")
+    with stage("export"):
+        data = serialize(export_tables(wb), generated_nomor_aju, fmt)
+    return export_filename(generated_nomor_aju, fmt), data
+
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export an extraction as per-sheet JSON or CSV (no workbook).")
+    parser.add_argument("json_path", help="Intermediate extraction JSON (data/intermediate/...)")
+    parser.add_argument("--format", choices=FORMATS, default="json")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--nomor-aju", help="Use this NOMOR AJU verbatim")
+    group.add_argument("--serial", type=int, help="Build the NOMOR AJU from this serial (tracker is not advanced)")
+    parser.add_argument("-o", "--output", help="Output file (default: ./<NOMOR AJU>.json|.zip)")
+    args = parser.parse_args(argv)
+
+    from scripts.run_pipeline import load_config
+
+    try:
+        with open(args.json_path, "r", encoding="utf-8") as f:
+            extracted = json.load(f)
+        # Scratch tracker: an export from the CLI never moves the real serial
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename, data = build_export(
+                load_config(), extracted, os.path.join(tmp, "serial_tracker.txt"), args.format,
+                serial_number=args.serial, nomor_aju=args.nomor_aju,
+            )
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+
+    output = args.output or filename
+    with open(output, "wb") as f:
+        f.write(data)
+    print(f"✅ Wrote {output} ({len(data)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,350 @@
+import argparse
+import asyncio
+import glob
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from scripts.synthetic import make_extraction
+
+# --------------------------------------------------
+# STAND-IN GEMINI SERVER (LOAD TESTS)
+# --------------------------------------------------
+# Speaks just enough of the Gemini REST API for google-genai:
+#   POST /upload/v1beta/files                      Files API (resumable upload)
+#   POST /v1beta/models/<model>:generateContent    returns an extraction payload
+#   POST /v1beta/models/<model>:streamGenerateContent?alt=sse
+#                                                  same payload in chunks, spread
+#                                                  over the sampled latency
+#   POST/GET/PATCH/DELETE /v1beta/cachedContents    context cache (prompt cache)
+# Payloads are recorded extractions (--payloads: JSON files or directories,
+# e.g. data/intermediate) or synthetic ones (scripts.synthetic). Latency is
+# drawn from a configurable distribution and a share of generateContent
+# calls fails with 429 / 500 / 503, like the real service under load.
+#
+#   python -m scripts.fake_gemini --port 8090 --latency lognormal:8:0.4 --error-rate 0.02
+#   GEMINI_BASE_URL=http://127.0.0.1:8090 GEMINI_API_KEY=fake uvicorn main:app
+#   python -m scripts.loadtest http://127.0.0.1:8000 --concurrency 1,2,4,8
+#
+# Requests limited to some sheets (fan-out extraction, "Return ONLY the
+# following sheets: ...") get only those sheets back. --output-rate adds
+# len(text) / rate seconds, so shorter answers come back sooner, as they do
+# from the real model.
+#
+# Cached contents live for their ttl; generate calls naming an unknown or
+# expired one get 404. --min-cache-tokens refuses smaller contents (400),
+# as the real service does below the model's minimum.
+#
+# GET /_stats returns the calls served so far.
+
+SCOPE_PATTERN = re.compile(r"Return ONLY the following sheets: ([A-Z, ]+)\.")
+
+ERRORS = [
+    (429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)."),
+    (500, "INTERNAL", "An internal error has occurred."),
+    (503, "UNAVAILABLE", "The model is overloaded. Please try again later."),
+]
+
+
+class Latency:
+    """
+    Seconds per call from a spec string:
+      fixed:S | uniform:MIN:MAX | normal:MEAN:STDDEV | lognormal:MEDIAN:SIGMA
+    """
+
+    KINDS = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+
+    def __init__(self, spec, rng=None):
+        kind, *params = spec.split(":")
+        if kind not in self.KINDS or len(params) != self.KINDS[kind]:
+            raise ValueError(f"invalid latency spec '{spec}' (e.g. fixed:2, uniform:1:3, lognormal:8:0.4)")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        self.rng = rng or random.Random()
+
+    def sample(self):
+        if self.kind == "fixed":
+            value = self.params[0]
+        elif self.kind == "uniform":
+            value = self.rng.uniform(*self.params)
+        elif self.kind == "normal":
+            value = self.rng.gauss(*self.params)
+        else:
+            median, sigma = self.params
+            value = self.rng.lognormvariate(0, sigma) * median
+        return max(0.0, value)
+
+
+def load_payloads(paths):
+    """Extraction payloads from JSON files / directories of JSON files (searched recursively)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.json"), recursive=True)))
+        else:
+            files.append(path)
+    payloads = []
+    for path in files:
+        if path.endswith(".validation.json"):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict) and "BARANG" in data:
+            payloads.append(data)
+    return payloads
+
+
+def requested_sheets(body):
+    """Sheet names of a scoped (fan-out) request, or None for all sheets."""
+    match = SCOPE_PATTERN.search(body.decode("utf-8", errors="replace"))
+    return [name.strip() for name in match.group(1).split(",")] if match else None
+
+
+def create_app(latency="fixed:0", upload_latency="fixed:0", error_rate=0.0, payloads=None, barang=10, seed=None,
+               chunk_chars=400, output_rate=0.0, min_cache_tokens=0):
+    from fastapi import FastAPI, Request, Response
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    rng = random.Random(seed)
+    generate_latency = Latency(latency, rng)
+    upload_latency = Latency(upload_latency, rng)
+    payloads = payloads or [make_extraction(barang)]
+    next_payload = itertools.cycle(payloads).__next__
+
+    lock = threading.Lock()
+    stats = {"uploads": 0, "generate": 0, "errors": 0, "cache_creates": 0, "cache_updates": 0, "cached_generate": 0}
+    uploads = {}  # upload_id → file metadata
+    caches = {}   # name → {"model", "displayName", "tokens", "expires_at"}
+
+    def count(key):
+        with lock:
+            stats[key] += 1
+
+    def maybe_fail():
+        if error_rate and rng.random() < error_rate:
+            code, status, message = rng.choice(ERRORS)
+            count("errors")
+            return JSONResponse({"error": {"code": code, "message": message, "status": status}}, status_code=code)
+        return None
+
+    app = FastAPI(title="Gemini stand-in")
+
+    @app.post("/upload/v1beta/files")
+    async def upload(request: Request):
+        command = request.headers.get("x-goog-upload-command", "")
+        base = str(request.base_url).rstrip("/")
+
+        if command == "start":
+            body = await request.json()
+            upload_id = uuid.uuid4().hex[:16]
+            uploads[upload_id] = (body.get("file") or {})
+            return Response(
+                content="{}",
+                media_type="application/json",
+                headers={"X-Goog-Upload-URL": f"{base}/upload/v1beta/files?upload_id={upload_id}"},
+            )
+
+        upload_id = request.query_params.get("upload_id")
+        data = await request.body()
+        if upload_id not in uploads:
+            return JSONResponse({"error": {"code": 404, "message": "Unknown upload", "status": "NOT_FOUND"}}, status_code=404)
+        if "finalize" not in command:
+            return Response(content="", headers={"X-Goog-Upload-Status": "active"})
+
+        await asyncio.sleep(upload_latency.sample())
+        meta = uploads.pop(upload_id)
+        count("uploads")
+        name = f"files/{upload_id}"
+        file = {
+            "name": name,
+            "mimeType": meta.get("mimeType", "application/pdf"),
+            "sizeBytes": str(len(data)),
+            "uri": f"{base}/v1beta/{name}",
+            "state": "ACTIVE",
+        }
+        return JSONResponse({"file": file}, headers={"X-Goog-Upload-Status": "final"})
+
+    def not_found(message):
+        return JSONResponse({"error": {"code": 404, "message": message, "status": "NOT_FOUND"}}, status_code=404)
+
+    def ttl_seconds(body):
+        return float(str(body.get("ttl") or "3600s").rstrip("s"))
+
+    def cache_resource(name):
+        entry = caches[name]
+        expire = datetime.fromtimestamp(entry["expires_at"], timezone.utc)
+        return {
+            "name": name,
+            "model": entry["model"],
+            "displayName": entry["displayName"],
+            "expireTime": expire.isoformat().replace("+00:00", "Z"),
+            "usageMetadata": {"totalTokenCount": entry["tokens"]},
+        }
+
+    def live_cache(name):
+        entry = caches.get(name)
+        if entry and entry["expires_at"] <= time.time():
+            caches.pop(name, None)
+            entry = None
+        return entry
+
+    @app.post("/v1beta/cachedContents")
+    async def create_cache(request: Request):
+        body = await request.json()
+        tokens = len(json.dumps(body.get("contents") or [], ensure_ascii=False)) // 4
+        if tokens < min_cache_tokens:
+            message = f"Cached content is too small. total_token_count={tokens}, min_total_token_count={min_cache_tokens}"
+            return JSONResponse({"error": {"code": 400, "message": message, "status": "INVALID_ARGUMENT"}}, status_code=400)
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        caches[name] = {
+            "model": body.get("model", ""),
+            "displayName": body.get("displayName", ""),
+            "tokens": tokens,
+            "expires_at": time.time() + ttl_seconds(body),
+        }
+        count("cache_creates")
+        return cache_resource(name)
+
+    @app.get("/v1beta/cachedContents/{cache_id}")
+    def get_cache(cache_id: str):
+        name = f"cachedContents/{cache_id}"
+        return cache_resource(name) if live_cache(name) else not_found(f"{name} not found")
+
+    @app.patch("/v1beta/cachedContents/{cache_id}")
+    async def update_cache(cache_id: str, request: Request):
+        name = f"cachedContents/{cache_id}"
+        entry = live_cache(name)
+        if not entry:
+            return not_found(f"{name} not found")
+        entry["expires_at"] = time.time() + ttl_seconds(await request.json())
+        count("cache_updates")
+        return cache_resource(name)
+
+    @app.delete("/v1beta/cachedContents/{cache_id}")
+    def delete_cache(cache_id: str):
+        caches.pop(f"cachedContents/{cache_id}", None)
+        return {}
+
+    def response_body(model, text, final=True, total_chars=None, cached_tokens=0):
+        body = {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "index": 0,
+            }],
+            "modelVersion": model,
+        }
+        if final:
+            output_tokens = (total_chars or len(text)) // 4
+            body["candidates"][0]["finishReason"] = "STOP"
+            body["usageMetadata"] = {
+                "promptTokenCount": 2600,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": 2600 + output_tokens,
+            }
+            if cached_tokens:
+                body["usageMetadata"]["cachedContentTokenCount"] = cached_tokens
+        return body
+
+    @app.post("/v1beta/models/{model_action}")
+    async def generate(model_action: str, request: Request):
+        model, _, action = model_action.partition(":")
+        if action not in ("generateContent", "streamGenerateContent"):
+            return JSONResponse({"error": {"code": 404, "message": f"Unsupported: {action}", "status": "NOT_FOUND"}}, status_code=404)
+        body = await request.body()
+        cached_name = json.loads(body or b"{}").get("cachedContent")
+        cached_tokens = 0
+        if cached_name:
+            entry = live_cache(cached_name)
+            if not entry:
+                return not_found(f"CachedContent not found (or permission denied): {cached_name}")
+            cached_tokens = entry["tokens"]
+            count("cached_generate")
+        payload = next_payload()
+        sheets = requested_sheets(body)
+        if sheets is not None:
+            payload = {name: rows for name, rows in payload.items() if name in sheets}
+        text = json.dumps(payload, ensure_ascii=False)
+        seconds = generate_latency.sample() + (len(text) / output_rate if output_rate else 0.0)
+
+        if action == "generateContent":
+            await asyncio.sleep(seconds)
+            failure = maybe_fail()
+            if failure is not None:
+                return failure
+            count("generate")
+            return response_body(model, text, cached_tokens=cached_tokens)
+
+        # Streaming: failures happen before the first chunk, the chunks are
+        # spread evenly over the sampled latency
+        failure = maybe_fail()
+        if failure is not None:
+            await asyncio.sleep(seconds * rng.random())
+            return failure
+        count("generate")
+        chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+
+        async def events():
+            for n, chunk in enumerate(chunks):
+                await asyncio.sleep(seconds / len(chunks))
+                body = response_body(model, chunk, final=n == len(chunks) - 1, total_chars=len(text),
+                                     cached_tokens=cached_tokens)
+                yield f"data: {json.dumps(body, ensure_ascii=False)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/_stats")
+    def get_stats():
+        with lock:
+            return dict(stats, latency=generate_latency.spec, error_rate=error_rate, payloads=len(payloads),
+                        caches=len(caches))
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini Files / generateContent API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", default="lognormal:8:0.4", help="generateContent latency (default lognormal:8:0.4)")
+    parser.add_argument("--upload-latency", default="uniform:0.2:0.6", help="Files upload latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of generateContent calls that fail (0-1)")
+    parser.add_argument("--payloads", nargs="+", default=[], help="recorded extraction JSON files or directories")
+    parser.add_argument("--barang", type=int, default=10, help="BARANG rows of the synthetic payload")
+    parser.add_argument("--chunk-chars", type=int, default=400, help="text per streamed chunk")
+    parser.add_argument("--output-rate", type=float, default=0.0,
+                        help="generated characters per second added to the latency (0 = off)")
+    parser.add_argument("--min-cache-tokens", type=int, default=0,
+                        help="refuse cached contents smaller than this (0 = accept all)")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    try:
+        payloads = load_payloads(args.payloads)
+        app = create_app(
+            args.latency, args.upload_latency, args.error_rate, payloads, args.barang, args.seed,
+            chunk_chars=max(1, args.chunk_chars), output_rate=max(0.0, args.output_rate),
+            min_cache_tokens=max(0, args.min_cache_tokens),
+        )
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+    if args.payloads and not payloads:
+        parser.error("no extraction payloads found in --payloads")
+    print(f"--- Gemini stand-in on http://{args.host}:{args.port} "
+          f"(latency {args.latency}, error rate {args.error_rate}, "
+          f"{len(payloads) or 'synthetic'} payload(s)) ---")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
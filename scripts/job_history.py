@@ -0,0 +1,132 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# --------------------------------------------------
+# SHIPMENT HISTORY
+# --------------------------------------------------
+# Every successful pipeline run records its extraction payload together with
+# the NOMOR AJU it was given. scripts.replay rebuilds workbooks from these
+# records (new template / reference files) without calling Gemini again.
+#
+# Like the queue database, put `history.path` on storage every node can
+# lock when workers run on several machines.
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_DB_PATH = os.path.join(ROOT_DIR, "state", "job_history.sqlite")
+
+# Fields returned by select(); the payload is only loaded when asked for
+SUMMARY_FIELDS = [
+    "job_id", "processed_date", "nomor_aju", "serial_number", "customer",
+    "output_name", "created_at", "replayed_at",
+]
+
+
+def customer_name(extraction):
+    """NAMA ENTITAS of the first ENTITAS row (the importer the LLM extracted)."""
+    try:
+        content = extraction.get("ENTITAS") or []
+        headers = [str(h).strip() for h in content[0]]
+        value = content[1][headers.index("NAMA ENTITAS")]
+        return str(value).strip() if value else None
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class JobHistory:
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS shipments (
+                    job_id         TEXT PRIMARY KEY,
+                    processed_date TEXT NOT NULL,
+                    nomor_aju      TEXT,
+                    serial_number  TEXT,
+                    customer       TEXT,
+                    output_name    TEXT,
+                    extraction     TEXT NOT NULL,
+                    created_at     REAL NOT NULL,
+                    replayed_at    REAL
+                );
+                CREATE INDEX IF NOT EXISTS shipments_date ON shipments (processed_date);
+                CREATE INDEX IF NOT EXISTS shipments_nomor_aju ON shipments (nomor_aju);
+            """)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout = 30000")
+            self._local.conn = conn
+        return conn
+
+    def record(self, job_id, extraction, nomor_aju, serial_number=None, output_name=None):
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO shipments (job_id, processed_date, nomor_aju, serial_number, "
+            "customer, output_name, extraction, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job_id,
+                datetime.fromtimestamp(now).strftime("%Y-%m-%d"),
+                nomor_aju,
+                str(serial_number) if serial_number else None,
+                customer_name(extraction),
+                output_name,
+                json.dumps(extraction, ensure_ascii=False),
+                now,
+            ),
+        )
+
+    def select(self, date_from=None, date_to=None, customer=None, nomor_aju=None, job_ids=None,
+               with_extraction=False):
+        """
+        Records matching every given filter. Dates are inclusive YYYY-MM-DD,
+        customer is a case-insensitive substring of NAMA ENTITAS, nomor_aju
+        and job_ids are lists of exact values.
+        """
+        clauses, params = [], []
+        if date_from:
+            clauses.append("processed_date >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("processed_date <= ?")
+            params.append(date_to)
+        if customer:
+            clauses.append("customer LIKE ?")
+            params.append(f"%{customer.strip()}%")
+        for column, values in (("nomor_aju", nomor_aju), ("job_id", job_ids)):
+            if values:
+                clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(str(v).strip() for v in values)
+
+        fields = SUMMARY_FIELDS + (["extraction"] if with_extraction else [])
+        sql = f"SELECT {', '.join(fields)} FROM shipments"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        rows = self._connect().execute(sql + " ORDER BY created_at", params).fetchall()
+
+        records = [dict(row) for row in rows]
+        if with_extraction:
+            for record in records:
+                record["extraction"] = json.loads(record["extraction"])
+        return records
+
+    def mark_replayed(self, job_id):
+        self._connect().execute(
+            "UPDATE shipments SET replayed_at = ? WHERE job_id = ?", (time.time(), job_id)
+        )
+
+
+def get_history(cfg):
+    """Opens the database configured under `history:` in config.yaml."""
+    path = ((cfg or {}).get("history") or {}).get("path") or DEFAULT_DB_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(ROOT_DIR, path)
+    return JobHistory(path)
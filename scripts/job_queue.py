@@ -0,0 +1,398 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# --------------------------------------------------
+# SHARED JOB QUEUE
+# --------------------------------------------------
+# API nodes enqueue shipments (both PDFs travel inside the job), stateless
+# workers on any machine claim them, run the pipeline in a scratch
+# directory and publish the finished workbook back into the queue.
+#
+# Backends (config.yaml → queue.backend):
+#   sqlite → one database file; put it on storage every node can lock
+#   redis  → any Redis-compatible server (needs the optional `redis` package)
+#
+# The backend also holds the NOMOR AJU serial counter of every entry point
+# (scripts/serials.py), so nodes never read or write a local
+# state/serial_tracker.txt. A queued job only carries the serial the client
+# asked for; the worker allocates one when the job reaches the Excel stage.
+#
+# A worker heartbeats its running job (heartbeat_at); requeue_stale() only
+# takes back jobs whose heartbeat stopped, however long they have run.
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_DB_PATH = os.path.join(ROOT_DIR, "state", "job_queue.sqlite")
+DEFAULT_SERIAL_FILE = os.path.join(ROOT_DIR, "state", "serial_tracker.txt")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Fields returned by status(); blobs are fetched separately
+STATUS_FIELDS = [
+    "job_id", "status", "stage", "serial_number", "invoice_name", "packing_name",
+    "result_name", "error", "worker", "attempts", "created_at", "started_at", "heartbeat_at", "finished_at",
+]
+
+
+def _initial_serial(serial_file=DEFAULT_SERIAL_FILE):
+    """Seeds the shared counter from the legacy tracker file (default 0888)."""
+    if os.path.exists(serial_file):
+        with open(serial_file, "r") as f:
+            content = f.read().strip()
+            if content.isdigit():
+                return int(content)
+    return 888
+
+
+class SQLiteQueue:
+    def __init__(self, path=DEFAULT_DB_PATH, serial_file=DEFAULT_SERIAL_FILE):
+        self.path = path
+        self.serial_file = serial_file
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id        TEXT PRIMARY KEY,
+                    status        TEXT NOT NULL,
+                    stage         TEXT,
+                    serial_number TEXT,
+                    invoice_name  TEXT,
+                    invoice_pdf   BLOB,
+                    packing_name  TEXT,
+                    packing_pdf   BLOB,
+                    result_name   TEXT,
+                    result        BLOB,
+                    error         TEXT,
+                    worker        TEXT,
+                    attempts      INTEGER NOT NULL DEFAULT 0,
+                    options       TEXT,
+                    created_at    REAL NOT NULL,
+                    started_at    REAL,
+                    heartbeat_at  REAL,
+                    finished_at   REAL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+                CREATE TABLE IF NOT EXISTS counters (
+                    name  TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+            # Databases created before heartbeats
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "heartbeat_at" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout = 30000")
+            self._local.conn = conn
+        return conn
+
+    # ---------- Serials ----------
+    def allocate_serial(self, requested=None):
+        """
+        Returns the serial for a new job as a 4-digit string. A numeric
+        requested serial is used as-is and moves the counter past it, as
+        the old state/serial_tracker.txt did.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM counters WHERE name = 'serial'").fetchone()
+            current = row["value"] if row else _initial_serial(self.serial_file)
+            if requested and str(requested).strip().isdigit():
+                serial = int(requested)
+            elif requested:
+                # Non-numeric serials are passed through untouched
+                conn.execute("COMMIT")
+                return str(requested).strip()
+            else:
+                serial = current
+            conn.execute(
+                "INSERT INTO counters (name, value) VALUES ('serial', ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (serial + 1,),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return str(serial).zfill(4)
+
+    def peek_serial(self):
+        row = self._connect().execute("SELECT value FROM counters WHERE name = 'serial'").fetchone()
+        return str(row["value"] if row else _initial_serial(self.serial_file)).zfill(4)
+
+    def set_serial(self, value):
+        """The next allocate_serial() returns `value`."""
+        self._connect().execute(
+            "INSERT INTO counters (name, value) VALUES ('serial', ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (int(value),),
+        )
+
+    def assign_serial(self, job_id, serial):
+        """Records the serial a running job was given."""
+        self._connect().execute("UPDATE jobs SET serial_number = ? WHERE job_id = ?", (serial, job_id))
+
+    # ---------- Producer side ----------
+    def enqueue(self, invoice_name, invoice_pdf, packing_name, packing_pdf, serial_number=None, options=None):
+        """serial_number is the requested serial (or None); it is allocated when the job runs."""
+        job_id = uuid.uuid4().hex
+        serial = str(serial_number).strip() if serial_number else None
+        self._connect().execute(
+            "INSERT INTO jobs (job_id, status, serial_number, invoice_name, invoice_pdf, "
+            "packing_name, packing_pdf, options, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, serial, invoice_name, invoice_pdf, packing_name, packing_pdf,
+             json.dumps(options or {}), time.time()),
+        )
+        return job_id
+
+    def status(self, job_id):
+        row = self._connect().execute(
+            f"SELECT {', '.join(STATUS_FIELDS)} FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def result(self, job_id):
+        """Returns (filename, bytes) for a finished job, else None."""
+        row = self._connect().execute(
+            "SELECT result_name, result FROM jobs WHERE job_id = ? AND status = ?", (job_id, DONE)
+        ).fetchone()
+        return (row["result_name"], row["result"]) if row else None
+
+    def depth(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)
+        ).fetchone()[0]
+
+    # ---------- Worker side ----------
+    def claim(self, worker_id):
+        """Atomically moves the oldest queued job to running and returns it."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1 "
+                "WHERE job_id = ?",
+                (RUNNING, worker_id, now, now, row["job_id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job = dict(row)
+        job["options"] = json.loads(job.get("options") or "{}")
+        return job
+
+    def heartbeat(self, job_id):
+        """The worker of a running job is alive (see requeue_stale)."""
+        self._connect().execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND status = ?", (time.time(), job_id, RUNNING)
+        )
+
+    def set_stage(self, job_id, stage):
+        self._connect().execute("UPDATE jobs SET stage = ? WHERE job_id = ?", (stage, job_id))
+
+    def complete(self, job_id, result_name, result_bytes):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, stage = NULL, result_name = ?, result = ?, "
+            "invoice_pdf = NULL, packing_pdf = NULL, finished_at = ? WHERE job_id = ?",
+            (DONE, result_name, result_bytes, time.time(), job_id),
+        )
+
+    def fail(self, job_id, error):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?",
+            (FAILED, str(error), time.time(), job_id),
+        )
+
+    def requeue_stale(self, timeout_seconds, max_attempts=3):
+        """
+        Jobs whose worker died keep status 'running' forever; put the ones
+        without a heartbeat for timeout_seconds back in the queue (or fail
+        them after max_attempts).
+        """
+        cutoff = time.time() - timeout_seconds
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = 'worker timed out', finished_at = ? "
+            "WHERE status = ? AND COALESCE(heartbeat_at, started_at) < ? AND attempts >= ?",
+            (FAILED, time.time(), RUNNING, cutoff, max_attempts),
+        )
+        return conn.execute(
+            "UPDATE jobs SET status = ?, worker = NULL, stage = NULL "
+            "WHERE status = ? AND COALESCE(heartbeat_at, started_at) < ?",
+            (QUEUED, RUNNING, cutoff),
+        ).rowcount
+
+
+class RedisQueue:
+    """
+    Redis-compatible backend. Job fields live in a hash per job, queued IDs
+    in a list; claim() moves an ID to a processing list atomically.
+    """
+    PREFIX = "inabata"
+
+    # Seed, then take the next serial or the requested one (ARGV[2], "" for
+    # none), in one step: a requested serial and a concurrent INCR cannot
+    # interleave. Returns the allocated serial.
+    ALLOCATE_SERIAL = """
+        redis.call('SETNX', KEYS[1], ARGV[1])
+        if ARGV[2] ~= '' then
+            redis.call('SET', KEYS[1], tonumber(ARGV[2]) + 1)
+            return tonumber(ARGV[2])
+        end
+        return redis.call('INCR', KEYS[1]) - 1
+    """
+
+    def __init__(self, url="redis://localhost:6379/0", serial_file=DEFAULT_SERIAL_FILE):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("queue.backend 'redis' needs the `redis` package (pip install redis)") from e
+        self.redis = redis.Redis.from_url(url)
+        self.serial_file = serial_file
+        self._allocate_serial = self.redis.register_script(self.ALLOCATE_SERIAL)
+
+    def _key(self, *parts):
+        return ":".join((self.PREFIX,) + parts)
+
+    def allocate_serial(self, requested=None):
+        if requested and not str(requested).strip().isdigit():
+            return str(requested).strip()
+        number = str(int(requested)) if requested else ""
+        serial = self._allocate_serial(keys=[self._key("serial")], args=[_initial_serial(self.serial_file), number])
+        return str(serial).zfill(4)
+
+    def peek_serial(self):
+        value = self.redis.get(self._key("serial"))
+        return str(int(value) if value else _initial_serial(self.serial_file)).zfill(4)
+
+    def set_serial(self, value):
+        self.redis.set(self._key("serial"), int(value))
+
+    def assign_serial(self, job_id, serial):
+        self.redis.hset(self._key("job", job_id), "serial_number", serial)
+
+    def enqueue(self, invoice_name, invoice_pdf, packing_name, packing_pdf, serial_number=None, options=None):
+        job_id = uuid.uuid4().hex
+        self.redis.hset(self._key("job", job_id), mapping={
+            "job_id": job_id,
+            "status": QUEUED,
+            # Redis hashes cannot hold None; "" = no requested serial
+            "serial_number": str(serial_number).strip() if serial_number else "",
+            "invoice_name": invoice_name,
+            "invoice_pdf": invoice_pdf,
+            "packing_name": packing_name,
+            "packing_pdf": packing_pdf,
+            "options": json.dumps(options or {}),
+            "attempts": 0,
+            "created_at": time.time(),
+        })
+        self.redis.lpush(self._key("queue"), job_id)
+        return job_id
+
+    def _decode(self, raw, fields):
+        job = {}
+        for field in fields:
+            value = raw.get(field.encode())
+            if value is not None and field not in ("invoice_pdf", "packing_pdf", "result"):
+                value = value.decode()
+            job[field] = value
+        return job
+
+    def status(self, job_id):
+        raw = self.redis.hgetall(self._key("job", job_id))
+        return self._decode(raw, STATUS_FIELDS) if raw else None
+
+    def result(self, job_id):
+        name, data, status = self.redis.hmget(self._key("job", job_id), "result_name", "result", "status")
+        if status is None or status.decode() != DONE:
+            return None
+        return name.decode(), data
+
+    def depth(self):
+        return self.redis.llen(self._key("queue"))
+
+    def claim(self, worker_id):
+        job_id = self.redis.lmove(self._key("queue"), self._key("processing"), "RIGHT", "LEFT")
+        if job_id is None:
+            return None
+        job_id = job_id.decode()
+        key = self._key("job", job_id)
+        now = time.time()
+        self.redis.hset(key, mapping={"status": RUNNING, "worker": worker_id, "started_at": now, "heartbeat_at": now})
+        self.redis.hincrby(key, "attempts", 1)
+        job = self._decode(self.redis.hgetall(key), STATUS_FIELDS + ["invoice_pdf", "packing_pdf", "options"])
+        job["options"] = json.loads(job.get("options") or "{}")
+        return job
+
+    def heartbeat(self, job_id):
+        self.redis.hset(self._key("job", job_id), "heartbeat_at", time.time())
+
+    def set_stage(self, job_id, stage):
+        self.redis.hset(self._key("job", job_id), "stage", stage)
+
+    def _finish(self, job_id, mapping):
+        key = self._key("job", job_id)
+        self.redis.hset(key, mapping=dict(mapping, finished_at=time.time()))
+        self.redis.hdel(key, "invoice_pdf", "packing_pdf", "stage")
+        self.redis.lrem(self._key("processing"), 0, job_id)
+
+    def complete(self, job_id, result_name, result_bytes):
+        self._finish(job_id, {"status": DONE, "result_name": result_name, "result": result_bytes})
+
+    def fail(self, job_id, error):
+        self._finish(job_id, {"status": FAILED, "error": str(error)})
+
+    def requeue_stale(self, timeout_seconds, max_attempts=3):
+        cutoff = time.time() - timeout_seconds
+        requeued = 0
+        for raw_id in self.redis.lrange(self._key("processing"), 0, -1):
+            job_id = raw_id.decode()
+            started, beat, attempts = self.redis.hmget(
+                self._key("job", job_id), "started_at", "heartbeat_at", "attempts"
+            )
+            last_seen = beat or started
+            if last_seen is None or float(last_seen) >= cutoff:
+                continue
+            if int(attempts or 0) >= max_attempts:
+                self.fail(job_id, "worker timed out")
+                continue
+            if self.redis.lrem(self._key("processing"), 0, job_id):
+                self.redis.hset(self._key("job", job_id), "status", QUEUED)
+                self.redis.lpush(self._key("queue"), job_id)
+                requeued += 1
+        return requeued
+
+
+def get_queue(cfg):
+    """Builds the backend configured under `queue:` in config.yaml."""
+    queue_cfg = (cfg or {}).get("queue") or {}
+    backend = queue_cfg.get("backend", "sqlite")
+    if backend == "sqlite":
+        path = queue_cfg.get("path") or DEFAULT_DB_PATH
+        if not os.path.isabs(path):
+            path = os.path.join(ROOT_DIR, path)
+        return SQLiteQueue(path)
+    if backend == "redis":
+        return RedisQueue(queue_cfg.get("url", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown queue backend: {backend}")
@@ -0,0 +1,86 @@
+import json
+
+# --------------------------------------------------
+# INCREMENTAL SHEET PARSER
+# --------------------------------------------------
+# The extraction is one JSON object of sheets ({"HEADER": [[...], ...],
+# "BARANG": [...], ...}). While Gemini streams it, this parser tracks string
+# and bracket state across chunks and hands over every top-level sheet the
+# moment its closing bracket arrives, so HEADER/ENTITAS/DOKUMEN can be used
+# while BARANG rows are still being generated.
+#
+#   parser = SheetStreamParser(on_sheet=lambda name, rows: ...)
+#   for chunk in stream:
+#       parser.feed(chunk.text)
+#   data = parser.close()   # the whole payload, as json.loads would return it
+
+
+class SheetStreamParser:
+    def __init__(self, on_sheet=None):
+        self.on_sheet = on_sheet
+        self.sheets = {}          # completed sheets, in arrival order
+        self._chunks = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_buf = None      # raw characters of the key being read
+        self._key = None
+        self._value = None        # pieces of the sheet value being read
+
+    def feed(self, text):
+        if not text:
+            return
+        self._chunks.append(text)
+        mark = 0 if self._value is not None else None
+
+        for i, ch in enumerate(text):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_buf is not None:
+                        self._key = json.loads('"' + "".join(self._key_buf) + '"')
+                        self._key_buf = None
+                    continue
+                if self._key_buf is not None:
+                    self._key_buf.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_buf = []
+                    self._expect_key = False
+            elif ch in "[{":
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = True
+                elif self._depth == 2:
+                    self._value = []
+                    mark = i
+            elif ch in "]}":
+                self._depth -= 1
+                if self._depth == 1 and self._value is not None:
+                    self._value.append(text[mark:i + 1])
+                    self._emit("".join(self._value))
+                    self._value = None
+                    mark = None
+            elif ch == "," and self._depth == 1:
+                self._expect_key = True
+
+        if self._value is not None and mark is not None:
+            self._value.append(text[mark:])
+
+    def _emit(self, raw):
+        rows = json.loads(raw)
+        self.sheets[self._key] = rows
+        if self.on_sheet:
+            self.on_sheet(self._key, rows)
+
+    def close(self):
+        """Parses the complete text; raises ValueError when the stream was cut short."""
+        return json.loads("".join(self._chunks))
@@ -176,26 +176,43 @@
 import json
 import os
 import yaml
+from functools import lru_cache
 from openpyxl import load_workbook
 from datetime import datetime
 
+from scripts.metrics import stage
+
 # --------------------------------------------------
 # LOAD CONFIG
 # --------------------------------------------------
-CONFIG_PATH = os.getenv("CONFIG_PATH", "config.yaml")
-
-# Check if config exists before loading to prevent crash if run from wrong dir
-if os.path.exists(CONFIG_PATH):
-    with open(CONFIG_PATH, "r") as f:
-        config = yaml.safe_load(f)
-        BASE_DIR = config["base_dir"]
-        OUTPUT_DIR = os.path.join(BASE_DIR, config["data"]["output"]["final_excel_dir"])
-        SERIAL_TRACKER_PATH = os.path.join(BASE_DIR, "state/serial_tracker.txt")
-else:
-    # Fallback/Default if config not found immediately (helpful for testing)
-    BASE_DIR = os.path.dirname(__file__)
-    OUTPUT_DIR = os.path.join(BASE_DIR, "output")
-    SERIAL_TRACKER_PATH = os.path.join(BASE_DIR, "serial_tracker.txt")
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+@lru_cache(maxsize=None)
+def get_default_paths():
+    """
+    Resolves (output_dir, serial_tracker_path) on first use instead of at
+    import time. CONFIG_PATH may override the config file; relative paths are
+    taken from the project root, not the current working directory.
+    """
+    config_path = os.getenv("CONFIG_PATH", os.path.join(ROOT_DIR, "config.yaml"))
+    if not os.path.isabs(config_path):
+        config_path = os.path.join(ROOT_DIR, config_path)
+
+    # Check if config exists before loading to prevent crash
+    if os.path.exists(config_path):
+        with open(config_path, "r") as f:
+            config = yaml.safe_load(f)
+        base_dir = os.getenv("INABATA_BASE_DIR") or config["base_dir"]
+        output_dir = os.path.join(base_dir, config["data"]["output"]["final_excel_dir"])
+        tracker_path = os.path.join(base_dir, "state/serial_tracker.txt")
+    else:
+        # Fallback/Default if config not found immediately (helpful for testing)
+        base_dir = os.path.dirname(__file__)
+        output_dir = os.path.join(base_dir, "output")
+        tracker_path = os.path.join(base_dir, "serial_tracker.txt")
+
+    return output_dir, tracker_path
 
 # --------------------------------------------------
 # SERIAL NUMBER HANDLER
@@ -231,20 +248,70 @@ def get_next_serial_number(tracker_path, fallback_serial):
 # CORE BUSINESS LOGIC
 # --------------------------------------------------
 # CHANGE: Added user_serial parameter
-def json_to_excel(json_path, template_path, user_serial=None):
+# output_dir / tracker_path default to the configured locations; benchmarks
+# pass scratch paths so they never touch the real serial tracker.
+# nomor_aju: replays pass the shipment's original NOMOR AJU, which is used
+# verbatim (no serial is allocated and the tracker is left alone).
+def json_to_excel(json_path, template_path, user_serial=None, output_dir=None, tracker_path=None, nomor_aju=None):
+    default_output_dir, _ = get_default_paths()
+    output_dir = output_dir or default_output_dir
+
     # ---------- Validate Inputs ----------
     if not os.path.exists(json_path):
         raise FileNotFoundError(f"JSON not found → {json_path}")
 
-    if not os.path.exists(template_path):
-        raise FileNotFoundError(f"Template not found → {template_path}")
-
     # ---------- Load JSON ----------
     with open(json_path, "r", encoding="utf-8") as f:
         data = json.load(f)
 
+    wb, generated_nomor_aju = fill_template(data, template_path, user_serial, tracker_path, nomor_aju)
+
+    # ---------- OUTPUT ----------
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, output_filename(generated_nomor_aju))
+    wb.save(output_path)
+
+    return output_path
+
+
+def output_filename(nomor_aju):
+    return (
+        f"{nomor_aju}.xlsx"
+        if nomor_aju
+        else f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    )
+
+
+# Fills the template with an extraction payload and returns the unsaved
+# (workbook, NOMOR AJU); the in-memory output mode keeps it off disk.
+def fill_template(data, template_path, user_serial=None, tracker_path=None, nomor_aju=None):
+    wb, generated_nomor_aju = prepare_template(template_path, user_serial, tracker_path, nomor_aju)
+    for sheet_name, content in data.items():
+        fill_sheet(wb, sheet_name, content)
+    return wb, generated_nomor_aju
+
+
+# Template with the NOMOR AJU set, before any sheet is filled; the streaming
+# extraction fills sheets one by one with fill_sheet as they arrive.
+def load_template(template_path):
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"Template not found → {template_path}")
+
     # ---------- Load Excel Template ----------
-    wb = load_workbook(template_path)
+    with stage("template_load"):
+        return load_workbook(template_path)
+
+
+def prepare_template(template_path, user_serial=None, tracker_path=None, nomor_aju=None):
+    wb = load_template(template_path)
+    return wb, assign_nomor_aju(wb, user_serial, tracker_path, nomor_aju)
+
+
+# Writes the NOMOR AJU (given, or built from the serial / tracker) into the
+# first sheet with a NOMOR AJU column and returns it. Works on anything with
+# the openpyxl Workbook interface (scripts.export uses plain tables).
+def assign_nomor_aju(wb, user_serial=None, tracker_path=None, nomor_aju=None):
+    tracker_path = tracker_path or get_default_paths()[1]
     generated_nomor_aju = None
 
     # ---------- NOMOR AJU LOGIC ----------
@@ -257,6 +324,11 @@ def json_to_excel(json_path, template_path, user_serial=None):
                 nomor_col = col
                 break
 
+        if nomor_col and nomor_aju:
+            generated_nomor_aju = str(nomor_aju).strip()
+            ws.cell(row=2, column=nomor_col).value = generated_nomor_aju
+            break
+
         if nomor_col:
             existing_val = str(ws.cell(row=2, column=nomor_col).value or "").strip()
             if len(existing_val) < 26:
@@ -271,14 +343,14 @@ def json_to_excel(json_path, template_path, user_serial=None):
                 try:
                     new_serial = int(user_serial)
                     # Update tracker to match the input provided
-                    os.makedirs(os.path.dirname(SERIAL_TRACKER_PATH), exist_ok=True)
-                    with open(SERIAL_TRACKER_PATH, "w") as f:
+                    os.makedirs(os.path.dirname(tracker_path), exist_ok=True)
+                    with open(tracker_path, "w") as f:
                         f.write(str(new_serial).zfill(4))
                 except ValueError:
-                    new_serial = get_next_serial_number(SERIAL_TRACKER_PATH, old_serial)
+                    new_serial = get_next_serial_number(tracker_path, old_serial)
             else:
                 new_serial = get_next_serial_number(
-                    SERIAL_TRACKER_PATH,
+                    tracker_path,
                     old_serial
                 )
 
@@ -286,62 +358,51 @@ def json_to_excel(json_path, template_path, user_serial=None):
             ws.cell(row=2, column=nomor_col).value = generated_nomor_aju
             break
 
-    # ---------- JSON → EXCEL ----------
-    for sheet_name, content in data.items():
-        if sheet_name not in wb.sheetnames or len(content) < 2:
-            continue
-
-        ws = wb[sheet_name]
-        headers = content[0]
-        rows = content[1:]
-
-        excel_headers = {
-            str(ws.cell(row=1, column=c).value).strip(): c
-            for c in range(1, ws.max_column + 1)
-            if ws.cell(row=1, column=c).value
-        }
-
-        # ENTITAS SPECIAL CASE
-        if sheet_name == "ENTITAS":
-            kode_col = excel_headers.get("KODE ENTITAS")
-            target_row = None
-
-            if kode_col:
-                for r in range(2, ws.max_row + 1):
-                    if str(ws.cell(row=r, column=kode_col).value).strip() == "8":
-                        target_row = r
-                        break
-
-            if target_row:
-                for row in rows[:1]:
-                    for i, val in enumerate(row):
-                        col = excel_headers.get(headers[i])
-                        if col:
-                            ws.cell(row=target_row, column=col).value = val
-            continue
-
-        # STANDARD SHEETS
-        excel_row = 2
-        for row in rows:
-            for i, val in enumerate(row):
-                col = excel_headers.get(headers[i])
-                if col:
-                    ws.cell(row=excel_row, column=col).value = val
-            excel_row += 1
-
-    # ---------- OUTPUT ----------
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-    filename = (
-        f"{generated_nomor_aju}.xlsx"
-        if generated_nomor_aju
-        else f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    )
-
-    output_path = os.path.join(OUTPUT_DIR, filename)
-    wb.save(output_path)
-
-    return output_path
+    return generated_nomor_aju
+
+
+# ---------- JSON → EXCEL (one sheet) ----------
+def fill_sheet(wb, sheet_name, content):
+    if sheet_name not in wb.sheetnames or len(content) < 2:
+        return
+
+    ws = wb[sheet_name]
+    headers = content[0]
+    rows = content[1:]
+
+    excel_headers = {
+        str(ws.cell(row=1, column=c).value).strip(): c
+        for c in range(1, ws.max_column + 1)
+        if ws.cell(row=1, column=c).value
+    }
+
+    # ENTITAS SPECIAL CASE
+    if sheet_name == "ENTITAS":
+        kode_col = excel_headers.get("KODE ENTITAS")
+        target_row = None
+
+        if kode_col:
+            for r in range(2, ws.max_row + 1):
+                if str(ws.cell(row=r, column=kode_col).value).strip() == "8":
+                    target_row = r
+                    break
+
+        if target_row:
+            for row in rows[:1]:
+                for i, val in enumerate(row):
+                    col = excel_headers.get(headers[i])
+                    if col:
+                        ws.cell(row=target_row, column=col).value = val
+        return
+
+    # STANDARD SHEETS
+    excel_row = 2
+    for row in rows:
+        for i, val in enumerate(row):
+            col = excel_headers.get(headers[i])
+            if col:
+                ws.cell(row=excel_row, column=col).value = val
+        excel_row += 1
 
 
 # --------------------------------------------------
@@ -0,0 +1,411 @@
+import argparse
+import contextvars
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from scripts.metrics import GEMINI_TOKENS
+
+# --------------------------------------------------
+# GEMINI CALL LEDGER
+# --------------------------------------------------
+# One row per Gemini call (PDF upload, generate, fan-out group, stream):
+# job, model, latency, retries, prompt cache hit, upload size and the token
+# counts from the response's usage metadata. When the job finishes,
+# record_history labels it with the customer (NAMA ENTITAS) and NOMOR AJU,
+# so costs can be grouped per customer; the extraction has no separate
+# supplier field.
+#
+# Reports aggregate per job first (seconds are the sum of the calls, so a
+# fan-out job counts every group), then per day / customer / model / call:
+#
+#   python -m scripts.ledger report --by customer --from 2026-10-01
+#   python -m scripts.ledger job <job_id>
+#   python -m scripts.ledger over-budget
+#   GET /api/ledger?by=day, GET /api/ledger/{job_id}
+#
+# Recording never fails a job. Put `ledger.path` on shared storage when
+# workers run on several machines, like `history.path`.
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_DB_PATH = os.path.join(ROOT_DIR, "state", "gemini_ledger.sqlite")
+
+GROUPINGS = ("day", "customer", "model", "call", "job")
+
+# usage_metadata attribute → ledger column
+USAGE_FIELDS = {
+    "prompt_token_count": "input_tokens",
+    "cached_content_token_count": "cached_tokens",
+    "candidates_token_count": "output_tokens",
+    "thoughts_token_count": "thoughts_tokens",
+    "total_token_count": "total_tokens",
+}
+TOKEN_COLUMNS = list(USAGE_FIELDS.values())
+
+# Job the calls of this context belong to (see tracking())
+ledger_job = contextvars.ContextVar("ledger_job", default=None)
+
+
+class Ledger:
+    def __init__(self, path=DEFAULT_DB_PATH, budget=None):
+        self.path = path
+        self.budget = budget or {}
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS calls (
+                    id              INTEGER PRIMARY KEY,
+                    job_id          TEXT,
+                    day             TEXT NOT NULL,
+                    created_at      REAL NOT NULL,
+                    call            TEXT NOT NULL,
+                    model           TEXT,
+                    status          TEXT NOT NULL,
+                    latency_seconds REAL NOT NULL,
+                    retries         INTEGER NOT NULL DEFAULT 0,
+                    cache_hit       INTEGER,
+                    document        TEXT,
+                    upload_bytes    INTEGER,
+                    input_tokens    INTEGER,
+                    cached_tokens   INTEGER,
+                    output_tokens   INTEGER,
+                    thoughts_tokens INTEGER,
+                    total_tokens    INTEGER,
+                    error           TEXT
+                );
+                CREATE INDEX IF NOT EXISTS calls_job ON calls (job_id);
+                CREATE INDEX IF NOT EXISTS calls_day ON calls (day);
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id    TEXT PRIMARY KEY,
+                    customer  TEXT,
+                    nomor_aju TEXT,
+                    labeled_at REAL NOT NULL
+                );
+            """)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout = 30000")
+            self._local.conn = conn
+        return conn
+
+    def record(self, job_id, call, latency_seconds, status="ok", **fields):
+        now = time.time()
+        row = {
+            "job_id": job_id,
+            "day": datetime.fromtimestamp(now).strftime("%Y-%m-%d"),
+            "created_at": now,
+            "call": call,
+            "status": status,
+            "latency_seconds": round(latency_seconds, 4),
+            **fields,
+        }
+        columns = ", ".join(row)
+        self._connect().execute(
+            f"INSERT INTO calls ({columns}) VALUES ({', '.join('?' * len(row))})", list(row.values())
+        )
+
+    def label_job(self, job_id, customer=None, nomor_aju=None):
+        """Attaches the finished job's customer / NOMOR AJU; returns its totals."""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO jobs (job_id, customer, nomor_aju, labeled_at) VALUES (?, ?, ?, ?)",
+            (job_id, customer, nomor_aju, time.time()),
+        )
+        totals = self.job_totals(job_ids=[job_id])
+        return totals[0] if totals else None
+
+    def calls(self, job_id):
+        rows = self._connect().execute(
+            "SELECT * FROM calls WHERE job_id = ? ORDER BY created_at", (job_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def job_totals(self, date_from=None, date_to=None, job_ids=None):
+        """One row per job: summed tokens, call seconds, upload bytes, retries, errors."""
+        clauses, params = [], []
+        if date_from:
+            clauses.append("c.day >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("c.day <= ?")
+            params.append(date_to)
+        if job_ids:
+            clauses.append(f"c.job_id IN ({', '.join('?' * len(job_ids))})")
+            params.extend(job_ids)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        token_sums = ", ".join(f"COALESCE(SUM(c.{col}), 0) AS {col}" for col in TOKEN_COLUMNS)
+        rows = self._connect().execute(f"""
+            SELECT COALESCE(c.job_id, '-') AS job_id, MIN(c.day) AS day, j.customer, j.nomor_aju,
+                   GROUP_CONCAT(DISTINCT c.model) AS model,
+                   GROUP_CONCAT(DISTINCT c.document) AS documents,
+                   COUNT(*) AS calls,
+                   SUM(c.status = 'error') AS errors,
+                   SUM(c.retries) AS retries,
+                   SUM(c.cache_hit = 1) AS cache_hits,
+                   SUM(c.cache_hit IS NOT NULL) AS cache_lookups,
+                   COALESCE(SUM(c.upload_bytes), 0) AS upload_bytes,
+                   SUM(c.latency_seconds) AS seconds,
+                   {token_sums}
+            FROM calls c LEFT JOIN jobs j ON j.job_id = c.job_id
+            {where}
+            GROUP BY COALESCE(c.job_id, '-')
+            ORDER BY MIN(c.created_at)
+        """, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def report(self, by="day", date_from=None, date_to=None):
+        """
+        Aggregates per `by` (day, customer, model, call or job): jobs, calls,
+        tokens, per-job averages and p50/p95, upload MB, error / retry counts
+        and the prompt cache hit rate.
+        """
+        if by not in GROUPINGS:
+            raise ValueError(f"by must be one of: {', '.join(GROUPINGS)}")
+        if by == "call":
+            return self._report_calls(date_from, date_to)
+
+        groups = {}
+        for job in self.job_totals(date_from, date_to):
+            key = job["job_id"] if by == "job" else (job[by] or "(unknown)")
+            groups.setdefault(key, []).append(job)
+        return [_summarize(by, key, jobs) for key, jobs in sorted(groups.items())]
+
+    def _report_calls(self, date_from, date_to):
+        clauses, params = [], []
+        if date_from:
+            clauses.append("day >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("day <= ?")
+            params.append(date_to)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        token_sums = ", ".join(f"COALESCE(SUM({col}), 0) AS {col}" for col in TOKEN_COLUMNS)
+        rows = self._connect().execute(f"""
+            SELECT call, COUNT(DISTINCT job_id) AS jobs, COUNT(*) AS calls,
+                   SUM(status = 'error') AS errors, SUM(retries) AS retries,
+                   COALESCE(SUM(upload_bytes), 0) AS upload_bytes,
+                   AVG(latency_seconds) AS avg_seconds, MAX(latency_seconds) AS max_seconds,
+                   {token_sums}
+            FROM calls {where} GROUP BY call ORDER BY call
+        """, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def over_budget(self, date_from=None, date_to=None):
+        """Jobs above budget.tokens_per_job or budget.seconds_per_job."""
+        return [job for job in self.job_totals(date_from, date_to) if self.exceeds(job)]
+
+    def exceeds(self, job):
+        max_tokens = self.budget.get("tokens_per_job")
+        max_seconds = self.budget.get("seconds_per_job")
+        return bool(
+            (max_tokens and job["total_tokens"] > max_tokens)
+            or (max_seconds and job["seconds"] > max_seconds)
+        )
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _summarize(by, key, jobs):
+    tokens = [j["total_tokens"] for j in jobs]
+    seconds = [j["seconds"] or 0.0 for j in jobs]
+    lookups = sum(j["cache_lookups"] or 0 for j in jobs)
+    summary = {
+        by: key,
+        "jobs": len(jobs),
+        "calls": sum(j["calls"] for j in jobs),
+        "errors": sum(j["errors"] or 0 for j in jobs),
+        "retries": sum(j["retries"] or 0 for j in jobs),
+        **{col: sum(j[col] for j in jobs) for col in TOKEN_COLUMNS},
+        "tokens_per_job": round(sum(tokens) / len(jobs)),
+        "tokens_p50": _percentile(tokens, 0.5),
+        "tokens_p95": _percentile(tokens, 0.95),
+        "seconds_per_job": round(sum(seconds) / len(jobs), 2),
+        "seconds_p50": round(_percentile(seconds, 0.5), 2),
+        "seconds_p95": round(_percentile(seconds, 0.95), 2),
+        "upload_mb": round(sum(j["upload_bytes"] for j in jobs) / 1e6, 2),
+        "cache_hit_rate": round(sum(j["cache_hits"] or 0 for j in jobs) / lookups, 3) if lookups else None,
+    }
+    if by == "job":
+        job = jobs[0]
+        summary.update(day=job["day"], customer=job["customer"], nomor_aju=job["nomor_aju"],
+                       documents=job["documents"])
+    return summary
+
+
+# --------------------------------------------------
+# RECORDING (used by scripts.pdf_to_json)
+# --------------------------------------------------
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger(cfg=None):
+    """The ledger configured under `ledger:` in config.yaml, or None when disabled."""
+    if cfg is None:
+        from scripts.run_pipeline import load_config
+
+        cfg = load_config()
+    settings = (cfg or {}).get("ledger") or {}
+    if not settings.get("enabled", False):
+        return None
+    path = settings.get("path") or DEFAULT_DB_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(ROOT_DIR, path)
+    with _ledgers_lock:
+        if path not in _ledgers:
+            _ledgers[path] = Ledger(path, settings.get("budget"))
+        return _ledgers[path]
+
+
+@contextmanager
+def tracking(job_id):
+    """Gemini calls made in this context (and threads started from it) are booked to job_id."""
+    token = ledger_job.set(job_id)
+    try:
+        yield
+    finally:
+        ledger_job.reset(token)
+
+
+def usage_fields(usage):
+    if usage is None:
+        return {}
+    fields = {column: getattr(usage, attr, None) for attr, column in USAGE_FIELDS.items()}
+    return {column: value for column, value in fields.items() if value is not None}
+
+
+@contextmanager
+def ledger_call(call, **fields):
+    """
+    Times one Gemini call and books it when the block exits. The block may
+    set entry["usage"] (response.usage_metadata), "retries", "cache_hit",
+    "status"; an exception is booked as an error and re-raised.
+    """
+    entry = dict(fields)
+    started = time.perf_counter()
+    try:
+        yield entry
+    except BaseException as e:
+        entry["status"] = "error"
+        entry["error"] = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        _book(call, time.perf_counter() - started, entry)
+
+
+def _book(call, seconds, entry):
+    try:
+        usage = usage_fields(entry.pop("usage", None))
+        for kind in ("input", "cached", "output"):
+            GEMINI_TOKENS.inc(usage.get(f"{kind}_tokens") or 0, kind=kind)
+        ledger = get_ledger()
+        if ledger is None:
+            return
+        if "cache_hit" in entry and entry["cache_hit"] is not None:
+            entry["cache_hit"] = int(bool(entry["cache_hit"]))
+        job_id = ledger_job.get()
+        if job_id is None:
+            from scripts.progress import current_job
+
+            job_id = current_job.get()
+        ledger.record(job_id, call, seconds, **entry, **usage)
+    except Exception as e:
+        print(f"   ! Warning: Could not record Gemini call in the ledger: {e}")
+
+
+def label_job(cfg, job_id, customer=None, nomor_aju=None):
+    """Called when a job finishes; warns when it went over budget. Never fails the job."""
+    try:
+        ledger = get_ledger(cfg)
+        if ledger is None:
+            return
+        totals = ledger.label_job(job_id, customer, nomor_aju)
+        if totals and ledger.exceeds(totals):
+            print(
+                f"   ! Warning: Job {job_id} over the Gemini budget: {totals['total_tokens']} tokens, "
+                f"{totals['seconds']:.1f}s in {totals['calls']} call(s) ({totals['documents']})"
+            )
+    except Exception as e:
+        print(f"   ! Warning: Could not label job in the ledger: {e}")
+
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+def _print_rows(rows, columns, empty="(no calls recorded)"):
+    if not rows:
+        print(empty)
+        return
+    widths = [max(len(col), *(len(_fmt(row.get(col))) for row in rows)) for col in columns]
+    print("  ".join(col.ljust(w) for col, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(_fmt(row.get(col)).ljust(w) for col, w in zip(columns, widths)))
+
+
+def _fmt(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def main(argv=None):
+    from scripts.run_pipeline import load_config
+
+    parser = argparse.ArgumentParser(description="Token and latency ledger of the Gemini calls.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_cmd = sub.add_parser("report", help="aggregate per day / customer / model / call / job")
+    report_cmd.add_argument("--by", choices=GROUPINGS, default="day")
+    job_cmd = sub.add_parser("job", help="every call of one job")
+    job_cmd.add_argument("job_id")
+    budget_cmd = sub.add_parser("over-budget", help="jobs above ledger.budget")
+    for cmd in (report_cmd, budget_cmd):
+        cmd.add_argument("--from", dest="date_from", help="YYYY-MM-DD (inclusive)")
+        cmd.add_argument("--to", dest="date_to", help="YYYY-MM-DD (inclusive)")
+    args = parser.parse_args(argv)
+
+    ledger = get_ledger(load_config())
+    if ledger is None:
+        print("❌ The ledger is disabled (ledger.enabled in config.yaml)")
+        return 1
+
+    if args.command == "report":
+        rows = ledger.report(args.by, args.date_from, args.date_to)
+        if args.by == "call":
+            columns = ["call", "jobs", "calls", "errors", "retries", "input_tokens", "cached_tokens",
+                       "output_tokens", "avg_seconds", "max_seconds", "upload_bytes"]
+        else:
+            columns = [args.by, "jobs", "calls", "errors", "retries", "input_tokens", "cached_tokens",
+                       "output_tokens", "tokens_per_job", "tokens_p95", "seconds_per_job", "seconds_p95",
+                       "upload_mb", "cache_hit_rate"]
+        _print_rows(rows, columns)
+    elif args.command == "job":
+        rows = ledger.calls(args.job_id)
+        _print_rows(rows, ["call", "model", "status", "latency_seconds", "retries", "cache_hit", "document",
+                           "upload_bytes", "input_tokens", "cached_tokens", "output_tokens", "error"])
+        return 0 if rows else 1
+    else:
+        rows = ledger.over_budget(args.date_from, args.date_to)
+        print(f"Budget: {ledger.budget.get('tokens_per_job') or '-'} tokens, "
+              f"{ledger.budget.get('seconds_per_job') or '-'}s per job")
+        _print_rows(rows, ["job_id", "day", "customer", "nomor_aju", "documents", "calls", "total_tokens", "seconds"],
+                    empty="(no job over budget)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+# --------------------------------------------------
+# HTTP LOAD TEST
+# --------------------------------------------------
+# Drives POST /api/process-docs end to end (upload → pipeline → xlsx) at
+# increasing concurrency and reports throughput and p50/p95/p99 latency per
+# level. Point the API at the Gemini stand-in (scripts/fake_gemini.py) so no
+# quota is used:
+#
+#   python -m scripts.fake_gemini --latency lognormal:8:0.4 &
+#   GEMINI_BASE_URL=http://127.0.0.1:8090 GEMINI_API_KEY=fake uvicorn main:app &
+#   python -m scripts.loadtest http://127.0.0.1:8000 --concurrency 1,2,4,8 --requests 40
+#
+# A request counts as successful only when the response is an .xlsx file.
+# Every run is appended to state/benchmarks/loadtest.jsonl.
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+RESULTS_PATH = os.path.join(ROOT_DIR, "state", "benchmarks", "loadtest.jsonl")
+
+# Smallest well-formed PDF; the stand-in never looks at the content
+BLANK_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+XLSX_SIGNATURE = b"PK\x03\x04"
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+async def _one(client, url, invoice, packing, name, in_memory):
+    params = {"in_memory": "1"} if in_memory else None
+    files = {
+        "invoice": (f"INV {name}.pdf", invoice, "application/pdf"),
+        "packing_list": (f"PL {name}.pdf", packing, "application/pdf"),
+    }
+    started = time.perf_counter()
+    try:
+        response = await client.post(url, files=files, params=params)
+        body = response.content
+        status = response.status_code
+    except Exception as e:
+        return time.perf_counter() - started, type(e).__name__
+    seconds = time.perf_counter() - started
+    if status == 200 and body.startswith(XLSX_SIGNATURE):
+        return seconds, None
+    return seconds, f"HTTP {status}"
+
+
+async def run_level(base_url, concurrency, requests, invoice, packing, in_memory=False, timeout=600):
+    """Sends `requests` jobs with `concurrency` in flight; returns the level summary."""
+    import httpx
+
+    url = f"{base_url.rstrip('/')}/api/process-docs"
+    run_id = datetime.now().strftime("%H%M%S")
+    names = iter(range(requests))
+    latencies, errors = [], {}
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        async def worker():
+            for i in names:
+                seconds, error = await _one(client, url, invoice, packing, f"LT{run_id}-{concurrency}-{i}", in_memory)
+                if error:
+                    errors[error] = errors.get(error, 0) + 1
+                else:
+                    latencies.append(seconds)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    summary = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if latencies:
+        summary.update(
+            p50=percentile(latencies, 50),
+            p95=percentile(latencies, 95),
+            p99=percentile(latencies, 99),
+            mean=statistics.mean(latencies),
+            max=max(latencies),
+        )
+    return summary
+
+
+def print_summary(s):
+    if s["ok"]:
+        latency = f"p50 {s['p50']:7.2f}s  p95 {s['p95']:7.2f}s  p99 {s['p99']:7.2f}s"
+    else:
+        latency = "no successful requests"
+    errors = ", ".join(f"{k}×{v}" for k, v in s["errors"].items()) or "-"
+    print(f"   > c={s['concurrency']:<3} {s['ok']:>4}/{s['requests']:<4} ok  "
+          f"{s['throughput'] * 60:7.1f} jobs/min  {latency}  errors: {errors}")
+
+
+def _levels(value):
+    levels = [int(v) for v in value.split(",") if v.strip()]
+    if not levels or min(levels) < 1:
+        raise argparse.ArgumentTypeError("comma-separated positive integers, e.g. 1,2,4,8")
+    return levels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test /api/process-docs (HTTP → pipeline → xlsx).")
+    parser.add_argument("url", nargs="?", default="http://127.0.0.1:8000", help="API base URL")
+    parser.add_argument("--concurrency", type=_levels, default=[1, 2, 4, 8], help="levels, e.g. 1,2,4,8")
+    parser.add_argument("--requests", type=int, default=20, help="requests per level")
+    parser.add_argument("--invoice", help="invoice PDF to upload (default: a blank PDF)")
+    parser.add_argument("--packing", help="packing-list PDF to upload (default: a blank PDF)")
+    parser.add_argument("--in-memory", action="store_true", help="request in-memory delivery (?in_memory=1)")
+    parser.add_argument("--timeout", type=float, default=600, help="per-request timeout in seconds")
+    parser.add_argument("--results", default=RESULTS_PATH)
+    args = parser.parse_args(argv)
+
+    def read(path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    invoice = read(args.invoice) if args.invoice else BLANK_PDF
+    packing = read(args.packing) if args.packing else BLANK_PDF
+
+    print(f"\n--- Load test {args.url} ({args.requests} requests per level) ---")
+    levels = []
+    for concurrency in args.concurrency:
+        summary = asyncio.run(run_level(
+            args.url, concurrency, args.requests, invoice, packing, args.in_memory, args.timeout
+        ))
+        print_summary(summary)
+        levels.append(summary)
+
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "url": args.url,
+        "params": {"requests": args.requests, "in_memory": args.in_memory},
+        "levels": levels,
+    }
+    os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+    failed = sum(s["requests"] - s["ok"] for s in levels)
+    print(f"{'❌' if failed else '✅'} {failed} failed request(s) → {args.results}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
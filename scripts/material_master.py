@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+
+# --------------------------------------------------
+# MATERIAL MASTER INDEX
+# --------------------------------------------------
+# Joins DATA_CHEM.xlsx (unit, packing, netto conversion) with HS_CODE.xlsx
+# (HS per description) into one dictionary keyed by material code, so the
+# BARANG pass resolves HS, canonical URAIAN and KODE SATUAN with O(1)
+# lookups instead of relying on the LLM.
+#
+# DATA_CHEM has no KODE BARANG column: the material code is the leading
+# 7-9 digit number of its URAIAN ("102010300 BUTYL TRI GLYCOL"), which is
+# also how HS_CODE lists these materials. A BARANG row is matched by its
+# KODE BARANG, then by the code at the start of its URAIAN, then by the
+# normalized URAIAN text.
+#
+# The joined index is cached as JSON under state/ and rebuilt whenever
+# either spreadsheet changes:
+#
+#   python -m scripts.material_master build
+#   python -m scripts.material_master lookup "102010300 BUTYL TRI GLYCOL"
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_CACHE_PATH = os.path.join(ROOT_DIR, "state", "material_index.json")
+INDEX_VERSION = 1
+
+CODE_PATTERN = re.compile(r"^\s*(\d{7,9})(?=\s|$)")
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def material_code(text):
+    """Leading material code of a description ("102010300 BUTYL…" → "102010300")."""
+    if text is None:
+        return None
+    match = CODE_PATTERN.match(str(text))
+    return match.group(1) if match else None
+
+
+def normalize_uraian(text):
+    """Upper-case, collapse whitespace and spacing around punctuation."""
+    if text is None:
+        return ""
+    text = str(text).upper().strip()
+    text = re.sub(r"\s*([,./()\-])\s*", r"\1", text)
+    return re.sub(r"\s+", " ", text)
+
+
+def _clean(value):
+    if value is None:
+        return None
+    try:
+        # pandas NaN
+        if value != value:
+            return None
+    except Exception:
+        pass
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value.strip() if isinstance(value, str) else value
+
+
+def _source_info(path):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def build_index(data_chem_path, hs_code_path):
+    """Reads both spreadsheets and returns the joined index as a plain dict."""
+    import pandas as pd
+
+    df_chem = pd.read_excel(data_chem_path, dtype={"URAIAN": str, "KODE SATUAN": str})
+    df_chem.columns = df_chem.columns.astype(str).str.strip()
+    df_hs = pd.read_excel(hs_code_path, dtype=str)
+    df_hs.columns = df_hs.columns.astype(str).str.strip()
+
+    # HS candidates, first entry wins (HS_CODE lists a few codes twice)
+    hs_by_code = {}
+    hs_by_uraian = {}
+    for hs, uraian in zip(df_hs["HS"], df_hs["URAIAN"]):
+        hs, uraian = _clean(hs), _clean(uraian)
+        if not hs or not uraian:
+            continue
+        hs_by_uraian.setdefault(normalize_uraian(uraian), (hs, uraian))
+        code = material_code(uraian)
+        if code:
+            hs_by_code.setdefault(code, (hs, uraian))
+
+    by_code = {}
+    by_uraian = {}
+    for row in df_chem.to_dict("records"):
+        uraian = _clean(row.get("URAIAN"))
+        code = material_code(uraian)
+        if not code or code in by_code:
+            continue
+        norm = normalize_uraian(uraian)
+        # Same description first, then same material code
+        hs_match = hs_by_uraian.get(norm) or hs_by_code.get(code)
+        by_code[code] = {
+            "code": code,
+            "uraian": uraian,
+            "hs": hs_match[0] if hs_match else None,
+            "kode_satuan": _clean(row.get("KODE SATUAN")),
+            "packing": _clean(row.get("PACKING")),
+            "conv_netto": _clean(row.get("CONV_NETTO")),
+        }
+        by_uraian[norm] = code
+
+    # Materials only known to HS_CODE still resolve HS + URAIAN
+    for code, (hs, uraian) in hs_by_code.items():
+        if code not in by_code:
+            by_code[code] = {
+                "code": code,
+                "uraian": uraian,
+                "hs": hs,
+                "kode_satuan": None,
+                "packing": None,
+                "conv_netto": None,
+            }
+            by_uraian.setdefault(normalize_uraian(uraian), code)
+
+    return {
+        "version": INDEX_VERSION,
+        "sources": {
+            "data_chem": _source_info(data_chem_path),
+            "hs_code": _source_info(hs_code_path),
+        },
+        "by_code": by_code,
+        "by_uraian": by_uraian,
+    }
+
+
+class MaterialIndex:
+    def __init__(self, data):
+        self.data = data
+        self.by_code = data["by_code"]
+        self.by_uraian = data["by_uraian"]
+
+    def __len__(self):
+        return len(self.by_code)
+
+    def lookup(self, kode_barang=None, uraian=None):
+        """Returns the master entry for a BARANG row, or None if unknown."""
+        if kode_barang:
+            entry = self.by_code.get(str(kode_barang).strip())
+            if entry:
+                return entry
+        code = material_code(uraian)
+        if code and code in self.by_code:
+            return self.by_code[code]
+        if uraian:
+            code = self.by_uraian.get(normalize_uraian(uraian))
+            if code:
+                return self.by_code[code]
+        return None
+
+
+def _is_fresh(data, data_chem_path, hs_code_path):
+    if data.get("version") != INDEX_VERSION:
+        return False
+    for key, path in (("data_chem", data_chem_path), ("hs_code", hs_code_path)):
+        saved = data.get("sources", {}).get(key, {})
+        current = _source_info(path)
+        if saved.get("path") != current["path"] or saved.get("mtime") != current["mtime"] or saved.get("size") != current["size"]:
+            return False
+    return True
+
+
+def load_index(data_chem_path, hs_code_path, cache_path=DEFAULT_CACHE_PATH):
+    """
+    Returns a MaterialIndex, from memory or the JSON cache when both source
+    spreadsheets are unchanged, otherwise rebuilt and re-cached.
+    """
+    key = (os.path.abspath(data_chem_path), os.path.abspath(hs_code_path), cache_path)
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is not None and _is_fresh(index.data, data_chem_path, hs_code_path):
+            return index
+
+        data = None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if not _is_fresh(data, data_chem_path, hs_code_path):
+                    data = None
+            except (OSError, ValueError):
+                data = None
+
+        if data is None:
+            data = build_index(data_chem_path, hs_code_path)
+            if cache_path:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                # Per-process temp name: several worker processes may rebuild at once
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, cache_path)
+            print(f"   > Material master index built ({len(data['by_code'])} materials)")
+
+        index = MaterialIndex(data)
+        _cache[key] = index
+        return index
+
+
+def main(argv=None):
+    from scripts.run_pipeline import load_config, resolve
+
+    cfg = load_config()
+    base_dir = cfg["base_dir"]
+    data_chem = resolve(base_dir, cfg["data"]["reference"]["data_chem"])
+    hs_code = resolve(base_dir, cfg["data"]["reference"]["hs_code"])
+
+    parser = argparse.ArgumentParser(description="Material master index (DATA_CHEM × HS_CODE).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="rebuild the cached index")
+    lookup = sub.add_parser("lookup", help="resolve one description or code")
+    lookup.add_argument("text")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        if os.path.exists(DEFAULT_CACHE_PATH):
+            os.remove(DEFAULT_CACHE_PATH)
+        index = load_index(data_chem, hs_code)
+        print(f"✅ Index → {DEFAULT_CACHE_PATH} ({len(index)} materials)")
+        return 0
+
+    entry = load_index(data_chem, hs_code).lookup(kode_barang=args.text, uraian=args.text)
+    print(json.dumps(entry, indent=4, ensure_ascii=False) if entry else "Not found")
+    return 0 if entry else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# --------------------------------------------------
+# IN-PROCESS METRICS REGISTRY
+# --------------------------------------------------
+# Small Prometheus-compatible registry (text exposition format 0.0.4).
+# Kept dependency-free so the pipeline scripts can record metrics
+# whether they run under FastAPI, a worker or a CLI.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds. Gemini extraction dominates (tens of seconds), Excel stages
+# usually sit well below one second.
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + list(extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, None, value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def samples(self):
+        for key, entry in self.values.items():
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                yield f"{self.name}_bucket", key, [("le", _format_value(bound))], count
+            yield f"{self.name}_sum", key, None, entry["sum"]
+            yield f"{self.name}_count", key, None, entry["count"]
+
+
+REGISTRY = []
+
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+STAGE_SECONDS = _register(Histogram(
+    "inabata_stage_duration_seconds",
+    "Wall-clock latency of each pipeline stage.",
+))
+STAGE_IN_FLIGHT = _register(Gauge(
+    "inabata_stage_in_flight",
+    "Number of jobs currently executing each stage.",
+))
+STAGE_ERRORS = _register(Counter(
+    "inabata_stage_errors_total",
+    "Number of stage executions that raised an exception.",
+))
+JOBS_TOTAL = _register(Counter(
+    "inabata_jobs_total",
+    "Pipeline jobs finished, by outcome.",
+))
+QUEUE_DEPTH = _register(Gauge(
+    "inabata_queue_depth",
+    "Jobs waiting to start, by queue (api: accepted by this API process; shared: the worker queue).",
+))
+PIPELINE_QUEUED = _register(Gauge(
+    "inabata_pipeline_queued",
+    "Jobs waiting for a stage pool of the staged pipeline, by stage.",
+))
+ADMISSION_JOBS = _register(Gauge(
+    "inabata_admission_jobs",
+    "Requests admitted to /api/process-docs, by lane and state (waiting/active).",
+))
+ADMISSION_REJECTED = _register(Counter(
+    "inabata_admission_rejected_total",
+    "Requests refused with 429 because their lane's queue was full, by lane.",
+))
+PDF_BYTES = _register(Counter(
+    "inabata_pdf_bytes_total",
+    "Size of the PDFs sent to Gemini, by version (original/uploaded).",
+))
+GEMINI_TOKENS = _register(Counter(
+    "inabata_gemini_tokens_total",
+    "Tokens reported by Gemini, by kind (input/cached/output); see scripts/ledger.py.",
+))
+CACHE_LOOKUPS = _register(Counter(
+    "inabata_cache_lookups_total",
+    "Reference lookups, by cache and result (hit/miss).",
+))
+CUSTOMER_MATCHES = _register(Counter(
+    "inabata_customer_matches_total",
+    "Fuzzy matches of ENTITAS names against the customer list, by result (matched/unmatched).",
+))
+WORKSPACES_REMOVED = _register(Counter(
+    "inabata_workspaces_removed_total",
+    "Per-job scratch directories removed, by reason (finished/expired/orphaned).",
+))
+
+
+# --------------------------------------------------
+# HELPERS USED BY THE PIPELINE
+# --------------------------------------------------
+# Called as listener(name, status, seconds) with status "start", "end" or
+# "error" (seconds is None on start); scripts.progress registers one to
+# stream stage transitions to clients.
+STAGE_LISTENERS = []
+
+
+def _notify(name, status, seconds=None):
+    for listener in STAGE_LISTENERS:
+        try:
+            listener(name, status, seconds)
+        except Exception:
+            pass
+
+
+@contextmanager
+def stage(name):
+    """
+    Times one pipeline stage and tracks it as in-flight while it runs.
+    Exceptions are counted and re-raised unchanged.
+    """
+    STAGE_IN_FLIGHT.inc(stage=name)
+    _notify(name, "start")
+    started = time.perf_counter()
+    status = "end"
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, stage=name)
+        STAGE_IN_FLIGHT.dec(stage=name)
+        _notify(name, status, seconds)
+
+
+def record_stage(name, seconds, status="end"):
+    """Records a stage that was timed elsewhere (e.g. in a worker process)."""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    if status == "error":
+        STAGE_ERRORS.inc(stage=name)
+    _notify(name, status, seconds)
+
+
+def record_cache(cache, hit, count=1):
+    if count:
+        CACHE_LOOKUPS.inc(count, cache=cache, result="hit" if hit else "miss")
+
+
+def render_metrics():
+    lines = []
+    with _lock:
+        for metric in REGISTRY:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key, extra)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
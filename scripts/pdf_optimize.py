@@ -0,0 +1,566 @@
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import zlib
+from contextlib import contextmanager
+from io import BytesIO
+
+from scripts.metrics import PDF_BYTES, stage
+
+# --------------------------------------------------
+# PDF UPLOAD OPTIMIZER
+# --------------------------------------------------
+# Scanned packing lists arrive as image PDFs of several MB (300-600 DPI page
+# scans). Before the upload to Gemini, page images above target_dpi are
+# downsampled with Pillow and recompressed as JPEG; text, fonts and vector
+# content are copied unchanged. The optimized copy is only used for the
+# upload (in a temporary directory); the original stays in data/input for
+# audit.
+#
+# There is no PDF library in the requirements, so this reads the file at
+# object level: every "N G obj ... endobj" (including the contents of
+# compressed object streams) is copied as is, except image XObjects, and a
+# new cross-reference table is written. The resolution of an image is
+# estimated against the page size (scans cover the page), so logos and
+# small pictures are never touched. Anything not understood (encryption,
+# CMYK, 1-bit, PNG predictors, other filters) is left as it is; when
+# nothing gets smaller, or an object cannot be read or does not come back
+# in the rewritten file, the original is uploaded. Off by default
+# (tests/test_pdf_optimize.py has round trips of the supported layouts).
+#
+# config.yaml:
+#   pdf_optimize:
+#     enabled: false
+#     target_dpi: 150
+#     jpeg_quality: 80
+#     min_file_kb: 1024
+#
+#   python -m scripts.pdf_optimize scan.pdf -o scan.small.pdf --dpi 150
+
+DEFAULT_PAGE = (595.0, 842.0)  # A4 in points, when no MediaBox is found
+
+WHITESPACE = b"\x00\t\n\x0c\r "
+DELIMITERS = b"()<>[]{}/%"
+OBJ_PATTERN = re.compile(rb"(\d+)\s+(\d+)\s+obj\b")
+ENDOBJ_PATTERN = re.compile(rb"endobj\b")
+
+
+class Name(str):
+    pass
+
+
+class Literal(bytes):
+    """A (literal string), kept raw including the parentheses."""
+
+
+class Ref:
+    def __init__(self, num, gen):
+        self.num = num
+        self.gen = gen
+
+
+# --------------------------------------------------
+# OBJECT PARSER (the subset needed for dictionaries)
+# --------------------------------------------------
+class Parser:
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def skip(self):
+        data, n = self.data, len(self.data)
+        while self.pos < n:
+            c = data[self.pos]
+            if c in WHITESPACE:
+                self.pos += 1
+            elif c == 0x25:  # % comment
+                while self.pos < n and data[self.pos] not in b"\r\n":
+                    self.pos += 1
+            else:
+                break
+
+    def token(self):
+        self.skip()
+        start = self.pos
+        while self.pos < len(self.data) and self.data[self.pos] not in WHITESPACE + DELIMITERS:
+            self.pos += 1
+        return self.data[start:self.pos]
+
+    def value(self):
+        self.skip()
+        data = self.data
+        if data.startswith(b"<<", self.pos):
+            self.pos += 2
+            result = {}
+            while True:
+                self.skip()
+                if data.startswith(b">>", self.pos):
+                    self.pos += 2
+                    return result
+                key = self.value()
+                if not isinstance(key, Name):
+                    raise ValueError(f"dictionary key expected at {self.pos}")
+                result[str(key)] = self.value()
+        c = data[self.pos:self.pos + 1]
+        if c == b"[":
+            self.pos += 1
+            result = []
+            while True:
+                self.skip()
+                if data.startswith(b"]", self.pos):
+                    self.pos += 1
+                    return result
+                result.append(self.value())
+        if c == b"/":
+            self.pos += 1
+            raw = self.token()
+            return Name(re.sub(rb"#([0-9A-Fa-f]{2})", lambda m: bytes([int(m.group(1), 16)]), raw).decode("latin-1"))
+        if c == b"(":
+            return self.literal_string()
+        if c == b"<":
+            end = data.index(b">", self.pos)
+            hex_digits = re.sub(rb"\s", b"", data[self.pos + 1:end])
+            self.pos = end + 1
+            return bytes.fromhex((hex_digits + b"0" * (len(hex_digits) % 2)).decode("ascii"))
+        raw = self.token()
+        if not raw:
+            raise ValueError(f"unexpected byte {c!r} at {self.pos}")
+        if raw == b"true":
+            return True
+        if raw == b"false":
+            return False
+        if raw == b"null":
+            return None
+        if re.fullmatch(rb"[+-]?\d+", raw):
+            number = int(raw)
+            # "num gen R" is a reference
+            saved = self.pos
+            gen = self.token()
+            if re.fullmatch(rb"\d+", gen) and self.token() == b"R":
+                return Ref(number, int(gen))
+            self.pos = saved
+            return number
+        try:
+            return float(raw)
+        except ValueError:
+            return Name(raw.decode("latin-1"))  # bare keyword (obj, stream, R, ...)
+
+    def literal_string(self):
+        data, depth = self.data, 0
+        start = self.pos
+        while True:
+            c = data[self.pos]
+            if c == 0x5C:  # backslash escape
+                self.pos += 2
+                continue
+            if c == 0x28:
+                depth += 1
+            elif c == 0x29:
+                depth -= 1
+                if depth == 0:
+                    self.pos += 1
+                    return Literal(data[start:self.pos])
+            self.pos += 1
+
+
+def serialize(value):
+    if isinstance(value, bool):
+        return b"true" if value else b"false"
+    if value is None:
+        return b"null"
+    if isinstance(value, Name):
+        return b"/" + re.sub(
+            rb"[^!-~]|[#()<>\[\]{}/%]", lambda m: b"#%02X" % m.group(0)[0], value.encode("latin-1")
+        )
+    if isinstance(value, Ref):
+        return b"%d %d R" % (value.num, value.gen)
+    if isinstance(value, int):
+        return b"%d" % value
+    if isinstance(value, float):
+        return (b"%.6f" % value).rstrip(b"0").rstrip(b".")
+    if isinstance(value, Literal):
+        return bytes(value)
+    if isinstance(value, bytes):
+        return b"<" + value.hex().encode("ascii") + b">"
+    if isinstance(value, list):
+        return b"[" + b" ".join(serialize(v) for v in value) + b"]"
+    if isinstance(value, dict):
+        return b"<<" + b"".join(serialize(Name(k)) + b" " + serialize(v) for k, v in value.items()) + b">>"
+    raise TypeError(f"cannot serialize {type(value).__name__}")
+
+
+# --------------------------------------------------
+# FILE STRUCTURE
+# --------------------------------------------------
+class PdfObject:
+    def __init__(self, num, gen, body, value=None, stream=None):
+        self.num = num
+        self.gen = gen
+        self.body = body      # raw bytes between "obj" and "endobj"
+        self.value = value    # parsed dictionary / value
+        self.stream = stream  # raw stream data, if any
+
+
+def _stream_data(data, pos, length):
+    """(stream bytes, end position) for a stream keyword at pos."""
+    start = pos + len(b"stream")
+    if data.startswith(b"\r\n", start):
+        start += 2
+    elif data[start:start + 1] in (b"\n", b"\r"):
+        start += 1
+    if isinstance(length, int) and length >= 0:
+        after = Parser(data, start + length)
+        after.skip()
+        if data.startswith(b"endstream", after.pos):
+            return data[start:start + length], after.pos + len(b"endstream")
+    end = data.index(b"endstream", start)
+    stream_end = end
+    if data[stream_end - 2:stream_end] == b"\r\n":
+        stream_end -= 2
+    elif data[stream_end - 1:stream_end] in (b"\n", b"\r"):
+        stream_end -= 1
+    return data[start:stream_end], end + len(b"endstream")
+
+
+def read_objects(data):
+    """
+    Every indirect object in file order (later definitions win) plus the
+    trailer entries. Objects inside object streams are expanded. Raises
+    ValueError for an object that cannot be read, since rewriting the file
+    without it would lose content.
+    """
+    objects, trailer = {}, {}
+    pos = 0
+    while True:
+        match = OBJ_PATTERN.search(data, pos)
+        trailer_pos = data.find(b"trailer", pos, match.start() if match else len(data))
+        if trailer_pos >= 0:
+            parser = Parser(data, trailer_pos + len(b"trailer"))
+            try:
+                value = parser.value()
+                if isinstance(value, dict):
+                    trailer.update(value)
+            except (ValueError, IndexError):
+                pass
+        if not match:
+            break
+
+        num, gen = int(match.group(1)), int(match.group(2))
+        parser = Parser(data, match.end())
+        try:
+            value = parser.value()
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"cannot read object {num}: {e}")
+        parser.skip()
+        stream = None
+        if data.startswith(b"stream", parser.pos):
+            length = value.get("Length") if isinstance(value, dict) else None
+            if isinstance(length, Ref):
+                # Often defined after the stream; then endstream is searched for
+                length = objects[length.num].value if length.num in objects else None
+            stream, parser.pos = _stream_data(data, parser.pos, length)
+        end = ENDOBJ_PATTERN.search(data, parser.pos)
+        if not end:
+            raise ValueError(f"object {num} has no endobj")
+        body = data[match.end():end.start()]
+        obj = PdfObject(num, gen, body, value, stream)
+        pos = end.end()
+
+        kind = value.get("Type") if isinstance(value, dict) else None
+        if kind == "XRef":
+            trailer.update(value)
+            continue
+        if kind == "ObjStm" and stream is not None:
+            try:
+                objects.update(_expand_object_stream(value, stream))
+            except (ValueError, IndexError, KeyError, zlib.error) as e:
+                raise ValueError(f"cannot read object stream {num}: {e}")
+            continue
+        objects[num] = obj
+    return objects, trailer
+
+
+def _expand_object_stream(value, stream):
+    decoded = _decode_flate(value, stream)
+    first, count = value["First"], value["N"]
+    header = Parser(decoded)
+    pairs = [(header.value(), header.value()) for _ in range(count)]
+    result = {}
+    for i, (num, offset) in enumerate(pairs):
+        start = first + offset
+        end = first + pairs[i + 1][1] if i + 1 < count else len(decoded)
+        body = decoded[start:end].strip()
+        try:
+            parsed = Parser(body).value()
+        except (ValueError, IndexError):
+            # Copied as is; only image dictionaries need to be understood
+            parsed = None
+        result[num] = PdfObject(num, 0, b" " + body + b" ", parsed)
+    return result
+
+
+def _filters(value):
+    filters = value.get("Filter")
+    if filters is None:
+        return []
+    return [str(f) for f in (filters if isinstance(filters, list) else [filters])]
+
+
+def _decode_flate(value, stream):
+    filters = _filters(value)
+    if filters != ["FlateDecode"]:
+        raise ValueError(f"unsupported object stream filters {filters}")
+    parms = value.get("DecodeParms") or {}
+    if isinstance(parms, dict) and parms.get("Predictor", 1) > 1:
+        raise ValueError("object stream with a predictor")
+    return zlib.decompress(stream)
+
+
+def write_pdf(version, objects, trailer):
+    out = BytesIO()
+    out.write(version + b"\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for num in sorted(objects):
+        obj = objects[num]
+        offsets[num] = (out.tell(), obj.gen)
+        out.write(b"%d %d obj" % (num, obj.gen))
+        out.write(obj.body)
+        out.write(b"endobj\n")
+
+    size = max(objects, default=0) + 1
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n" % size)
+    out.write(b"0000000000 65535 f\r\n")
+    for num in range(1, size):
+        if num in offsets:
+            out.write(b"%010d %05d n\r\n" % offsets[num])
+        else:
+            out.write(b"0000000000 00000 f\r\n")
+    entries = {"Size": size}
+    for key in ("Root", "Info", "ID"):
+        if key in trailer:
+            entries[key] = trailer[key]
+    out.write(b"trailer\n" + serialize(entries) + b"\nstartxref\n%d\n%%%%EOF\n" % xref)
+    return out.getvalue()
+
+
+# --------------------------------------------------
+# IMAGES
+# --------------------------------------------------
+def _resolve(objects, value):
+    while isinstance(value, Ref):
+        obj = objects.get(value.num)
+        value = obj.value if obj else None
+    return value
+
+
+def page_size(objects):
+    """Largest (short, long) MediaBox side in points over all pages."""
+    short, long = 0.0, 0.0
+    for obj in objects.values():
+        if not isinstance(obj.value, dict) or obj.value.get("Type") not in ("Page", "Pages"):
+            continue
+        box = _resolve(objects, obj.value.get("MediaBox"))
+        if isinstance(box, list) and len(box) == 4:
+            box = [_resolve(objects, v) for v in box]
+            w, h = abs(box[2] - box[0]), abs(box[3] - box[1])
+            short, long = max(short, min(w, h)), max(long, max(w, h))
+    return (short, long) if short and long else DEFAULT_PAGE
+
+
+def _image_mode(objects, value):
+    """Pillow mode of a raw (Flate) image, or None when unsupported."""
+    space = _resolve(objects, value.get("ColorSpace"))
+    if _resolve(objects, value.get("BitsPerComponent")) != 8:
+        return None
+    if space == "DeviceGray":
+        return "L"
+    if space == "DeviceRGB":
+        return "RGB"
+    if isinstance(space, list) and len(space) == 2 and space[0] == "ICCBased":
+        profile = _resolve(objects, space[1])
+        components = profile.get("N") if isinstance(profile, dict) else None
+        return {1: "L", 3: "RGB"}.get(components)
+    return None
+
+
+def _load_image(objects, value, stream):
+    from PIL import Image
+
+    if value.get("ImageMask") or value.get("Decode") is not None:
+        return None
+    filters = _filters(value)
+    if filters == ["DCTDecode"]:
+        image = Image.open(BytesIO(stream))
+        return image if image.mode in ("L", "RGB") else None
+    if filters == ["FlateDecode"]:
+        parms = _resolve(objects, value.get("DecodeParms")) or {}
+        if isinstance(parms, dict) and parms.get("Predictor", 1) > 1:
+            return None
+        mode = _image_mode(objects, value)
+        if mode is None:
+            return None
+        size = (_resolve(objects, value["Width"]), _resolve(objects, value["Height"]))
+        raw = zlib.decompress(stream)
+        return Image.frombytes(mode, size, raw[:size[0] * size[1] * len(mode)])
+    return None
+
+
+def optimize_pdf(data, target_dpi=150, jpeg_quality=80, min_pixels=500_000):
+    """
+    Returns (bytes, {"images", "resampled", "original", "optimized"}). The
+    input is returned unchanged when it cannot be rewritten or nothing
+    gets smaller.
+    """
+    from PIL import Image
+
+    stats = {"images": 0, "resampled": 0, "original": len(data), "optimized": len(data)}
+    header = re.match(rb"%PDF-\d\.\d", data)
+    if not header:
+        raise ValueError("not a PDF file")
+    objects, trailer = read_objects(data)
+    if "Encrypt" in trailer or "Root" not in trailer:
+        return data, stats
+
+    short_in, long_in = (side / 72.0 for side in page_size(objects))
+    changed = False
+    for obj in objects.values():
+        value = obj.value
+        if obj.stream is None or not isinstance(value, dict) or value.get("Subtype") != "Image":
+            continue
+        stats["images"] += 1
+        width, height = _resolve(objects, value.get("Width")), _resolve(objects, value.get("Height"))
+        if not isinstance(width, int) or not isinstance(height, int) or width * height < min_pixels:
+            continue
+        # Resolution the image would have if it covered the page
+        dpi = min(min(width, height) / short_in, max(width, height) / long_in)
+        scale = target_dpi / dpi
+        if scale > 0.85:
+            continue
+        try:
+            image = _load_image(objects, value, obj.stream)
+        except Exception:
+            image = None
+        if image is None:
+            continue
+
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        resized = image.resize(size, Image.LANCZOS)
+        encoded = BytesIO()
+        resized.save(encoded, "JPEG", quality=jpeg_quality, optimize=True)
+        encoded = encoded.getvalue()
+        if len(encoded) >= len(obj.stream):
+            continue
+
+        new_value = {k: v for k, v in value.items() if k not in ("DecodeParms", "Filter", "Length")}
+        new_value.update(
+            Width=size[0],
+            Height=size[1],
+            BitsPerComponent=8,
+            Filter=Name("DCTDecode"),
+            Length=len(encoded),
+        )
+        if "ColorSpace" not in value:
+            # Only L / RGB images get here, so an existing colour space still fits
+            new_value["ColorSpace"] = Name("DeviceGray" if resized.mode == "L" else "DeviceRGB")
+        obj.body = b"\n" + serialize(new_value) + b"\nstream\n" + encoded + b"\nendstream\n"
+        stats["resampled"] += 1
+        changed = True
+
+    if not changed:
+        return data, stats
+    result = write_pdf(header.group(0), objects, trailer)
+    if len(result) >= len(data):
+        return data, stats
+    if set(read_objects(result)[0]) != set(objects):
+        raise ValueError("rewritten file lost objects")
+    stats["optimized"] = len(result)
+    return result, stats
+
+
+# --------------------------------------------------
+# PIPELINE HOOK
+# --------------------------------------------------
+_settings = None
+
+
+def optimize_settings():
+    global _settings
+    if _settings is None:
+        from scripts.run_pipeline import load_config
+
+        _settings = load_config().get("pdf_optimize") or {}
+    return _settings
+
+
+@contextmanager
+def optimized_for_upload(*paths):
+    """
+    Yields the paths to upload: an optimized copy in a temporary directory
+    for each PDF that got smaller, the original path otherwise.
+    """
+    settings = optimize_settings()
+    if not settings.get("enabled", False):
+        yield paths
+        return
+
+    min_bytes = int(settings.get("min_file_kb", 1024)) * 1024
+    with tempfile.TemporaryDirectory(prefix="inabata_upload_") as work_dir:
+        uploads = []
+        for i, path in enumerate(paths):
+            size = os.path.getsize(path)
+            upload = path
+            if size >= min_bytes:
+                try:
+                    with stage("pdf_optimize"):
+                        with open(path, "rb") as f:
+                            data, stats = optimize_pdf(
+                                f.read(),
+                                settings.get("target_dpi", 150),
+                                settings.get("jpeg_quality", 80),
+                            )
+                    if stats["optimized"] < size:
+                        upload = os.path.join(work_dir, f"{i}_{os.path.basename(path)}")
+                        with open(upload, "wb") as f:
+                            f.write(data)
+                        print(f"   > Optimized {os.path.basename(path)}: {size / 1024:.0f} KB → "
+                              f"{len(data) / 1024:.0f} KB ({stats['resampled']}/{stats['images']} images)")
+                except Exception as e:
+                    print(f"   ! Warning: Could not optimize {os.path.basename(path)}, uploading the original: {e}")
+            PDF_BYTES.inc(size, version="original")
+            PDF_BYTES.inc(os.path.getsize(upload), version="uploaded")
+            uploads.append(upload)
+        yield tuple(uploads)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Downsample the page images of a scanned PDF.")
+    parser.add_argument("pdf")
+    parser.add_argument("-o", "--output", help="output path (default: <name>.optimized.pdf)")
+    parser.add_argument("--dpi", type=int, default=150, help="target resolution (default 150)")
+    parser.add_argument("--quality", type=int, default=80, help="JPEG quality (default 80)")
+    args = parser.parse_args(argv)
+
+    with open(args.pdf, "rb") as f:
+        data = f.read()
+    try:
+        result, stats = optimize_pdf(data, args.dpi, args.quality)
+    except (ValueError, KeyError, zlib.error) as e:
+        print(f"❌ {e}")
+        return 1
+    output = args.output or f"{os.path.splitext(args.pdf)[0]}.optimized.pdf"
+    if result is data:
+        shutil.copyfile(args.pdf, output)
+    else:
+        with open(output, "wb") as f:
+            f.write(result)
+    print(f"✅ {stats['original'] / 1024:.0f} KB → {stats['optimized'] / 1024:.0f} KB, "
+          f"{stats['resampled']} of {stats['images']} image(s) resampled → {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
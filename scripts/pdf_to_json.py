@@ -2,19 +2,39 @@ import json
 import os
 import re  # Added for filename sanitization
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+
+from scripts.ledger import ledger_call
+from scripts.metrics import stage
+from scripts.profiling import thread_profiled
 
 # --------------------------------------------------
 # ENV SETUP
 # --------------------------------------------------
 load_dotenv()
 
-API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
-    raise EnvironmentError("GEMINI_API_KEY not found in environment")
+_client = None
+
+MODEL = "gemini-2.5-flash"
 
-client = genai.Client(api_key=API_KEY)
+
+def get_client():
+    """
+    Creates the Gemini client on first use, so importing this module (e.g.
+    for benchmarks with a stub extractor) does not require an API key.
+    """
+    global _client
+    if _client is None:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise EnvironmentError("GEMINI_API_KEY not found in environment")
+        # google-genai is slow to import; only load it when a call is made
+        from google import genai
+        # GEMINI_BASE_URL points the client at another endpoint, e.g. the
+        # load-test stand-in (python -m scripts.fake_gemini)
+        base_url = os.getenv("GEMINI_BASE_URL")
+        http_options = {"base_url": base_url} if base_url else None
+        _client = genai.Client(api_key=api_key, http_options=http_options)
+    return _client
 
 
 # --------------------------------------------------
@@ -105,37 +125,220 @@ CRITICAL RULES
 # --------------------------------------------------
 # GEMINI EXTRACTION
 # --------------------------------------------------
-def extract_with_gemini(invoice_pdf, packing_pdf):
+def _upload_documents(invoice_pdf, packing_pdf):
+    """Uploads both PDFs; returns {"invoice": File, "packing": File}."""
     # Validate paths
     if not os.path.exists(invoice_pdf):
         raise FileNotFoundError(f"Invoice PDF not found → {invoice_pdf}")
     if not os.path.exists(packing_pdf):
         raise FileNotFoundError(f"Packing List PDF not found → {packing_pdf}")
 
-    # Upload PDF files to Gemini Files API
-    invoice_file = client.files.upload(file=invoice_pdf, config={"mime_type": "application/pdf"})
-    packing_file = client.files.upload(file=packing_pdf, config={"mime_type": "application/pdf"})
+    from scripts.pdf_optimize import optimized_for_upload
 
-    # Generate structured content with uploaded file references
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=[
-            build_prompt(),       # user prompt text
-            invoice_file,         # uploaded invoice
-            packing_file,         # uploaded packing list
-        ],
+    client = get_client()
+
+    def upload(path, original):
+        with ledger_call("upload", document=os.path.basename(original), upload_bytes=os.path.getsize(path)):
+            return client.files.upload(file=path, config={"mime_type": "application/pdf"})
+
+    # Scans are downsampled first (pdf_optimize); the originals stay on disk
+    with optimized_for_upload(invoice_pdf, packing_pdf) as (invoice_upload, packing_upload):
+        # Upload PDF files to Gemini Files API
+        with stage("gemini_upload"):
+            invoice_file = upload(invoice_upload, invoice_pdf)
+            packing_file = upload(packing_upload, packing_pdf)
+    return {"invoice": invoice_file, "packing": packing_file}
+
+
+def _generate_request(contents, cached_content=None):
+    from google.genai import types
+
+    return dict(
+        model=MODEL,
+        contents=contents,
         config=types.GenerateContentConfig(
             temperature=0,
             response_mime_type="application/json",
+            cached_content=cached_content,
         ),
     )
 
+
+def _prompt_prefix():
+    """
+    The static instructions for a request: ([], cache name) when they are
+    held in the server-side prompt cache (scripts.prompt_cache), otherwise
+    ([prompt text], None).
+    """
+    from scripts.prompt_cache import get_prompt_cache
+
+    prompt = build_prompt()
+    cache = get_prompt_cache()
+    cached_content = cache.handle(get_client(), MODEL, prompt) if cache else None
+    return ([] if cached_content else [prompt]), cached_content
+
+
+def _generate(contents, call="generate"):
+    """
+    generate_content with the static prompt in front of `contents`. A cache
+    the service no longer knows (deleted, expired early) is dropped and the
+    request is sent once more with the prompt inline. Booked in the ledger
+    under `call`.
+    """
+    from scripts.prompt_cache import get_prompt_cache
+
+    prefix, cached_content = _prompt_prefix()
+    with ledger_call(call, model=MODEL, cache_hit=cached_content is not None) as entry:
+        try:
+            response = get_client().models.generate_content(**_generate_request(prefix + contents, cached_content))
+        except Exception as e:
+            if not cached_content or getattr(e, "code", None) not in (403, 404):
+                raise
+            print(f"   ! Warning: Prompt cache {cached_content} rejected ({e}); retrying with the prompt inline")
+            get_prompt_cache().invalidate(cached_content)
+            entry.update(retries=1, cache_hit=False)
+            response = get_client().models.generate_content(**_generate_request([build_prompt()] + contents))
+        entry["usage"] = response.usage_metadata
+        return response
+
+
+def extract_with_gemini(invoice_pdf, packing_pdf):
+    files = _upload_documents(invoice_pdf, packing_pdf)
+
+    # Generate structured content with uploaded file references
+    with stage("generate"):
+        response = _generate([files["invoice"], files["packing"]])
+
     return json.loads(response.text)
 
 
 # --------------------------------------------------
-# SAVE JSON (MODIFIED)
+# FAN-OUT EXTRACTION (extraction.mode: fanout)
 # --------------------------------------------------
+# One call has to read both PDFs and write all five sheets, so its latency
+# is that of the longest output. Fan-out sends smaller requests at the same
+# time, each for a group of sheets from the documents it needs, and merges
+# the answers locally into the usual structure. The wall-clock time becomes
+# that of the slowest group (usually BARANG alone).
+#
+# (group, documents attached, sheets returned, extra instruction)
+FANOUT_GROUPS = [
+    ("header", ("invoice",), ("HEADER", "ENTITAS", "PENGANGKUT"), ""),
+    ("barang", ("invoice",), ("BARANG",), ""),
+    ("dokumen", ("invoice", "packing"), ("DOKUMEN",), ""),
+    ("weights", ("packing",), ("HEADER",),
+     "Only BRUTO and NETTO are needed: the total gross and net weight of the Packing List."),
+]
+
+SHEET_ORDER = ["HEADER", "ENTITAS", "DOKUMEN", "PENGANGKUT", "BARANG"]
+
+DOCUMENT_NAMES = {"invoice": "Commercial Invoice", "packing": "Packing List"}
+
+
+def scope_prompt(documents, sheets, note=""):
+    """Appended after build_prompt(): which PDFs are attached, which sheets to return."""
+    attached = " and the ".join(DOCUMENT_NAMES[d] for d in documents)
+    return (
+        "\n==================================================\n"
+        "SCOPE OF THIS REQUEST\n"
+        "==================================================\n"
+        f"Only the {attached} PDF is attached to this request.\n"
+        f"Return ONLY the following sheets: {', '.join(sheets)}.\n"
+        f"{note}\n"
+    )
+
+
+def _blank(value):
+    return value is None or str(value).strip() == ""
+
+
+def merge_fanout(results):
+    """
+    Combines {group: payload} into the single-call structure. BRUTO/NETTO
+    missing from the invoice HEADER are taken from the packing list.
+    """
+    merged = {}
+    for group, _, sheets, _ in FANOUT_GROUPS:
+        if group == "weights":
+            continue
+        for sheet in sheets:
+            if sheet in (results.get(group) or {}):
+                merged[sheet] = results[group][sheet]
+
+    header = merged.get("HEADER")
+    weights = (results.get("weights") or {}).get("HEADER")
+    if header and len(header) > 1 and weights and len(weights) > 1:
+        header_cols = [str(h).strip() for h in header[0]]
+        weight_cols = [str(h).strip() for h in weights[0]]
+        row = header[1]
+        for col in ("BRUTO", "NETTO"):
+            if col not in weight_cols or _blank(weights[1][weight_cols.index(col)]):
+                continue
+            if col not in header_cols:
+                header[0].append(col)
+                header_cols.append(col)
+            i = header_cols.index(col)
+            row.extend([""] * (i + 1 - len(row)))
+            if _blank(row[i]):
+                row[i] = weights[1][weight_cols.index(col)]
+
+    ordered = {sheet: merged[sheet] for sheet in SHEET_ORDER if sheet in merged}
+    ordered.update((sheet, rows) for sheet, rows in merged.items() if sheet not in ordered)
+    return ordered
+
+
+def extract_with_gemini_fanout(invoice_pdf, packing_pdf):
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor
+
+    files = _upload_documents(invoice_pdf, packing_pdf)
+
+    def generate(group, documents, sheets, note):
+        # The shared prompt comes from the cache; the scope is per request
+        with stage(f"generate_{group}"):
+            response = _generate(
+                [scope_prompt(documents, sheets, note)] + [files[d] for d in documents], call=f"generate_{group}"
+            )
+        return json.loads(response.text)
+
+    # Each thread keeps the job context (metrics / progress events / profile)
+    with stage("generate"), ThreadPoolExecutor(max_workers=len(FANOUT_GROUPS)) as pool:
+        futures = {
+            group: pool.submit(
+                contextvars.copy_context().run, thread_profiled(generate), group, documents, sheets, note
+            )
+            for group, documents, sheets, note in FANOUT_GROUPS
+        }
+        results = {group: future.result() for group, future in futures.items()}
+
+    return merge_fanout(results)
+
+
+def extract_with_gemini_stream(invoice_pdf, packing_pdf, on_sheet=None, stop=None):
+    """
+    Same request, streamed: on_sheet(name, rows) is called for each sheet as
+    soon as it is complete (see scripts.json_stream). Returns the whole
+    payload. Setting the `stop` event abandons the stream (returns None).
+    """
+    from scripts.json_stream import SheetStreamParser
+
+    files = _upload_documents(invoice_pdf, packing_pdf)
+    prefix, cached_content = _prompt_prefix()
+    request = _generate_request(prefix + [files["invoice"], files["packing"]], cached_content)
+    parser = SheetStreamParser(on_sheet)
+
+    with stage("generate"), ledger_call("stream", model=MODEL, cache_hit=cached_content is not None) as entry:
+        for chunk in get_client().models.generate_content_stream(**request):
+            # Usage metadata comes with the final chunk
+            entry["usage"] = chunk.usage_metadata or entry.get("usage")
+            if stop is not None and stop.is_set():
+                entry["status"] = "abandoned"
+                return None
+            parser.feed(chunk.text)
+
+    return parser.close()
+
+
 def save_to_json(data, output_dir, filename=None):
     """
     Saves JSON data. 
@@ -0,0 +1,211 @@
+import cProfile
+import contextvars
+import functools
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# --------------------------------------------------
+# PER-JOB PROFILING (OPT-IN)
+# --------------------------------------------------
+# Captures a CPU profile (cProfile) and a peak-memory allocation snapshot
+# (tracemalloc) for a single pipeline job and writes them under
+# state/profiles/ named after the job ID:
+#
+#   <job_id>.prof        → load with `python -m pstats` or snakeviz
+#   <job_id>.cpu.txt     → top functions by cumulative time
+#   <job_id>.memory.txt  → peak traced memory and top allocation sites
+#
+# Up to Python 3.11 cProfile only sees the thread that enabled it. Threads
+# the job starts itself (the streaming producer, the fan-out requests) wrap
+# their target in thread_profiled(), which profiles that thread too; the
+# reports merge all of them. Other threads (e.g. inside HTTP client
+# libraries) are not covered. From 3.12 a profiler covers every thread of
+# the process, and tracemalloc always traces the whole process.
+#
+# So a profiled job runs alone: every pipeline job enters profile_job, and
+# a profiled one waits for the running jobs to finish and holds off new ones
+# until its reports are written. Requests outside the pipeline (amend,
+# replay, exports) are not held off; the report headers say what they cover.
+#
+# When profiling is off the context manager only takes a shared slot.
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_PROFILE_DIR = os.path.join(ROOT_DIR, "state", "profiles")
+
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+# Python 3.12+: one profiler sees all threads, and no second one can start
+ALL_THREADS = sys.version_info >= (3, 12)
+
+# Profilers of the job's worker threads, for the job running in this context
+_thread_profiles = contextvars.ContextVar("inabata_thread_profiles", default=None)
+
+
+def should_profile(requested=False, sample_rate=0.0):
+    """True if the caller asked for it, or the job is picked by the sampling rate."""
+    if requested:
+        return True
+    return bool(sample_rate) and random.random() < float(sample_rate)
+
+
+def _resolve_dir(output_dir):
+    if not output_dir:
+        return DEFAULT_PROFILE_DIR
+    if os.path.isabs(output_dir):
+        return output_dir
+    return os.path.join(ROOT_DIR, output_dir)
+
+
+class JobGate:
+    """Pipeline jobs of this process: any number share it, a profiled one holds it alone."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._running = 0
+        self._exclusive = False
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._exclusive)
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._exclusive)
+            self._exclusive = True
+            self._cond.wait_for(lambda: self._running == 0)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+_gate = JobGate()
+
+
+class ThreadProfiles:
+    def __init__(self):
+        self.profilers = []
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def add(self, profiler):
+        with self._lock:
+            self.profilers.append(profiler)
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+
+def thread_profiled(fn):
+    """
+    Wraps the target of a thread started by the job: when the job is being
+    profiled, the thread runs under its own profiler, merged into the
+    job's report. Call it inside the job's context (contextvars).
+    """
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        collector = _thread_profiles.get()
+        if collector is None or ALL_THREADS:
+            # 3.12+: already covered by the job's profiler
+            return fn(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            collector.skip()
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            collector.add(profiler)
+    return run
+
+
+@contextmanager
+def profile_job(job_id, enabled=False, output_dir=None):
+    if not enabled:
+        with _gate.shared():
+            yield
+        return
+
+    with _gate.exclusive():
+        with _profiled(job_id, output_dir):
+            yield
+
+
+@contextmanager
+def _profiled(job_id, output_dir):
+    profiler = cProfile.Profile()
+    threads = ThreadProfiles()
+    token = _thread_profiles.set(threads)
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            if not was_tracing:
+                tracemalloc.stop()
+            _write_reports(job_id, profiler, threads, peak, snapshot, _resolve_dir(output_dir))
+    finally:
+        _thread_profiles.reset(token)
+
+
+def _write_reports(job_id, profiler, threads, peak, snapshot, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    base = os.path.join(output_dir, str(job_id))
+
+    buffer = io.StringIO()
+    stats = pstats.Stats(profiler, stream=buffer)
+    for thread_profiler in threads.profilers:
+        stats.add(thread_profiler)
+    stats.dump_stats(f"{base}.prof")
+
+    buffer.write(f"Job: {job_id}\n")
+    if ALL_THREADS:
+        buffer.write("Threads profiled: every thread of the process (Python 3.12+)\n")
+        buffer.write("Other pipeline jobs were held off; other requests to this process are included.\n\n")
+    else:
+        buffer.write(f"Threads profiled: job thread + {len(threads.profilers)} worker thread(s)\n")
+        if threads.skipped:
+            buffer.write(f"Not profiled: {threads.skipped} worker thread(s) (another profiler was active)\n")
+        buffer.write("Threads started by libraries (e.g. HTTP clients) are not included.\n\n")
+    stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    with open(f"{base}.cpu.txt", "w", encoding="utf-8") as f:
+        f.write(buffer.getvalue())
+
+    with open(f"{base}.memory.txt", "w", encoding="utf-8") as f:
+        f.write(f"Job: {job_id}\n")
+        f.write(f"Peak traced memory: {peak / (1024 * 1024):.2f} MiB\n")
+        f.write("Traced memory is process-wide: other pipeline jobs were held off, other requests count.\n\n")
+        f.write(f"Top {TOP_ALLOCATIONS} allocation sites still alive at job end:\n")
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+            f.write(f"{stat}\n")
+
+    print(f"   > Profile written → {base}.prof / .cpu.txt / .memory.txt")
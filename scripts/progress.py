@@ -0,0 +1,122 @@
+import asyncio
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from scripts.metrics import STAGE_LISTENERS
+
+# --------------------------------------------------
+# JOB PROGRESS EVENTS
+# --------------------------------------------------
+# In-process event bus behind GET /api/process-docs/{job_id}/events (SSE).
+# Every metrics.stage() that runs while current_job is set (track_job) is
+# published as a "stage" event; main.py adds "accepted", "done" (with the
+# download link) and "failed". Events are kept per job for a while, so a
+# client that subscribes late still receives the whole sequence.
+
+TERMINAL_EVENTS = ("done", "failed")
+
+current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class ProgressBus:
+    def __init__(self, keep_seconds=900, max_events=500):
+        self.keep_seconds = keep_seconds
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._events = {}       # job_id → [event, ...]
+        self._finished = {}     # job_id → time of the terminal event
+        self._subscribers = {}  # job_id → [(loop, asyncio.Queue), ...]
+
+    def publish(self, job_id, event, **data):
+        """Thread-safe; may be called from the pipeline's worker threads."""
+        entry = {"event": event, "job_id": job_id, "time": time.time(), **data}
+        with self._lock:
+            self._prune()
+            events = self._events.setdefault(job_id, [])
+            if len(events) < self.max_events:
+                events.append(entry)
+            if event in TERMINAL_EVENTS:
+                self._finished[job_id] = entry["time"]
+            subscribers = list(self._subscribers.get(job_id, []))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, entry)
+        return entry
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_seconds
+        for job_id, finished_at in list(self._finished.items()):
+            if finished_at < cutoff:
+                self._finished.pop(job_id, None)
+                self._events.pop(job_id, None)
+
+    def history(self, job_id):
+        with self._lock:
+            return list(self._events.get(job_id, []))
+
+    async def subscribe(self, job_id, heartbeat=15.0):
+        """
+        Yields past and live events of one job until its terminal event.
+        Yields None every `heartbeat` seconds without events (keep-alive).
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        with self._lock:
+            past = list(self._events.get(job_id, []))
+            self._subscribers.setdefault(job_id, []).append((loop, queue))
+        try:
+            for entry in past:
+                yield entry
+                if entry["event"] in TERMINAL_EVENTS:
+                    return
+            while True:
+                try:
+                    entry = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield entry
+                if entry["event"] in TERMINAL_EVENTS:
+                    return
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(job_id, [])
+                if (loop, queue) in subscribers:
+                    subscribers.remove((loop, queue))
+                if not subscribers:
+                    self._subscribers.pop(job_id, None)
+
+
+BUS = ProgressBus()
+
+
+def _on_stage(name, status, seconds):
+    job_id = current_job.get()
+    if job_id is None:
+        return
+    data = {"stage": name, "status": status}
+    if seconds is not None:
+        data["seconds"] = round(seconds, 3)
+    BUS.publish(job_id, "stage", **data)
+
+
+STAGE_LISTENERS.append(_on_stage)
+
+
+@contextmanager
+def track_job(job_id):
+    """Stages run in this context (and threads started from it) report to job_id."""
+    token = current_job.set(job_id)
+    try:
+        yield
+    finally:
+        current_job.reset(token)
+
+
+def format_sse(entry):
+    """One Server-Sent Events frame; None becomes a keep-alive comment."""
+    if entry is None:
+        return ": keep-alive\n\n"
+    return f"event: {entry['event']}\ndata: {json.dumps(entry, ensure_ascii=False)}\n\n"
@@ -0,0 +1,150 @@
+import hashlib
+import threading
+import time
+
+from scripts.metrics import record_cache, stage
+
+# --------------------------------------------------
+# SERVER-SIDE PROMPT CACHE
+# --------------------------------------------------
+# build_prompt() is the same long instruction block for every shipment. It
+# is registered once as cached content with Gemini (client.caches), and
+# extraction requests reference the cache instead of resending the text, so
+# those input tokens are not processed (and billed) in full again.
+#
+# The handle is kept per (model, prompt hash): a changed prompt gets a new
+# cache. When a handle is within refresh_margin_seconds of expiring, its TTL
+# is extended in the background while requests keep using it; an expired or
+# deleted cache is recreated on the next request. If the provider refuses
+# to cache (e.g. the prompt is below the model's minimum size), requests
+# send the prompt inline and creation is retried after retry_after_seconds.
+#
+# config.yaml:
+#   prompt_cache:
+#     enabled: true
+#     ttl_seconds: 3600
+#     refresh_margin_seconds: 300
+#     retry_after_seconds: 600
+
+DISPLAY_NAME = "inabata-extraction-prompt"
+
+
+class PromptCache:
+    def __init__(self, ttl_seconds=3600, refresh_margin_seconds=300, retry_after_seconds=600):
+        self.ttl = int(ttl_seconds)
+        self.margin = min(float(refresh_margin_seconds), self.ttl / 2)
+        self.retry_after = float(retry_after_seconds)
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+        self._entries = {}        # (model, prompt hash) → {"name", "expires_at"}
+        self._refreshing = set()
+        self._failed_at = {}      # key → time of the last failed create
+
+    def handle(self, client, model, prompt):
+        """Name of the cached content holding `prompt`, or None to send it inline."""
+        key = (model, hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        name = self._lookup(client, key)
+        if name is not None:
+            return name
+        # One create at a time: concurrent requests (fan-out) wait for it
+        # instead of each registering a copy
+        with self._create_lock:
+            name = self._lookup(client, key)
+            if name is not None:
+                return name
+            if time.time() - self._failed_at.get(key, 0) < self.retry_after:
+                return None
+            record_cache("prompt", False)
+            return self._create(client, key, prompt)
+
+    def _lookup(self, client, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry["expires_at"] - now <= 5:
+                return None
+            if entry["expires_at"] - now <= self.margin and key not in self._refreshing:
+                # Still valid: extend it without holding up this request
+                self._refreshing.add(key)
+                threading.Thread(target=self._refresh, args=(client, key, entry["name"]), daemon=True).start()
+            record_cache("prompt", True)
+            return entry["name"]
+
+    def _create(self, client, key, prompt):
+        from google.genai import types
+
+        model = key[0]
+        try:
+            with stage("prompt_cache_create"):
+                cached = client.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        contents=[prompt],
+                        display_name=DISPLAY_NAME,
+                        ttl=f"{self.ttl}s",
+                    ),
+                )
+        except Exception as e:
+            print(f"   ! Warning: Prompt cache unavailable, sending the prompt inline: {e}")
+            with self._lock:
+                self._failed_at[key] = time.time()
+            return None
+
+        with self._lock:
+            self._entries[key] = {"name": cached.name, "expires_at": self._expiry(cached)}
+            self._failed_at.pop(key, None)
+        print(f"   > Prompt cached as {cached.name} (ttl {self.ttl}s)")
+        return cached.name
+
+    def _refresh(self, client, key, name):
+        from google.genai import types
+
+        try:
+            with stage("prompt_cache_refresh"):
+                cached = client.caches.update(
+                    name=name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+                )
+            with self._lock:
+                self._entries[key] = {"name": name, "expires_at": self._expiry(cached)}
+        except Exception as e:
+            # Gone or not refreshable: the next request creates a new one
+            print(f"   ! Warning: Could not refresh prompt cache {name}: {e}")
+            with self._lock:
+                self._entries.pop(key, None)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _expiry(self, cached):
+        expire_time = getattr(cached, "expire_time", None)
+        return expire_time.timestamp() if expire_time else time.time() + self.ttl
+
+    def invalidate(self, name):
+        """Forgets a handle the provider no longer knows (e.g. a 404 on use)."""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry["name"] == name:
+                    del self._entries[key]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prompt_cache():
+    """Shared PromptCache configured from config.yaml, or None when disabled."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            from scripts.run_pipeline import load_config
+
+            settings = load_config().get("prompt_cache") or {}
+            if not settings.get("enabled", False):
+                _cache = False
+            else:
+                _cache = PromptCache(
+                    settings.get("ttl_seconds", 3600),
+                    settings.get("refresh_margin_seconds", 300),
+                    settings.get("retry_after_seconds", 600),
+                )
+        return _cache or None
@@ -0,0 +1,450 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from datetime import date, datetime
+
+# --------------------------------------------------
+# COMPILED REFERENCE SNAPSHOT
+# --------------------------------------------------
+# Every process that runs post-processing used to parse LIST_OF_CUSTOMER,
+# HS_CODE (and DATA_CHEM for the material master) with pandas and keep its
+# own dictionaries. Here the three spreadsheets are compiled once into a
+# single binary file that each process memory-maps read-only: the pages
+# live in the OS page cache, so N workers share one copy, and opening it
+# costs a few syscalls instead of an Excel parse.
+#
+# Layout (little-endian):
+#
+#   b"INABREF1" | u32 header length | header JSON | sections
+#
+# The header holds the source files (path, mtime, size), the section
+# offsets and the customer list's O2 cell. A keyed section is
+#
+#   u32 count | count × (u32 key off, u32 key len, u32 value off, u32 value len) | blob
+#
+# with the entries sorted by UTF-8 key, so a lookup is a binary search over
+# the mapped bytes; only the matching value (JSON) is decoded.
+#
+# The snapshot is compiled at deploy time, or on first use after one of the
+# spreadsheets changes (auto_compile). When it is disabled or does not cover
+# the requested files, callers read the spreadsheets as before.
+#
+#   python -m scripts.ref_snapshot compile
+#   python -m scripts.ref_snapshot info
+#   python -m scripts.ref_snapshot lookup hs "BUTYL TRI GLYCOL"
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_PATH = os.path.join(ROOT_DIR, "state", "reference_snapshot.bin")
+MAGIC = b"INABREF1"
+SNAPSHOT_VERSION = 1
+
+_ENTRY = struct.Struct("<IIII")
+_U32 = struct.Struct("<I")
+
+
+# --------------------------------------------------
+# VALUE ENCODING
+# --------------------------------------------------
+def _plain(value):
+    """Python value of a pandas / numpy cell; datetimes tagged for JSON."""
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if hasattr(value, "to_pydatetime"):
+        # pandas Timestamp / NaT (both datetime subclasses)
+        return None if value != value else {"$datetime": value.to_pydatetime().isoformat()}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    if hasattr(value, "item"):
+        return _plain(value.item())
+    return str(value)
+
+
+def _revive(obj):
+    if len(obj) == 1:
+        if "$datetime" in obj:
+            return datetime.fromisoformat(obj["$datetime"])
+        if "$date" in obj:
+            return date.fromisoformat(obj["$date"])
+    return obj
+
+
+def encode_value(value):
+    # NaN is kept (the customer rows carry it for empty cells)
+    return json.dumps(_plain(value), ensure_ascii=False, allow_nan=True).encode("utf-8")
+
+
+def decode_value(data):
+    return json.loads(data, object_hook=_revive)
+
+
+def pack_table(items):
+    """{str key: value} → keyed section bytes."""
+    entries = sorted((str(k).encode("utf-8"), encode_value(v)) for k, v in items.items())
+    index = bytearray()
+    blob = bytearray()
+    for key, value in entries:
+        index += _ENTRY.pack(len(blob), len(key), len(blob) + len(key), len(value))
+        blob += key
+        blob += value
+    return _U32.pack(len(entries)) + bytes(index) + bytes(blob)
+
+
+class SortedTable:
+    """Read-only mapping over a keyed section: get / in / [] / len."""
+
+    def __init__(self, buffer, offset):
+        self._buffer = buffer
+        self._count = _U32.unpack_from(buffer, offset)[0]
+        self._index = offset + _U32.size
+        self._blob = self._index + self._count * _ENTRY.size
+
+    def __len__(self):
+        return self._count
+
+    def _find(self, key):
+        target = str(key).encode("utf-8")
+        buffer, index, blob = self._buffer, self._index, self._blob
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key_off, key_len, value_off, value_len = _ENTRY.unpack_from(buffer, index + mid * _ENTRY.size)
+            current = buffer[blob + key_off:blob + key_off + key_len]
+            if current == target:
+                return buffer[blob + value_off:blob + value_off + value_len]
+            if current < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def get(self, key, default=None):
+        if key is None:
+            return default
+        data = self._find(key)
+        return default if data is None else decode_value(data)
+
+    def __contains__(self, key):
+        return key is not None and self._find(key) is not None
+
+    def __getitem__(self, key):
+        data = self._find(key)
+        if data is None:
+            raise KeyError(key)
+        return decode_value(data)
+
+    def keys(self):
+        for i in range(self._count):
+            key_off, key_len, _, _ = _ENTRY.unpack_from(self._buffer, self._index + i * _ENTRY.size)
+            yield self._buffer[self._blob + key_off:self._blob + key_off + key_len].decode("utf-8")
+
+
+class CustomerTable:
+    """
+    The customer list as excel_postprocess uses it: `names` (NAMA ENTITAS in
+    sheet order, for the fuzzy match) and row(name), the first row with that
+    name as {column: value}.
+    """
+
+    def __init__(self, names, rows):
+        self.names = names
+        self._rows = rows
+
+    @property
+    def empty(self):
+        return len(self._rows) == 0
+
+    def row(self, name):
+        return self._rows[name]
+
+    def get(self, name):
+        return self._rows.get(name)
+
+
+# --------------------------------------------------
+# COMPILE
+# --------------------------------------------------
+def _source_info(path):
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def compile_snapshot(customer_ref, hs_code_ref, data_chem_ref=None, path=DEFAULT_PATH):
+    """
+    Parses the reference spreadsheets and writes the snapshot to `path`
+    (atomically). DATA_CHEM is optional: without it the snapshot has no
+    material master. Returns the header.
+    """
+    from scripts.excel_postprocess import read_customer_o2, read_customers, read_hs_map
+    from scripts.metrics import stage
+
+    with stage("reference_compile"):
+        df_customers = read_customers(customer_ref)
+        names = (
+            df_customers["NAMA ENTITAS"].dropna().astype(str).tolist()
+            if "NAMA ENTITAS" in df_customers.columns else []
+        )
+        customer_rows = {}
+        for row in df_customers.to_dict("records"):
+            name = row.get("NAMA ENTITAS")
+            # Same as the DataFrame filter: the first row with the name wins
+            if name is not None and name == name:
+                customer_rows.setdefault(str(name), row)
+
+        sections = {
+            "customer_names": encode_value(names),
+            "customers": pack_table(customer_rows),
+            "hs_map": pack_table(read_hs_map(hs_code_ref)),
+        }
+        material_count = 0
+        if data_chem_ref and os.path.exists(data_chem_ref):
+            from scripts.material_master import build_index
+
+            index = build_index(data_chem_ref, hs_code_ref)
+            sections["material_by_code"] = pack_table(index["by_code"])
+            sections["material_by_uraian"] = pack_table(index["by_uraian"])
+            material_count = len(index["by_code"])
+
+        try:
+            customer_o2 = _plain(read_customer_o2(customer_ref))
+        except Exception as e:
+            print(f"   ! Warning: Could not read Customer Ref O2: {e}")
+            customer_o2 = None
+
+        header = {
+            "version": SNAPSHOT_VERSION,
+            "compiled_at": datetime.now().isoformat(timespec="seconds"),
+            "sources": {
+                "customer_list": _source_info(customer_ref),
+                "hs_code": _source_info(hs_code_ref),
+                "data_chem": _source_info(data_chem_ref),
+            },
+            "customer_o2": customer_o2,
+            "counts": {
+                "customers": len(customer_rows),
+                "hs_codes": _U32.unpack_from(sections["hs_map"])[0],
+                "materials": material_count,
+            },
+            "sections": {},
+        }
+        # Offsets are relative to the end of the header
+        offset = 0
+        for name, data in sections.items():
+            header["sections"][name] = [offset, len(data)]
+            offset += len(data)
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Per-process temp name: several workers may recompile at once
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(_U32.pack(len(header_bytes)))
+            f.write(header_bytes)
+            for data in sections.values():
+                f.write(data)
+        os.replace(tmp_path, path)
+    print(
+        f"   > Reference snapshot compiled: {header['counts']['customers']} customers, "
+        f"{header['counts']['hs_codes']} HS codes, {material_count} materials"
+    )
+    return header
+
+
+# --------------------------------------------------
+# OPEN
+# --------------------------------------------------
+class Snapshot:
+    """A memory-mapped snapshot file; lookups read straight from the mapping."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a reference snapshot: {path}")
+        header_len = _U32.unpack_from(self._mm, len(MAGIC))[0]
+        start = len(MAGIC) + _U32.size
+        self.header = json.loads(self._mm[start:start + header_len], object_hook=_revive)
+        if self.header.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot version {self.header.get('version')} (expected {SNAPSHOT_VERSION})")
+        base = start + header_len
+        sections = {name: base + offset for name, (offset, _) in self.header["sections"].items()}
+        lengths = dict(self.header["sections"])
+
+        names_at = sections["customer_names"]
+        names = decode_value(self._mm[names_at:names_at + lengths["customer_names"][1]])
+        self.customers = CustomerTable(names, SortedTable(self._mm, sections["customers"]))
+        self.hs_map = SortedTable(self._mm, sections["hs_map"])
+        self.customer_o2 = self.header["customer_o2"]
+
+        self.material_index = None
+        if "material_by_code" in sections:
+            from scripts.material_master import MaterialIndex
+
+            self.material_index = MaterialIndex({
+                "by_code": SortedTable(self._mm, sections["material_by_code"]),
+                "by_uraian": SortedTable(self._mm, sections["material_by_uraian"]),
+            })
+
+    def covers(self, kind, path):
+        """True when `path` is the file this snapshot compiled for `kind`."""
+        source = self.header["sources"].get(kind)
+        return bool(source) and source["path"] == os.path.abspath(path)
+
+    def is_fresh(self, sources):
+        """Same file still on disk and the same source spreadsheets, unchanged."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self._identity:
+            return False
+        return self.header["sources"] == sources
+
+
+_lock = threading.Lock()
+_open = {}      # snapshot path → Snapshot
+_failed = {}    # snapshot path → sources that could not be compiled
+
+
+def snapshot_settings(cfg):
+    return (cfg or {}).get("reference_snapshot") or {}
+
+
+def snapshot_path(cfg):
+    path = snapshot_settings(cfg).get("path") or DEFAULT_PATH
+    return path if os.path.isabs(path) else os.path.join(ROOT_DIR, path)
+
+
+def reference_paths(cfg):
+    """(customer_list, hs_code, data_chem) from config.yaml."""
+    reference = cfg["data"]["reference"]
+    base_dir = cfg["base_dir"]
+    return (
+        os.path.join(base_dir, reference["customer_list"]),
+        os.path.join(base_dir, reference["hs_code"]),
+        os.path.join(base_dir, reference["data_chem"]) if reference.get("data_chem") else None,
+    )
+
+
+def get_snapshot(cfg=None):
+    """
+    The configured snapshot, mapped once per process and reopened when the
+    file is replaced. Compiled first when it is missing or stale and
+    auto_compile is on. None when disabled or unavailable.
+    """
+    if cfg is None:
+        from scripts.run_pipeline import load_config
+
+        cfg = load_config()
+    settings = snapshot_settings(cfg)
+    if not settings.get("enabled", False):
+        return None
+    path = snapshot_path(cfg)
+    customer_ref, hs_code_ref, data_chem_ref = paths = reference_paths(cfg)
+    sources = {
+        "customer_list": _source_info(customer_ref),
+        "hs_code": _source_info(hs_code_ref),
+        "data_chem": _source_info(data_chem_ref),
+    }
+
+    with _lock:
+        snapshot = _open.get(path)
+        if snapshot is not None and snapshot.is_fresh(sources):
+            return snapshot
+        # Another process may already have compiled the current one
+        try:
+            snapshot = Snapshot(path) if os.path.exists(path) else None
+        except (OSError, ValueError) as e:
+            print(f"   ! Warning: Ignoring reference snapshot {path}: {e}")
+            snapshot = None
+        if snapshot is None or snapshot.header["sources"] != sources:
+            if not settings.get("auto_compile", True) or _failed.get(path) == sources:
+                return None
+            if not sources["customer_list"] or not sources["hs_code"]:
+                _failed[path] = sources
+                return None
+            try:
+                compile_snapshot(*paths, path=path)
+                snapshot = Snapshot(path)
+            except Exception as e:
+                print(f"   ! Warning: Could not compile the reference snapshot, reading the spreadsheets: {e}")
+                _failed[path] = sources
+                return None
+        _failed.pop(path, None)
+        # A replaced mapping stays valid for lookups still holding it and is
+        # unmapped once they let go
+        _open[path] = snapshot
+        return snapshot
+
+
+def snapshot_for(kind, path):
+    """The snapshot when it is enabled and compiled from `path`, else None."""
+    try:
+        snapshot = get_snapshot()
+    except Exception as e:
+        print(f"   ! Warning: Reference snapshot unavailable: {e}")
+        return None
+    return snapshot if snapshot is not None and snapshot.covers(kind, path) else None
+
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+def main(argv=None):
+    from scripts.run_pipeline import load_config
+
+    parser = argparse.ArgumentParser(description="Compiled, memory-mapped reference snapshot.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("compile", help="compile the reference spreadsheets now (e.g. at deploy time)")
+    sub.add_parser("info", help="sources and counts of the current snapshot")
+    lookup = sub.add_parser("lookup", help="look one key up")
+    lookup.add_argument("table", choices=["hs", "customer", "material"])
+    lookup.add_argument("key")
+    args = parser.parse_args(argv)
+
+    cfg = load_config()
+    path = snapshot_path(cfg)
+    if args.command == "compile":
+        try:
+            header = compile_snapshot(*reference_paths(cfg), path=path)
+        except Exception as e:
+            print(f"❌ {e}")
+            return 1
+        print(f"✅ Snapshot → {path} ({os.path.getsize(path)} bytes, {header['counts']})")
+        return 0
+
+    if not os.path.exists(path):
+        print(f"❌ No snapshot at {path} (python -m scripts.ref_snapshot compile)")
+        return 1
+    snapshot = Snapshot(path)
+    if args.command == "info":
+        print(json.dumps({k: v for k, v in snapshot.header.items() if k != "sections"}, indent=4, ensure_ascii=False, default=str))
+        return 0
+
+    if args.table == "hs":
+        found = snapshot.hs_map.get(args.key.strip())
+    elif args.table == "customer":
+        found = snapshot.customers.get(args.key)
+    else:
+        found = snapshot.material_index.lookup(args.key, args.key) if snapshot.material_index else None
+    print(json.dumps(_plain(found), indent=4, ensure_ascii=False) if found is not None else "Not found")
+    return 0 if found is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
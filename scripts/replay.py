@@ -0,0 +1,131 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from scripts.job_history import get_history
+from scripts.run_pipeline import load_config, resolve, run_excel_stages
+
+# --------------------------------------------------
+# REPLAY
+# --------------------------------------------------
+# Rebuilds workbooks from the extractions stored in the shipment history
+# (scripts.job_history) after a template or reference file changed. Gemini
+# is not called and every shipment keeps its original NOMOR AJU, so the
+# serial tracker is not touched. The Excel stages are CPU-bound (openpyxl),
+# so shipments run in separate processes. POST /api/replay runs the same
+# replay() in the background and returns a job ID.
+#
+#   python -m scripts.replay --from 2026-01-01 --to 2026-01-31
+#   python -m scripts.replay --customer "PT ABC" --workers 4
+#   python -m scripts.replay --nomor-aju 000027010694202601150000391 ...
+
+
+def replay_output_dir(cfg):
+    base_dir = cfg["base_dir"]
+    output_dir = (cfg.get("replay") or {}).get("output_dir") or "data/output/replay"
+    return resolve(base_dir, output_dir)
+
+
+def replay_one(record, output_dir):
+    """Runs steps 2-4 for one history record. Executed in a worker process."""
+    cfg = load_config()
+    with tempfile.TemporaryDirectory(prefix=f"inabata_replay_{record['job_id']}_") as work_dir:
+        json_path = os.path.join(work_dir, f"{record['job_id']}.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(record["extraction"], f, ensure_ascii=False)
+
+        return run_excel_stages(
+            cfg,
+            json_path,
+            output_dir,
+            tracker_path=None,
+            nomor_aju=record["nomor_aju"],
+        )
+
+
+def replay(date_from=None, date_to=None, customer=None, nomor_aju=None, job_ids=None,
+           workers=None, output_dir=None):
+    """
+    Replays every matching shipment and returns one result per shipment:
+    {job_id, nomor_aju, customer, output | error}.
+    """
+    cfg = load_config()
+    history = get_history(cfg)
+    records = history.select(date_from, date_to, customer, nomor_aju, job_ids, with_extraction=True)
+    output_dir = output_dir or replay_output_dir(cfg)
+    if not records:
+        return []
+
+    replay_cfg = cfg.get("replay") or {}
+    workers = workers or replay_cfg.get("workers") or os.cpu_count() or 1
+    workers = max(1, min(int(workers), len(records)))
+    print(f"--- Replaying {len(records)} shipment(s) with {workers} worker(s) → {output_dir} ---")
+
+    results = []
+    # spawn: the API calls this from a threadpool, and forking a process
+    # that runs threads is unsafe (same as the staged pipeline's CPU pool)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(replay_one, record, output_dir): record for record in records}
+        for future in as_completed(futures):
+            record = futures[future]
+            result = {
+                "job_id": record["job_id"],
+                "nomor_aju": record["nomor_aju"],
+                "customer": record["customer"],
+            }
+            try:
+                result["output"] = future.result()
+                history.mark_replayed(record["job_id"])
+            except Exception as e:
+                print(f"   ! Warning: Replay of {record['nomor_aju']} failed: {e}")
+                result["error"] = str(e)
+            results.append(result)
+
+    order = {record["job_id"]: i for i, record in enumerate(records)}
+    return sorted(results, key=lambda r: order[r["job_id"]])
+
+
+def _date(value):
+    datetime.strptime(value, "%Y-%m-%d")
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild workbooks from stored extractions (no Gemini calls).")
+    parser.add_argument("--from", dest="date_from", type=_date, help="first processing date, YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", type=_date, help="last processing date, YYYY-MM-DD")
+    parser.add_argument("--customer", help="NAMA ENTITAS contains this text (case-insensitive)")
+    parser.add_argument("--nomor-aju", nargs="+", help="replay these NOMOR AJU only")
+    parser.add_argument("--job-id", nargs="+", help="replay these job IDs only")
+    parser.add_argument("--workers", type=int, help="parallel processes (default: replay.workers or CPU count)")
+    parser.add_argument("--output-dir", help="default: replay.output_dir in config.yaml")
+    parser.add_argument("--list", action="store_true", help="only list the matching shipments")
+    parser.add_argument("--all", action="store_true", help="allow replaying without any filter")
+    args = parser.parse_args(argv)
+
+    filters = (args.date_from, args.date_to, args.customer, args.nomor_aju, args.job_id)
+    if not any(filters) and not args.all:
+        parser.error("give at least one filter (--from/--to/--customer/--nomor-aju/--job-id) or --all")
+
+    if args.list:
+        records = get_history(load_config()).select(*filters)
+        for record in records:
+            print(f"{record['processed_date']}  {record['nomor_aju']}  {record['customer'] or '-'}  ({record['job_id']})")
+        print(f"{len(records)} shipment(s)")
+        return 0
+
+    results = replay(*filters, workers=args.workers, output_dir=args.output_dir)
+    failed = [r for r in results if "error" in r]
+    for r in results:
+        print(f"{'❌' if 'error' in r else '✅'} {r['nomor_aju']}: {r.get('output') or r.get('error')}")
+    print(f"{len(results) - len(failed)} rebuilt, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
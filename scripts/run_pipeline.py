@@ -254,59 +254,425 @@
 #     print(f"Pipeline Complete. Output: {final_output_path}")
 #     return final_output_path
 import os
+import json
 import yaml
 import sys
+import contextvars
+import queue
+import tempfile
+import threading
+from contextlib import ExitStack
+from datetime import datetime
+
+from scripts.metrics import stage, JOBS_TOTAL
+from scripts.profiling import profile_job, should_profile, thread_profiled
+from scripts.validate import validate_extraction, has_errors, ValidationError
+from scripts.storage import shard_dir, record_files
+from scripts.ledger import tracking
+
+# The stage modules pull in pandas, openpyxl and google-genai. They are
+# imported on first use (or by preload_pipeline) to keep startup cheap.
+
+
+def preload_pipeline():
+    """Imports every stage module so the first job does not pay for it."""
+    from scripts.pdf_to_json import extract_with_gemini, save_to_json  # noqa: F401
+    from scripts.json_to_excel import json_to_excel  # noqa: F401
+    from scripts.excel_postprocess import process_customs_excel  # noqa: F401
+    from scripts.excel_fix import fix_entitas_nomor_aju_to_text  # noqa: F401
+    from scripts.pdf_to_json import get_client
+    from scripts.ref_snapshot import get_snapshot
+
+    if os.getenv("GEMINI_API_KEY"):
+        get_client()
+    # Compile (if stale) and map the reference snapshot before the first job
+    get_snapshot()
 
-# Change imports to relative or absolute based on your execution context
-from scripts.pdf_to_json import extract_with_gemini, save_to_json
-from scripts.json_to_excel import json_to_excel
-from scripts.excel_postprocess import process_customs_excel
-# --- NEW IMPORT ---
-from scripts.excel_fix import fix_entitas_nomor_aju_to_text
 
 def load_config():
     config_path = os.path.join(os.path.dirname(__file__), "..", "config.yaml")
     with open(config_path, "r") as f:
-        return yaml.safe_load(f)
+        cfg = yaml.safe_load(f)
+    # config.yaml carries one machine's base_dir; other nodes override it
+    if os.getenv("INABATA_BASE_DIR"):
+        cfg["base_dir"] = os.getenv("INABATA_BASE_DIR")
+    return cfg
 
 def resolve(base, relative):
     return os.path.join(base, relative)
 
-# --- NEW FUNCTION FOR FASTAPI ---
-# CHANGE: Added serial_number=None parameter
-def run_custom_pipeline(invoice_pdf_path, packing_pdf_path, serial_number=None):
-    print("\n--- Triggering API Pipeline ---")
-    cfg = load_config()
+def load_material_index(cfg, base_dir, hs_code_ref):
+    """Material master for the BARANG pass; None when disabled or unavailable."""
+    if not (cfg.get("material_master") or {}).get("enabled", False):
+        return None
+    try:
+        from scripts.material_master import load_index
+        from scripts.ref_snapshot import snapshot_for
+
+        data_chem_ref = resolve(base_dir, cfg["data"]["reference"]["data_chem"])
+        with stage("material_index"):
+            # Memory-mapped from the compiled reference snapshot when it covers both files
+            snapshot = snapshot_for("data_chem", data_chem_ref)
+            if snapshot is not None and snapshot.material_index is not None and snapshot.covers("hs_code", hs_code_ref):
+                return snapshot.material_index
+            return load_index(data_chem_ref, hs_code_ref)
+    except Exception as e:
+        print(f"   ! Warning: Material master unavailable, using HS lookup only: {e}")
+        return None
+
+# --- EXCEL STAGES (STEPS 2-4) ---
+# Shared by run_custom_pipeline and scripts.replay. nomor_aju: replays pass
+# the original NOMOR AJU so no serial is consumed.
+def excel_references(cfg):
+    """(template, customer_ref, hs_code_ref, material_index, override_master)"""
     base_dir = cfg["base_dir"]
-
-    # Intermediate & References from Config
-    json_dir = resolve(base_dir, "data/intermediate")
-    template_excel = resolve(base_dir, cfg["data"]["templates"]["pib_template"])
-    customer_ref = resolve(base_dir, cfg["data"]["reference"]["customer_list"])
     hs_code_ref = resolve(base_dir, cfg["data"]["reference"]["hs_code"])
-    output_dir = resolve(base_dir, cfg["data"]["output"]["final_excel_dir"])
+    return (
+        resolve(base_dir, cfg["data"]["templates"]["pib_template"]),
+        resolve(base_dir, cfg["data"]["reference"]["customer_list"]),
+        hs_code_ref,
+        load_material_index(cfg, base_dir, hs_code_ref),
+        bool((cfg.get("material_master") or {}).get("override", False)),
+    )
+
 
-    # STEP 1: PDF → JSON
-    print("...Running Step 1: Extraction")
-    extracted = extract_with_gemini(invoice_pdf_path, packing_pdf_path)
-    json_path = save_to_json(extracted, output_dir=json_dir)
+def run_excel_stages(cfg, json_path, output_dir, tracker_path, serial_number=None, nomor_aju=None):
+    from scripts.json_to_excel import json_to_excel
+    from scripts.excel_postprocess import process_customs_excel
+    from scripts.excel_fix import fix_entitas_nomor_aju_to_text
+
+    template_excel, customer_ref, hs_code_ref, material_index, override_master = excel_references(cfg)
 
     # STEP 2: JSON → EXCEL
     print("...Running Step 2: Populating Excel")
     # CHANGE: Passed user_serial to json_to_excel
-    populated_excel = json_to_excel(json_path, template_excel, user_serial=serial_number)
+    # "template_fill" includes the nested "template_load" stage
+    with stage("template_fill"):
+        populated_excel = json_to_excel(
+            json_path,
+            template_excel,
+            user_serial=serial_number,
+            output_dir=output_dir,
+            tracker_path=tracker_path,
+            nomor_aju=nomor_aju,
+        )
 
     # STEP 3: POST-PROCESS (Calculations & Logic)
     print("...Running Step 3: Post-Processing")
-    post_processed_excel = process_customs_excel(
-        populated_excel,
-        customer_ref,
-        hs_code_ref
-    )
+    with stage("postprocess"):
+        post_processed_excel = process_customs_excel(
+            populated_excel,
+            customer_ref,
+            hs_code_ref,
+            material_index=material_index,
+            override_master=override_master,
+        )
 
     # STEP 4: EXCEL FIX (Text Formatting for ENTITAS)
     print("...Running Step 4: Formatting Fixes")
-    final_output_path = fix_entitas_nomor_aju_to_text(post_processed_excel)
+    with stage("excel_fix"):
+        return fix_entitas_nomor_aju_to_text(post_processed_excel)
+
+
+# Same steps without touching data/output: the workbook goes from the
+# template to the response as objects and buffers. Returns (filename, bytes).
+def run_excel_stages_in_memory(cfg, extracted, tracker_path, serial_number=None, nomor_aju=None):
+    from scripts.json_to_excel import fill_template
+
+    references = excel_references(cfg)
+
+    print("...Running Step 2: Populating Excel (in memory)")
+    with stage("template_fill"):
+        wb, generated_nomor_aju = fill_template(
+            extracted, references[0], serial_number, tracker_path, nomor_aju
+        )
+    return finish_workbook(wb, generated_nomor_aju, references)
+
+
+def finish_workbook(wb, nomor_aju, references, output_dir=None):
+    """
+    Steps 3-4 on a filled template. Writes <output_dir>/<NOMOR AJU>.xlsx and
+    returns its path; without output_dir returns (filename, bytes).
+    """
+    from io import BytesIO
+    from scripts.json_to_excel import output_filename
+    from scripts.excel_postprocess import process_customs_excel
+    from scripts.excel_fix import fix_entitas_nomor_aju_to_text
+
+    _, customer_ref, hs_code_ref, material_index, override_master = references
+
+    print("...Running Step 3: Post-Processing")
+    with stage("postprocess"):
+        wb = process_customs_excel(
+            wb,
+            customer_ref,
+            hs_code_ref,
+            material_index=material_index,
+            override_master=override_master,
+        )
+
+    print("...Running Step 4: Formatting Fixes")
+    with stage("excel_fix"):
+        filename = output_filename(nomor_aju)
+        if output_dir is None:
+            populated = BytesIO()
+            wb.save(populated)
+            populated.seek(0)
+            return filename, fix_entitas_nomor_aju_to_text(populated, BytesIO()).getvalue()
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, filename)
+        wb.save(output_path)
+        return fix_entitas_nomor_aju_to_text(output_path)
+
+
+def extraction_mode(cfg):
+    return (cfg.get("extraction") or {}).get("mode", "single")
+
+
+# --- EXTRACTION STAGE (STEP 1) ---
+# Gemini extraction, validation and the intermediate JSON. Shared by
+# run_custom_pipeline and scripts.staged_pipeline; raises ValidationError in
+# "reject" mode before any workbook or serial is touched.
+def run_extraction_stage(cfg, invoice_pdf_path, packing_pdf_path, json_dir):
+    from scripts.pdf_to_json import extract_with_gemini, extract_with_gemini_fanout, save_to_json
+
+    validation_cfg = cfg.get("validation") or {}
+    validation_mode = validation_cfg.get("mode", "flag")
+
+    # STEP 1: PDF → JSON (one call, or concurrent calls per sheet group)
+    if extraction_mode(cfg) == "fanout":
+        print("...Running Step 1: Extraction (fan-out)")
+        extracted = extract_with_gemini_fanout(invoice_pdf_path, packing_pdf_path)
+    else:
+        print("...Running Step 1: Extraction")
+        extracted = extract_with_gemini(invoice_pdf_path, packing_pdf_path)
+
+    # STEP 1b: VALIDATE (before any workbook or serial number is used)
+    issues = []
+    if validation_mode != "off":
+        with stage("validate"):
+            issues = validate_extraction(extracted, validation_cfg.get("tolerance_pct", 0.5))
+        for issue in issues:
+            print(f"   ! {issue['severity'].upper()}: {issue['message']}")
+
+    with stage("json_save"):
+        json_path = save_to_json(extracted, output_dir=json_dir)
+        if issues:
+            with open(f"{os.path.splitext(json_path)[0]}.validation.json", "w", encoding="utf-8") as f:
+                json.dump(issues, f, indent=4, ensure_ascii=False)
+
+    if validation_mode == "reject" and has_errors(issues):
+        raise ValidationError(issues)
+    return extracted, json_path
+
+
+# --- STREAMED EXTRACTION (extraction.stream) ---
+# Steps 1-4 with the Gemini response streamed: the template is loaded while
+# Gemini is still generating, and every sheet is validated on its own and
+# written into the workbook as soon as it is complete (BARANG, the longest,
+# usually arrives last). The cross-sheet checks run once the payload is
+# complete. In "reject" mode a sheet with errors stops the job right away.
+# Returns (extracted, json_path, result); result is the output path, or
+# (filename, bytes) when in_memory.
+def run_streaming_stages(cfg, invoice_pdf_path, packing_pdf_path, json_dir, output_dir, tracker_path,
+                         serial_number=None, in_memory=False, allocate=None):
+    from scripts.pdf_to_json import extract_with_gemini_stream, save_to_json
+    from scripts.json_to_excel import assign_nomor_aju, fill_sheet, load_template
+
+    validation_cfg = cfg.get("validation") or {}
+    validation_mode = validation_cfg.get("mode", "flag")
+    tolerance_pct = validation_cfg.get("tolerance_pct", 0.5)
+
+    # The stream runs in its own thread (same job context, for metrics and
+    # progress events) and hands over sheets through `arrived`
+    arrived = queue.Queue()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            data = extract_with_gemini_stream(
+                invoice_pdf_path, packing_pdf_path,
+                on_sheet=lambda name, rows: arrived.put(("sheet", name, rows)),
+                stop=stop,
+            )
+            arrived.put(("done", None, data))
+        except BaseException as e:
+            arrived.put(("error", None, e))
+
+    print("...Running Step 1: Extraction (streaming)")
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(thread_profiled(produce),), daemon=True).start()
+
+    issues, filled = [], set()
+    try:
+        references = excel_references(cfg)
+        print("...Running Step 2: Populating Excel (as sheets arrive)")
+        # NOMOR AJU is written once validation passed (see below)
+        wb = load_template(references[0])
+
+        while True:
+            kind, name, value = arrived.get()
+            if kind == "error":
+                raise value
+            if kind == "done":
+                extracted = value
+                break
+            print(f"   > Sheet {name} complete ({max(len(value) - 1, 0)} row(s))")
+            if validation_mode != "off":
+                with stage("validate"):
+                    sheet_issues = validate_extraction({name: value}, tolerance_pct, scope="sheets")
+                issues.extend(sheet_issues)
+                if validation_mode == "reject" and has_errors(sheet_issues):
+                    raise ValidationError(sheet_issues)
+            with stage("template_fill"):
+                fill_sheet(wb, name, value)
+            filled.add(name)
+    finally:
+        stop.set()
+
+    # Top-level values that are not sheets (lists) only show up in the full payload
+    if validation_mode != "off":
+        leftovers = {name: content for name, content in extracted.items() if name not in filled}
+        with stage("validate"):
+            if leftovers:
+                issues.extend(validate_extraction(leftovers, tolerance_pct, scope="sheets"))
+            issues.extend(validate_extraction(extracted, tolerance_pct, scope="cross"))
+        for issue in issues:
+            print(f"   ! {issue['severity'].upper()}: {issue['message']}")
+
+    with stage("json_save"):
+        json_path = save_to_json(extracted, output_dir=json_dir)
+        if issues:
+            with open(f"{os.path.splitext(json_path)[0]}.validation.json", "w", encoding="utf-8") as f:
+                json.dump(issues, f, indent=4, ensure_ascii=False)
+
+    if validation_mode == "reject" and has_errors(issues):
+        raise ValidationError(issues)
+
+    # The serial is taken only now, so a rejected shipment does not use one
+    if allocate is not None:
+        serial_number = allocate(serial_number)
+    generated_nomor_aju = assign_nomor_aju(wb, serial_number, tracker_path)
+    result = finish_workbook(wb, generated_nomor_aju, references, None if in_memory else output_dir)
+    return extracted, json_path, result
+
+
+def record_history(cfg, job_id, extracted, serial_number, output_name):
+    """Stores the extraction for scripts.replay; never fails the job."""
+    from scripts.job_history import customer_name
+    from scripts.ledger import label_job
+
+    name = os.path.basename(output_name)
+    try:
+        from scripts.job_history import get_history
+
+        get_history(cfg).record(job_id, extracted, os.path.splitext(name)[0], serial_number, name)
+    except Exception as e:
+        print(f"   ! Warning: Could not record job history: {e}")
+    # Customer / NOMOR AJU for the per-customer Gemini cost reports
+    label_job(cfg, job_id, customer_name(extracted), os.path.splitext(name)[0])
+
+
+# --- NEW FUNCTION FOR FASTAPI ---
+# CHANGE: Added serial_number=None parameter
+# job_id / profile: set profile=True (or configure profiling.sample_rate) to
+# capture a CPU + memory profile of this job under state/profiles/<job_id>.*
+# serial_number: the requested serial (or None). The serial is allocated
+# from the shared counter (scripts/serials.py) once extraction and validation
+# passed; allocate(requested) replaces that allocator (e.g. to record it)
+# work_dir: when set (per-job scratch, see scripts/workspace.py),
+# intermediates and the output workbook live there instead of under
+# base_dir, and the caller indexes what it keeps
+# in_memory: build the workbook without writing data/output and return
+# (filename, bytes) instead of the output path
+# output_format: "json" / "csv" skip the workbook entirely and return
+# (filename, bytes) of the per-sheet export (see scripts/export.py)
+def run_custom_pipeline(invoice_pdf_path, packing_pdf_path, serial_number=None, job_id=None, profile=False, work_dir=None, in_memory=False,
+                        output_format="xlsx", allocate=None):
+    from scripts.serials import allocate_serial
+
+    print("\n--- Triggering API Pipeline ---")
+    cfg = load_config()
+    base_dir = cfg["base_dir"]
 
+    profiling_cfg = cfg.get("profiling") or {}
+    profile = should_profile(profile, profiling_cfg.get("sample_rate", 0))
+    # Every job gets an ID: profiles and the replay history are keyed by it
+    job_id = job_id or datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+    # Intermediate & Outputs from Config (today's shard, see scripts/storage.py)
+    json_dir = shard_dir(resolve(base_dir, "data/intermediate"), cfg)
+    output_dir = shard_dir(resolve(base_dir, cfg["data"]["output"]["final_excel_dir"]), cfg)
+    # Streaming applies to the single-call extraction
+    stream = bool((cfg.get("extraction") or {}).get("stream", False)) and extraction_mode(cfg) == "single"
+    # Exports have no workbook to fill while streaming
+    export = output_format != "xlsx"
+    stream = stream and not export
+    in_memory = in_memory or export
+
+    if work_dir:
+        json_dir = resolve(work_dir, "intermediate")
+        output_dir = resolve(work_dir, "output")
+
+    allocate = allocate or (lambda requested: allocate_serial(cfg, requested))
+    taken = []
+
+    def take_serial(requested):
+        taken.append(allocate(requested))
+        return taken[-1]
+
+    with ExitStack() as scratch, profile_job(job_id, profile, profiling_cfg.get("output_dir")), tracking(job_id):
+        # The serial is already allocated; json_to_excel only writes the
+        # tracker it is given, so it gets a throw-away one
+        tracker_path = os.path.join(
+            work_dir or scratch.enter_context(tempfile.TemporaryDirectory(prefix="inabata_tracker_")),
+            "serial_tracker.txt",
+        )
+        try:
+            if stream:
+                # STEPS 1-4 overlapped: sheets are filled while Gemini streams
+                extracted, json_path, result = run_streaming_stages(
+                    cfg, invoice_pdf_path, packing_pdf_path, json_dir, output_dir, tracker_path,
+                    serial_number=serial_number, in_memory=in_memory, allocate=take_serial,
+                )
+                serial_number = taken[-1]
+            else:
+                # STEP 1: PDF → JSON (+ validation)
+                extracted, json_path = run_extraction_stage(cfg, invoice_pdf_path, packing_pdf_path, json_dir)
+                serial_number = take_serial(serial_number)
+
+                # STEPS 2-4: EXCEL
+                if export:
+                    from scripts.export import build_export
+
+                    result = build_export(
+                        cfg, extracted, tracker_path, output_format, serial_number=serial_number
+                    )
+                elif in_memory:
+                    result = run_excel_stages_in_memory(
+                        cfg, extracted, tracker_path, serial_number=serial_number
+                    )
+                else:
+                    result = run_excel_stages(
+                        cfg, json_path, output_dir, tracker_path, serial_number=serial_number
+                    )
+        except Exception:
+            JOBS_TOTAL.inc(outcome="error")
+            raise
+
+    JOBS_TOTAL.inc(outcome="success")
+    if in_memory:
+        filename, data = result
+        record_history(cfg, job_id, extracted, serial_number, filename)
+        if not work_dir:
+            record_files(cfg, {"intermediate": json_path}, os.path.splitext(filename)[0], job_id)
+        print(f"Pipeline Complete. Output: {filename} ({len(data)} bytes, in memory)")
+        return filename, data
+
+    final_output_path = result
+    record_history(cfg, job_id, extracted, serial_number, final_output_path)
+    if not work_dir:
+        nomor_aju = os.path.splitext(os.path.basename(final_output_path))[0]
+        record_files(cfg, {"intermediate": json_path, "output": final_output_path}, nomor_aju, job_id)
     print(f"Pipeline Complete. Output: {final_output_path}")
-    return final_output_path
\ No newline at end of file
+    return final_output_path
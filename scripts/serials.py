@@ -0,0 +1,80 @@
+import argparse
+import sys
+import threading
+
+from scripts.job_queue import get_queue
+
+# --------------------------------------------------
+# NOMOR AJU SERIALS
+# --------------------------------------------------
+# One counter for every entry point: /api/process-docs (sequential and
+# staged), the /api/jobs workers and the batch CLI. It lives in the shared
+# queue backend (queue: in config.yaml), so API nodes and workers on other
+# machines draw from the same sequence. Allocation is atomic there: a
+# BEGIN IMMEDIATE transaction in SQLite, INCR in Redis.
+#
+# A job takes its serial when it reaches the Excel stage, after extraction
+# and validation. A shipment rejected by validation therefore does not use
+# up a number.
+#
+# A numeric requested serial is used as-is and the counter continues after
+# it, as the API always did. The counter is seeded once from
+# state/serial_tracker.txt; after that the file is no longer read. Move the
+# counter with:
+#
+#   python -m scripts.serials show
+#   python -m scripts.serials set 0950
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_counter(cfg=None):
+    """The queue backend holding the counter (one instance per backend and path)."""
+    if cfg is None:
+        from scripts.run_pipeline import load_config
+
+        cfg = load_config()
+    queue_cfg = cfg.get("queue") or {}
+    key = (queue_cfg.get("backend", "sqlite"), queue_cfg.get("path"), queue_cfg.get("url"))
+    with _counters_lock:
+        if key not in _counters:
+            _counters[key] = get_queue(cfg)
+        return _counters[key]
+
+
+def allocate_serial(cfg=None, requested=None):
+    """Serial for a job entering the Excel stage, as a 4-digit string."""
+    return get_counter(cfg).allocate_serial(requested)
+
+
+def peek_serial(cfg=None):
+    """The serial the next job will get."""
+    return get_counter(cfg).peek_serial()
+
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared NOMOR AJU serial counter.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("show", help="the serial the next job will get")
+    set_cmd = sub.add_parser("set", help="make the next job get this serial")
+    set_cmd.add_argument("serial")
+    args = parser.parse_args(argv)
+
+    counter = get_counter()
+    if args.command == "set":
+        if not args.serial.isdigit():
+            print(f"❌ Serial must be numeric, got '{args.serial}'")
+            return 1
+        counter.set_serial(int(args.serial))
+        print(f"✅ Next serial: {counter.peek_serial()}")
+    else:
+        print(counter.peek_serial())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
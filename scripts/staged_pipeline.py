@@ -0,0 +1,318 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from scripts.metrics import JOBS_TOTAL, PIPELINE_QUEUED, STAGE_LISTENERS, record_stage
+from scripts.run_pipeline import (
+    load_config,
+    record_history,
+    resolve,
+    run_excel_stages,
+    run_excel_stages_in_memory,
+    run_extraction_stage,
+)
+from scripts.storage import record_files, shard_dir
+from scripts.ledger import tracking
+from scripts.profiling import profile_job, should_profile
+from scripts.ref_snapshot import get_snapshot
+from scripts.serials import allocate_serial
+
+# --------------------------------------------------
+# STAGED PIPELINE
+# --------------------------------------------------
+# run_custom_pipeline keeps one worker busy from the Gemini call to the last
+# excel_fix save, so the CPU idles while Gemini answers and Gemini capacity
+# idles while openpyxl runs. Here the job is split in two stage pools joined
+# by bounded queues:
+#
+#   submit → [extract queue] → I/O pool (threads: Gemini, validation, JSON)
+#          → [excel queue]   → CPU pool (processes: template fill,
+#                              post-processing, excel_fix)
+#
+# so the extraction of job N+1 overlaps the Excel work of job N. Each pool
+# is sized on its own (pipeline.io_workers / pipeline.cpu_workers); a full
+# queue makes the stage in front of it wait (submit() waits as well), so a
+# slow CPU stage cannot pile up extracted jobs without bound.
+#
+# Serials are taken when a job enters the Excel stage, one at a time on a
+# thread of their own (the counter may wait on SQLite, Redis or an fsync),
+# unless the caller passes one. Used by scripts.batch, and
+# by the API when pipeline.mode is "staged".
+#
+# A profiled job (scripts/profiling.py) is profiled in the CPU worker that
+# runs its Excel stage, where it is the only job; the extraction shares the
+# I/O pool with other jobs and is not covered.
+
+
+def pipeline_cfg(cfg):
+    return (cfg or {}).get("pipeline") or {}
+
+
+def is_staged(cfg):
+    return pipeline_cfg(cfg).get("mode", "sequential") == "staged"
+
+
+# --------------------------------------------------
+# CPU WORKER (separate process)
+# --------------------------------------------------
+def _init_cpu_worker(log_path=None):
+    if log_path:
+        # Keep the step-by-step output away from the caller's console
+        sys.stdout = sys.stderr = open(log_path, "a", buffering=1, encoding="utf-8")
+    # Pay for openpyxl / pandas once per process, not on the first job
+    from scripts.json_to_excel import fill_template  # noqa: F401
+    from scripts.excel_postprocess import process_customs_excel  # noqa: F401
+    from scripts.excel_fix import fix_entitas_nomor_aju_to_text  # noqa: F401
+    from scripts.export import build_export  # noqa: F401
+    # Maps the snapshot compiled by the parent (start()); shared, not copied
+    get_snapshot()
+
+
+def _excel_job(cfg, json_path, extracted, output_dir, serial_number, in_memory, output_format="xlsx",
+               job_id=None, profile=False):
+    """
+    Steps 2-4 for one job. Returns (result, timings): the result of
+    run_excel_stages / run_excel_stages_in_memory / build_export and the
+    finished stages as (name, status, seconds), which the parent records in
+    its own metrics.
+    """
+    timings = []
+
+    def collect(name, status, seconds):
+        if status != "start":
+            timings.append((name, status, seconds))
+
+    STAGE_LISTENERS.append(collect)
+    try:
+        with profile_job(job_id, profile, (cfg.get("profiling") or {}).get("output_dir")):
+            # The serial is already allocated; json_to_excel only writes the
+            # tracker it is given, so it gets a throw-away one
+            with tempfile.TemporaryDirectory(prefix="inabata_excel_") as scratch:
+                tracker_path = os.path.join(scratch, "serial_tracker.txt")
+                if output_format != "xlsx":
+                    from scripts.export import build_export
+
+                    result = build_export(cfg, extracted, tracker_path, output_format, serial_number)
+                elif in_memory:
+                    result = run_excel_stages_in_memory(cfg, extracted, tracker_path, serial_number)
+                else:
+                    result = run_excel_stages(cfg, json_path, output_dir, tracker_path, serial_number)
+    finally:
+        STAGE_LISTENERS.remove(collect)
+    return result, timings
+
+
+def _extract_job(job_id, *args):
+    """Step 1 with its Gemini calls booked to job_id in the ledger."""
+    with tracking(job_id):
+        return run_extraction_stage(*args)
+
+
+def _record_timings(timings):
+    for name, status, seconds in timings:
+        record_stage(name, seconds, status)
+
+
+# --------------------------------------------------
+# PIPELINE
+# --------------------------------------------------
+class StagedPipeline:
+    """
+    Usage (inside a running event loop):
+
+        async with StagedPipeline(cfg) as pipeline:
+            path = await pipeline.run(invoice_pdf, packing_pdf)
+
+    allocate(requested_serial, job_id=...) returns the serial of a job
+    entering the Excel stage; by default the shared counter's
+    (scripts/serials.py), which uses a numeric requested serial as-is.
+    """
+
+    def __init__(self, cfg=None, io_workers=None, cpu_workers=None, queue_size=None,
+                 output_dir=None, json_dir=None, allocate=None, log_path=None):
+        self.cfg = cfg or load_config()
+        settings = pipeline_cfg(self.cfg)
+        self.io_workers = max(1, int(io_workers or settings.get("io_workers") or 4))
+        self.cpu_workers = max(1, int(cpu_workers or settings.get("cpu_workers") or 2))
+        self.queue_size = max(1, int(queue_size or settings.get("queue_size") or self.io_workers))
+        self.output_dir = output_dir
+        self.json_dir = json_dir
+        self.log_path = log_path
+
+        self.allocate = allocate or (lambda requested, job_id=None: allocate_serial(self.cfg, requested))
+
+        self._futures = set()
+        self._tasks = []
+        self._io_pool = None
+        self._serial_pool = None
+        self._cpu_pool = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop(drain=exc_type is None)
+
+    async def start(self):
+        self._extract_queue = asyncio.Queue(self.queue_size)
+        self._excel_queue = asyncio.Queue(self.queue_size)
+        self._io_pool = ThreadPoolExecutor(self.io_workers, thread_name_prefix="inabata-io")
+        # One thread: allocators need not be thread-safe, and a busy I/O pool cannot delay them
+        self._serial_pool = ThreadPoolExecutor(1, thread_name_prefix="inabata-serial")
+        # Compile a stale reference snapshot once here rather than in every CPU worker
+        await asyncio.get_running_loop().run_in_executor(self._io_pool, get_snapshot, self.cfg)
+        # spawn: forking a process that runs threads (uvicorn, the I/O pool) is unsafe
+        self._cpu_pool = ProcessPoolExecutor(
+            self.cpu_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_cpu_worker,
+            initargs=(self.log_path,),
+        )
+        self._tasks = [asyncio.create_task(self._extract_worker()) for _ in range(self.io_workers)]
+        self._tasks += [asyncio.create_task(self._excel_worker()) for _ in range(self.cpu_workers)]
+        print(f"   > Staged pipeline: {self.io_workers} I/O worker(s), {self.cpu_workers} CPU worker(s), queue size {self.queue_size}")
+
+    async def stop(self, drain=True):
+        """drain=True finishes every submitted job first; otherwise they are cancelled."""
+        if drain:
+            await self._extract_queue.join()
+            await self._excel_queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for future in list(self._futures):
+            future.cancel()
+        self._io_pool.shutdown(wait=drain, cancel_futures=True)
+        self._serial_pool.shutdown(wait=drain, cancel_futures=True)
+        self._cpu_pool.shutdown(wait=drain, cancel_futures=True)
+
+    async def submit(self, invoice_pdf_path, packing_pdf_path, serial_number=None, job_id=None, in_memory=False,
+                     output_format="xlsx", work_dir=None, profile=False):
+        """
+        Queues one shipment and returns a future for its result: the output
+        path, or (filename, bytes) when in_memory or when output_format is
+        "json" / "csv" (scripts/export.py). Waits while the extraction
+        queue is full. Progress/metrics context (current_job) is taken from
+        the caller. With work_dir (scripts/workspace.py) the intermediate
+        JSON and the workbook are written there and left to the caller to
+        promote and index. profile: profile the job's Excel stage (or as
+        picked by profiling.sample_rate).
+        """
+        job = {
+            "job_id": job_id or datetime.now().strftime("%Y%m%d_%H%M%S_%f"),
+            "invoice": invoice_pdf_path,
+            "packing": packing_pdf_path,
+            "serial_number": serial_number,
+            "in_memory": in_memory or output_format != "xlsx",
+            "output_format": output_format,
+            "work_dir": work_dir,
+            "profile": should_profile(profile, (self.cfg.get("profiling") or {}).get("sample_rate", 0)),
+            "context": contextvars.copy_context(),
+            "future": asyncio.get_running_loop().create_future(),
+        }
+        self._futures.add(job["future"])
+        job["future"].add_done_callback(self._futures.discard)
+        PIPELINE_QUEUED.inc(stage="extract")
+        await self._extract_queue.put(job)
+        return job["future"]
+
+    async def run(self, *args, **kwargs):
+        return await (await self.submit(*args, **kwargs))
+
+    # --- STAGE WORKERS ---
+    async def _extract_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._extract_queue.get()
+            PIPELINE_QUEUED.dec(stage="extract")
+            try:
+                if job["future"].done():
+                    continue  # caller gave up (e.g. client disconnected)
+                if job["work_dir"]:
+                    json_dir = os.path.join(job["work_dir"], "intermediate")
+                else:
+                    json_dir = self.json_dir or shard_dir(resolve(self.cfg["base_dir"], "data/intermediate"), self.cfg)
+                job["extracted"], job["json_path"] = await loop.run_in_executor(
+                    self._io_pool,
+                    job["context"].run,
+                    _extract_job,
+                    job["job_id"],
+                    self.cfg,
+                    job["invoice"],
+                    job["packing"],
+                    json_dir,
+                )
+            except Exception as e:
+                self._fail(job, e)
+            else:
+                # Waits here while the CPU stage is behind
+                PIPELINE_QUEUED.inc(stage="excel")
+                await self._excel_queue.put(job)
+            finally:
+                self._extract_queue.task_done()
+
+    async def _excel_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._excel_queue.get()
+            PIPELINE_QUEUED.dec(stage="excel")
+            try:
+                if job["future"].done():
+                    continue
+                serial_number = await loop.run_in_executor(
+                    self._serial_pool,
+                    job["context"].run,
+                    functools.partial(self.allocate, job["serial_number"], job_id=job["job_id"]),
+                )
+                if job["work_dir"]:
+                    output_dir = os.path.join(job["work_dir"], "output")
+                else:
+                    output_dir = self.output_dir or shard_dir(
+                        resolve(self.cfg["base_dir"], self.cfg["data"]["output"]["final_excel_dir"]), self.cfg
+                    )
+                result, timings = await loop.run_in_executor(
+                    self._cpu_pool,
+                    _excel_job,
+                    self.cfg,
+                    job["json_path"],
+                    job["extracted"] if job["in_memory"] else None,
+                    output_dir,
+                    serial_number,
+                    job["in_memory"],
+                    job["output_format"],
+                    job["job_id"],
+                    job["profile"],
+                )
+                job["context"].run(_record_timings, timings)
+                self._finish(job, serial_number, result)
+            except Exception as e:
+                self._fail(job, e)
+            finally:
+                self._excel_queue.task_done()
+
+    def _finish(self, job, serial_number, result):
+        JOBS_TOTAL.inc(outcome="success")
+        output_name = result[0] if job["in_memory"] else result
+        nomor_aju = os.path.splitext(os.path.basename(output_name))[0]
+        record_history(self.cfg, job["job_id"], job["extracted"], serial_number, output_name)
+        if not job["work_dir"]:
+            files = {"intermediate": job["json_path"]}
+            if not job["in_memory"]:
+                files["output"] = result
+            record_files(self.cfg, files, nomor_aju, job["job_id"])
+        print(f"Pipeline Complete. Output: {output_name} (serial {serial_number})")
+        if not job["future"].done():
+            job["future"].set_result(result)
+
+    def _fail(self, job, error):
+        JOBS_TOTAL.inc(outcome="error")
+        if not job["future"].done():
+            job["future"].set_exception(error)
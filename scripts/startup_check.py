@@ -0,0 +1,96 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import yaml
+
+# --------------------------------------------------
+# COLD-START BUDGET CHECK
+# --------------------------------------------------
+# Measures how long a fresh interpreter takes to `import main` (the cost a
+# restarted worker pays before it can accept requests) and compares the
+# median against startup.cold_start_budget_ms in config.yaml.
+#
+#   python -m scripts.startup_check            → exit 1 if over budget
+#   python -m scripts.startup_check --top 15   → also list slowest imports
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_BUDGET_MS = 800
+
+# Modules that must not be imported by `import main`
+HEAVY_MODULES = ["pandas", "openpyxl", "google.genai", "xlsxwriter"]
+
+
+def measure(module="main", runs=5):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], cwd=ROOT_DIR, check=True)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def eagerly_imported(module="main"):
+    """Returns the heavy modules that `import <module>` loads."""
+    probe = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", probe], cwd=ROOT_DIR, check=True, capture_output=True, text=True
+    )
+    return [m for m in out.stdout.strip().split(",") if m]
+
+
+def slowest_imports(module="main", top=15):
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, check=True, capture_output=True, text=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative_us), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the API cold-start time budget.")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--top", type=int, default=0, help="list the N slowest imports")
+    args = parser.parse_args(argv)
+
+    budget = args.budget_ms
+    if budget is None:
+        with open(os.path.join(ROOT_DIR, "config.yaml"), "r") as f:
+            cfg = yaml.safe_load(f)
+        budget = (cfg.get("startup") or {}).get("cold_start_budget_ms", DEFAULT_BUDGET_MS)
+
+    timings = measure(args.module, args.runs)
+    median = statistics.median(timings)
+    print(f"   > import {args.module}: median {median:.0f} ms over {args.runs} runs (budget {budget:.0f} ms)")
+
+    heavy = eagerly_imported(args.module)
+    if heavy:
+        print(f"   ! Warning: heavy modules imported at startup: {', '.join(heavy)}")
+
+    if args.top:
+        for cumulative_us, name in slowest_imports(args.module, args.top):
+            print(f"     {cumulative_us / 1000:8.1f} ms  {name}")
+
+    if median > budget:
+        print("❌ Cold start is over budget")
+        return 1
+    print("✅ Cold start within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tarfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, date
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process, _compact_lock only
+    fcntl = None
+
+# --------------------------------------------------
+# DATE-SHARDED STORAGE
+# --------------------------------------------------
+# Uploaded PDFs, intermediate JSON and output workbooks are written to
+# day shards (<dir>/YYYY/MM/DD/) instead of one flat directory each, and
+# every file is listed in a small index (state/storage_index.sqlite) so a
+# NOMOR AJU is found without scanning directories.
+#
+# Compaction (background task in main.py, or the CLI) applies the
+# retention policy per kind: day shards older than compress_after_days are
+# packed into <dir>/YYYY/MM/DD.tar.gz, shards/archives older than
+# delete_after_days are removed. Every API process runs compaction, so
+# each day shard is handled under a lock file in state/locks/ (flock, this
+# machine's processes); a shard another process holds is skipped this round.
+#
+#   python -m scripts.storage compact [--dry-run]
+#   python -m scripts.storage migrate        (move flat legacy files into shards)
+#   python -m scripts.storage find <NOMOR AJU>
+#   python -m scripts.storage stats
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_INDEX_PATH = os.path.join(ROOT_DIR, "state", "storage_index.sqlite")
+LOCK_DIR = os.path.join(ROOT_DIR, "state", "locks")
+
+KINDS = ("input", "intermediate", "output")
+
+LIVE = "live"
+ARCHIVED = "archived"
+DELETED = "deleted"
+SUPERSEDED = "superseded"  # replaced by an amended workbook
+
+_compact_lock = threading.Lock()
+
+
+def storage_cfg(cfg):
+    return (cfg or {}).get("storage") or {}
+
+
+def is_sharded(cfg):
+    return storage_cfg(cfg).get("layout", "sharded") == "sharded"
+
+
+def kind_dir(cfg, kind):
+    """Root directory of one kind (data/input, data/intermediate, final_excel_dir)."""
+    relative = {
+        "input": "data/input",
+        "intermediate": "data/intermediate",
+        "output": cfg["data"]["output"]["final_excel_dir"],
+    }[kind]
+    return os.path.join(cfg["base_dir"], relative)
+
+
+def shard_dir(root, cfg=None, when=None):
+    """root/YYYY/MM/DD for `when` (default: today); root itself for the flat layout."""
+    if cfg is not None and not is_sharded(cfg):
+        return root
+    when = when or datetime.now()
+    return os.path.join(root, f"{when:%Y}", f"{when:%m}", f"{when:%d}")
+
+
+# --------------------------------------------------
+# INDEX
+# --------------------------------------------------
+class StorageIndex:
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path       TEXT PRIMARY KEY,
+                    kind       TEXT NOT NULL,
+                    nomor_aju  TEXT,
+                    job_id     TEXT,
+                    size       INTEGER,
+                    created_at REAL NOT NULL,
+                    status     TEXT NOT NULL,
+                    archive    TEXT
+                );
+                CREATE INDEX IF NOT EXISTS files_nomor_aju ON files (nomor_aju);
+                CREATE INDEX IF NOT EXISTS files_kind_created ON files (kind, created_at);
+            """)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout = 30000")
+            self._local.conn = conn
+        return conn
+
+    def register(self, kind, path, nomor_aju=None, job_id=None):
+        path = os.path.abspath(path)
+        size = os.path.getsize(path) if os.path.exists(path) else None
+        self._connect().execute(
+            "INSERT OR REPLACE INTO files (path, kind, nomor_aju, job_id, size, created_at, status) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, kind, nomor_aju, job_id, size, time.time(), LIVE),
+        )
+
+    def find(self, nomor_aju):
+        rows = self._connect().execute(
+            "SELECT * FROM files WHERE nomor_aju = ? ORDER BY created_at", (nomor_aju,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def find_job(self, job_id):
+        rows = self._connect().execute(
+            "SELECT * FROM files WHERE job_id = ? ORDER BY created_at", (job_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def supersede(self, nomor_aju, keep):
+        """Marks the live outputs of a NOMOR AJU other than `keep` as superseded."""
+        return self._connect().execute(
+            "UPDATE files SET status = ? WHERE nomor_aju = ? AND kind = 'output' AND status = ? AND path != ?",
+            (SUPERSEDED, nomor_aju, LIVE, os.path.abspath(keep)),
+        ).rowcount
+
+    def mark_prefix(self, prefix, status, archive=None):
+        """Updates every live file under a shard directory (after compaction)."""
+        prefix = os.path.join(os.path.abspath(prefix), "")
+        return self._connect().execute(
+            "UPDATE files SET status = ?, archive = COALESCE(?, archive) "
+            "WHERE substr(path, 1, ?) = ? AND status != ?",
+            (status, archive, len(prefix), prefix, DELETED),
+        ).rowcount
+
+    def stats(self):
+        rows = self._connect().execute(
+            "SELECT kind, status, COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes "
+            "FROM files GROUP BY kind, status ORDER BY kind, status"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def get_index(cfg):
+    path = storage_cfg(cfg).get("index") or DEFAULT_INDEX_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(ROOT_DIR, path)
+    return StorageIndex(path)
+
+
+def record_files(cfg, files, nomor_aju=None, job_id=None):
+    """Indexes {kind: path or [paths]}; never fails the caller."""
+    try:
+        index = get_index(cfg)
+        for kind, paths in files.items():
+            for path in paths if isinstance(paths, (list, tuple)) else [paths]:
+                if path:
+                    index.register(kind, path, nomor_aju, job_id)
+    except Exception as e:
+        print(f"   ! Warning: Could not update storage index: {e}")
+
+
+# --------------------------------------------------
+# COMPACTION
+# --------------------------------------------------
+def iter_shards(root):
+    """
+    Yields (day, path, is_archive) for root/YYYY/MM/DD and its archives
+    root/YYYY/MM/DD.tar.gz (DD.<n>.tar.gz for files that arrived later).
+    """
+    if not os.path.isdir(root):
+        return
+    for year in sorted(os.listdir(root)):
+        if not (year.isdigit() and len(year) == 4):
+            continue
+        for month in sorted(os.listdir(os.path.join(root, year))):
+            month_dir = os.path.join(root, year, month)
+            if not (month.isdigit() and os.path.isdir(month_dir)):
+                continue
+            for entry in sorted(os.listdir(month_dir)):
+                is_archive = entry.endswith(".tar.gz")
+                day_name = entry.split(".")[0] if is_archive else entry
+                try:
+                    day = date(int(year), int(month), int(day_name))
+                except ValueError:
+                    continue
+                yield day, os.path.join(month_dir, entry), is_archive
+
+
+def _remove_empty_parents(path, root):
+    parent = os.path.dirname(path)
+    while os.path.abspath(parent) != os.path.abspath(root):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            return
+        parent = os.path.dirname(parent)
+
+
+@contextmanager
+def shard_lock(path):
+    """Yields True when this process holds the lock of one day shard, False when another one does."""
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    fd = os.open(os.path.join(LOCK_DIR, f"shard-{name}.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)  # releases the flock
+
+
+def compress_shard(path):
+    """Packs one day directory into <path>.tar.gz and removes the directory."""
+    archive = f"{path}.tar.gz"
+    n = 1
+    while os.path.exists(archive):
+        archive = f"{path}.{n}.tar.gz"
+        n += 1
+    tmp = f"{archive}.{os.getpid()}.tmp"
+    with tarfile.open(tmp, "w:gz") as tar:
+        tar.add(path, arcname=os.path.basename(path))
+    os.replace(tmp, archive)
+    shutil.rmtree(path)
+    return archive
+
+
+def compact(cfg, today=None, dry_run=False):
+    """
+    Applies storage.retention to every kind. Returns a list of
+    (action, kind, path) describing what was (or would be) done.
+    """
+    today = today or date.today()
+    retention = storage_cfg(cfg).get("retention") or {}
+    actions = []
+
+    with _compact_lock:
+        index = None if dry_run else get_index(cfg)
+        for kind in KINDS:
+            policy = retention.get(kind) or {}
+            compress_after = policy.get("compress_after_days")
+            delete_after = policy.get("delete_after_days")
+            if compress_after is None and delete_after is None:
+                continue
+            if compress_after is not None:
+                # Today's shard is still being written to
+                compress_after = max(1, compress_after)
+
+            root = kind_dir(cfg, kind)
+            for day, path, is_archive in list(iter_shards(root)):
+                age = (today - day).days
+                if delete_after is not None and age >= delete_after:
+                    action = "delete"
+                elif not is_archive and compress_after is not None and age >= compress_after:
+                    action = "compress"
+                else:
+                    continue
+                if dry_run:
+                    actions.append((action, kind, path))
+                    continue
+                shard = os.path.join(os.path.dirname(path), f"{day:%d}")
+                with shard_lock(shard) as locked:
+                    # Held by, or already done by, another process
+                    if not locked or not os.path.exists(path):
+                        continue
+                    actions.append((action, kind, path))
+                    if action == "delete":
+                        if is_archive:
+                            os.remove(path)
+                        else:
+                            shutil.rmtree(path)
+                        index.mark_prefix(shard, DELETED)
+                        _remove_empty_parents(path, root)
+                    else:
+                        archive = compress_shard(path)
+                        index.mark_prefix(path, ARCHIVED, archive)
+
+    for action, kind, path in actions:
+        print(f"   > Storage {action}: {kind} {path}")
+    return actions
+
+
+def migrate_flat(cfg, dry_run=False):
+    """Moves files lying directly in a kind's root into the shard of their mtime."""
+    moved = []
+    index = None if dry_run else get_index(cfg)
+    for kind in KINDS:
+        root = kind_dir(cfg, kind)
+        if not os.path.isdir(root):
+            continue
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if not os.path.isfile(path) or name.startswith("."):
+                continue
+            target_dir = shard_dir(root, when=datetime.fromtimestamp(os.path.getmtime(path)))
+            target = os.path.join(target_dir, name)
+            moved.append((kind, path, target))
+            if dry_run:
+                continue
+            os.makedirs(target_dir, exist_ok=True)
+            shutil.move(path, target)
+            nomor_aju = os.path.splitext(name)[0] if kind == "output" else None
+            index.register(kind, target, nomor_aju)
+    return moved
+
+
+async def compaction_loop(cfg):
+    """Runs compact() in the executor every storage.compaction_interval_minutes."""
+    loop = asyncio.get_running_loop()
+    interval = float(storage_cfg(cfg).get("compaction_interval_minutes") or 60) * 60
+    while True:
+        try:
+            await loop.run_in_executor(None, compact, cfg)
+        except Exception as e:
+            print(f"   ! Warning: Storage compaction failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def main(argv=None):
+    from scripts.run_pipeline import load_config
+
+    parser = argparse.ArgumentParser(description="Sharded storage maintenance.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compact_cmd = sub.add_parser("compact", help="apply the retention policy now")
+    compact_cmd.add_argument("--dry-run", action="store_true")
+    migrate_cmd = sub.add_parser("migrate", help="move flat legacy files into day shards")
+    migrate_cmd.add_argument("--dry-run", action="store_true")
+    find_cmd = sub.add_parser("find", help="list the files of one NOMOR AJU")
+    find_cmd.add_argument("nomor_aju")
+    sub.add_parser("stats", help="indexed files and bytes per kind and status")
+    args = parser.parse_args(argv)
+
+    cfg = load_config()
+    if args.command == "compact":
+        actions = compact(cfg, dry_run=args.dry_run)
+        print(f"✅ {len(actions)} shard(s) {'would be ' if args.dry_run else ''}compacted")
+    elif args.command == "migrate":
+        moved = migrate_flat(cfg, dry_run=args.dry_run)
+        for kind, path, target in moved:
+            print(f"{kind}: {path} → {target}")
+        print(f"✅ {len(moved)} file(s) {'would be ' if args.dry_run else ''}moved")
+    elif args.command == "find":
+        files = get_index(cfg).find(args.nomor_aju)
+        for f in files:
+            print(f"{f['kind']:<13} {f['status']:<9} {f['archive'] or f['path']}")
+        return 0 if files else 1
+    else:
+        for row in get_index(cfg).stats():
+            print(f"{row['kind']:<13} {row['status']:<9} {row['files']:>7} files {row['bytes'] / 1e6:>10.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
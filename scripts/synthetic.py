@@ -0,0 +1,130 @@
+import random
+from datetime import date, datetime, timedelta
+from openpyxl import Workbook
+
+# --------------------------------------------------
+# SYNTHETIC SHIPMENTS
+# --------------------------------------------------
+# Generates extraction payloads in the exact shape returned by
+# extract_with_gemini (sheet name -> list of lists, first row = headers)
+# plus matching reference workbooks, so the Excel stages can be measured
+# without PDFs or a Gemini key.
+
+SATUAN = ["ST", "KGM", "MTR", "RO"]
+
+WORDS = [
+    "RESIN", "FILM", "TANK", "REEL", "PHENOLIC", "MOLD", "ADDITIVE", "GLYCOL",
+    "SOLVENT", "POLYMER", "PELLET", "SHEET", "BLK", "NATURAL", "COMPOUND",
+]
+
+CUSTOMER_HEADERS = [
+    "SERI", "KODE ENTITAS", "KODE JENIS IDENTITAS", "NOMOR IDENTITAS",
+    "NAMA ENTITAS", "ALAMAT ENTITAS", "NIB ENTITAS", "KODE JENIS API",
+    "KODE STATUS", "NOMOR IJIN ENTITAS", "TANGGAL IJIN ENTITAS",
+]
+
+
+def _uraian(i):
+    # Deterministic so the HS reference can list the same descriptions
+    words = " ".join(WORDS[(i * k) % len(WORDS)] for k in (1, 3, 7))
+    return f"{100000000 + i:09d} {words} {i}"
+
+
+def _customer_name(i):
+    return f"SYNTHETIC CUSTOMER {i:05d} INDONESIA"
+
+
+def make_extraction(barang_rows=10, dokumen_rows=3, customers=50, hs_known_ratio=0.5, seed=0):
+    """
+    Builds one synthetic extraction payload.
+
+    About half of the BARANG rows (hs_known_ratio) are left without HS so the
+    post-process HS lookup is exercised; their URAIAN values exist in the HS
+    table produced by make_hs_reference.
+    """
+    rng = random.Random(seed)
+    day = date(2026, 1, 1) + timedelta(days=rng.randint(0, 300))
+
+    barang = [["HS", "KODE BARANG", "URAIAN", "KODE SATUAN", "JUMLAH SATUAN", "NETTO", "CIF"]]
+    total_netto = 0.0
+    total_cif = 0.0
+    for i in range(barang_rows):
+        netto = round(rng.uniform(1, 2000), 2)
+        cif = round(netto * rng.uniform(1, 15), 2)
+        total_netto += netto
+        total_cif += cif
+        hs = "" if rng.random() >= hs_known_ratio else f"{39000000 + i % 99999:08d}"
+        barang.append([
+            hs,
+            f"MA{41000000 + i:08d}",
+            _uraian(i),
+            rng.choice(SATUAN),
+            rng.randint(1, 500),
+            netto,
+            cif,
+        ])
+
+    dokumen = [["SERI", "NOMOR DOKUMEN", "TANGGAL"]]
+    for i in range(dokumen_rows):
+        dokumen.append([i + 1, f"SID{270000 + seed:07d}-{i}", day.isoformat()])
+
+    return {
+        "HEADER": [
+            ["CIF", "BRUTO", "NETTO", "TANGGAL PERNYATAAN", "KODE VALUTA"],
+            [round(total_cif, 2), round(total_netto * 1.1, 2), round(total_netto, 2), day.isoformat(), "USD"],
+        ],
+        "ENTITAS": [
+            ["NAMA ENTITAS", "ALAMAT ENTITAS"],
+            [_customer_name(rng.randrange(max(customers, 1))), "JL. SYNTHETIC NO. 1, BEKASI"],
+        ],
+        "DOKUMEN": dokumen,
+        "PENGANGKUT": [["NAMA PENGANGKUT"], ["TRUCK"]],
+        "BARANG": barang,
+    }
+
+
+def make_customer_reference(path, customers=50):
+    """Writes a LIST_OF_CUSTOMER.xlsx look-alike with `customers` rows."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(CUSTOMER_HEADERS + [None, None, None, None])
+    for i in range(customers):
+        ws.append([
+            "8", "8", "6", f"{10000000000 + i:022d}", _customer_name(i),
+            f"KAWASAN INDUSTRI BLOK {i}, BEKASI", None, None, None,
+            f"{i}/KM.4/WBC.08/2025", datetime(2025, 1, 1), None, None, None,
+            datetime(2025, 3, 1) if i == 0 else None,
+        ])
+    wb.save(path)
+    return path
+
+
+def make_hs_reference(path, hs_rows=250, barang_rows=10):
+    """
+    Writes an HS_CODE.xlsx look-alike with `hs_rows` rows. The URAIAN values
+    generated by make_extraction(barang_rows) are listed first.
+    """
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["HS", "URAIAN"])
+    for i in range(hs_rows):
+        if i < barang_rows:
+            ws.append([f"{39000000 + i % 99999:08d}", _uraian(i)])
+        else:
+            ws.append([f"{29000000 + i % 99999:08d}", f"REFERENCE ONLY ITEM {i}"])
+    wb.save(path)
+    return path
+
+
+# --------------------------------------------------
+# STUB EXTRACTOR
+# --------------------------------------------------
+def stub_extractor(payload):
+    """
+    Returns a drop-in replacement for extract_with_gemini that ignores the
+    PDFs and returns a copy of `payload`.
+    """
+    def extract(invoice_pdf=None, packing_pdf=None):
+        return {sheet: [list(row) for row in rows] for sheet, rows in payload.items()}
+
+    return extract
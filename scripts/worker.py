@@ -0,0 +1,136 @@
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from scripts.job_queue import get_queue
+from scripts.metrics import QUEUE_DEPTH
+from scripts.run_pipeline import load_config, run_custom_pipeline
+from scripts.serials import allocate_serial
+from scripts.workspace import job_workspace, sweep
+
+# --------------------------------------------------
+# QUEUE WORKER
+# --------------------------------------------------
+# Stateless worker: claims jobs from the shared queue, runs the pipeline in
+# a throw-away directory and publishes the workbook back to the queue.
+# Start as many as the machines allow:
+#
+#   python -m scripts.worker
+#   python -m scripts.worker --once          (drain the queue, then exit)
+#
+# Each node only needs the code, config.yaml (INABATA_BASE_DIR may point at
+# the local checkout) and the template/reference files.
+#
+# While a job runs, a background thread heartbeats it; a job whose
+# heartbeat stops for --stale-after seconds (worker killed, machine gone)
+# is put back in the queue by the next worker that polls.
+
+
+@contextmanager
+def heartbeat(queue, job_id, interval):
+    """Heartbeats job_id every `interval` seconds until the block exits."""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                queue.heartbeat(job_id)
+            except Exception as e:
+                print(f"   ! Warning: Heartbeat for job {job_id} failed: {e}")
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def process_job(cfg, queue, job):
+    job_id = job["job_id"]
+    print(f"\n--- Worker picked job {job_id} (requested serial {job['serial_number'] or '-'}) ---")
+
+    def allocate(requested):
+        # Taken from the shared counter once the extraction passed validation
+        serial = allocate_serial(cfg, requested)
+        queue.assign_serial(job_id, serial)
+        return serial
+
+    # Scratch on tmpfs when available; nothing is promoted, the workbook
+    # goes back through the queue (see scripts/workspace.py)
+    with job_workspace(cfg, job_id) as workspace:
+        invoice_path = workspace.save_upload(job["invoice_name"], job["invoice_pdf"])
+        packing_path = workspace.save_upload(job["packing_name"], job["packing_pdf"])
+
+        queue.set_stage(job_id, "pipeline")
+        final_path = run_custom_pipeline(
+            invoice_path,
+            packing_path,
+            job["serial_number"],
+            job_id=job_id,
+            profile=bool(job["options"].get("profile")),
+            work_dir=workspace.path,
+            allocate=allocate,
+        )
+
+        with open(final_path, "rb") as f:
+            queue.complete(job_id, os.path.basename(final_path), f.read())
+
+    print(f"✅ Job {job_id} published")
+
+
+def run_worker(once=False, poll_interval=1.0, stale_after=900, heartbeat_interval=30):
+    cfg = load_config()
+    queue = get_queue(cfg)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    # Several beats within stale_after, so one slow write does not requeue a live job
+    heartbeat_interval = min(heartbeat_interval, stale_after / 3)
+    print(f"--- Worker {worker_id} started ({type(queue).__name__}) ---")
+    # Scratch left behind by a worker that was killed on this machine
+    sweep(cfg)
+
+    while True:
+        requeued = queue.requeue_stale(stale_after)
+        if requeued:
+            print(f"   ! Requeued {requeued} stale job(s)")
+
+        job = queue.claim(worker_id)
+        QUEUE_DEPTH.set(queue.depth(), queue="shared")
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        try:
+            with heartbeat(queue, job["job_id"], heartbeat_interval):
+                process_job(cfg, queue, job)
+        except Exception as e:
+            print(f"❌ Job {job['job_id']} failed: {e}")
+            queue.fail(job["job_id"], e)
+
+
+def main(argv=None):
+    cfg = load_config()
+    worker_cfg = (cfg.get("queue") or {}).get("worker") or {}
+
+    parser = argparse.ArgumentParser(description="Process shipments from the shared job queue.")
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    parser.add_argument("--poll-interval", type=float, default=worker_cfg.get("poll_interval", 1.0))
+    parser.add_argument("--stale-after", type=float, default=worker_cfg.get("stale_after_seconds", 900),
+                        help="requeue running jobs without a heartbeat for this long (seconds)")
+    parser.add_argument("--heartbeat", type=float, default=worker_cfg.get("heartbeat_seconds", 30),
+                        help="how often a running job is heartbeated (seconds)")
+    args = parser.parse_args(argv)
+
+    run_worker(args.once, args.poll_interval, args.stale_after, args.heartbeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+from scripts.metrics import WORKSPACES_REMOVED
+from scripts.storage import kind_dir, record_files, shard_dir
+
+# --------------------------------------------------
+# PER-JOB SCRATCH WORKSPACES
+# --------------------------------------------------
+# Every job gets its own directory for the uploaded PDFs, the intermediate
+# JSON and the output, instead of writing data/input, data/intermediate and
+# data/output under the client's upload names, NOMOR DOKUMEN and NOMOR AJU
+# (two shipments uploaded as invoice.pdf used to overwrite each other):
+#
+#   <root>/inabata-job-<job_id>-<random>/
+#       input/         uploads
+#       intermediate/  <NOMOR DOKUMEN>.json
+#       output/        <NOMOR AJU>.xlsx
+#       .owner         {"job_id", "host", "pid", "created_at", "deadline"}
+#
+# root is /dev/shm (RAM-backed) when workspace.tmpfs is on and it has
+# min_free_mb free, otherwise workspace.dir or the system temp dir.
+#
+# When the job succeeds, its output and the kinds listed in
+# workspace.promote are moved into today's data/ shards and indexed
+# (scripts/storage.py). Inputs and intermediates that would overwrite
+# another job's file get a -<n> suffix; outputs replace the previous
+# workbook of the same NOMOR AJU as before.
+# The directory is removed when the job ends, whatever the outcome. sweep()
+# reclaims the rest: directories of processes that died, and directories
+# past their deadline (workspace.timeout_seconds); a job that still needs
+# its files then fails (504 from the API). The API sweeps every
+# sweep_interval_seconds.
+#
+# Usage: python -m scripts.workspace list | sweep
+
+PREFIX = "inabata-job-"
+OWNER_FILE = ".owner"
+SUBDIRS = {"input": "input", "intermediate": "intermediate", "output": "output"}
+TMPFS = "/dev/shm"
+
+
+def workspace_cfg(cfg):
+    return cfg.get("workspace") or {}
+
+
+def disk_root(cfg):
+    return workspace_cfg(cfg).get("dir") or tempfile.gettempdir()
+
+
+def scratch_root(cfg):
+    """/dev/shm when enabled, writable and roomy enough; the disk root otherwise."""
+    settings = workspace_cfg(cfg)
+    if settings.get("tmpfs", True) and os.path.isdir(TMPFS) and os.access(TMPFS, os.W_OK):
+        free_mb = shutil.disk_usage(TMPFS).free / (1024 * 1024)
+        if free_mb >= float(settings.get("min_free_mb") or 0):
+            return TMPFS
+        print(f"   ! Warning: {TMPFS} has {free_mb:.0f} MB free; using {disk_root(cfg)} for scratch")
+    return disk_root(cfg)
+
+
+class Workspace:
+    def __init__(self, path, job_id, deadline=None):
+        self.path = path
+        self.job_id = job_id
+        self.deadline = deadline
+        self.removed = False
+
+    def dir(self, kind):
+        path = os.path.join(self.path, SUBDIRS[kind])
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @property
+    def input_dir(self):
+        return self.dir("input")
+
+    @property
+    def expired(self):
+        """Past its deadline, or reclaimed by sweep() while the job was running."""
+        if self.deadline is not None and time.time() > self.deadline:
+            return True
+        return not self.removed and not os.path.isdir(self.path)
+
+    def save_upload(self, filename, source):
+        """Copies a file object into input/ under its base name (made unique); returns the path."""
+        path = unique_path(self.input_dir, os.path.basename(filename) or "upload.pdf")
+        with open(path, "wb") as f:
+            if isinstance(source, bytes):
+                f.write(source)
+            else:
+                shutil.copyfileobj(source, f)
+        return path
+
+    def files(self, kind):
+        path = os.path.join(self.path, SUBDIRS[kind])
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if not name.endswith(".tmp"))
+
+    def promote(self, cfg, nomor_aju=None, kinds=None):
+        """
+        Moves this job's files of `kinds` (default workspace.promote; the
+        output always) into today's data/ shards and indexes them. Returns
+        {kind: [durable paths]}.
+        """
+        kinds = kinds if kinds is not None else workspace_cfg(cfg).get("promote", ["input", "intermediate"])
+        kinds = list(dict.fromkeys([*kinds, "output"]))
+        promoted = {}
+        for kind in kinds:
+            paths = [
+                promote_file(path, shard_dir(kind_dir(cfg, kind), cfg), replace=kind == "output")
+                for path in self.files(kind)
+            ]
+            if paths:
+                promoted[kind] = paths
+        record_files(cfg, promoted, nomor_aju, self.job_id)
+        return promoted
+
+    def remove(self, reason="finished"):
+        self.removed = True
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+            WORKSPACES_REMOVED.inc(reason=reason)
+
+
+def unique_path(directory, name):
+    """directory/name, or directory/<stem>-<n><ext> for the first free n."""
+    stem, ext = os.path.splitext(name)
+    path, n = os.path.join(directory, name), 1
+    while os.path.exists(path):
+        n += 1
+        path = os.path.join(directory, f"{stem}-{n}{ext}")
+    return path
+
+
+def promote_file(path, dest_dir, replace=False):
+    """
+    Moves path into dest_dir (atomically: copied next to the target across
+    filesystems, then renamed). Unless replace, an existing name is kept and
+    the file gets the next free -<n> suffix. Returns the new path.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    tmp = os.path.join(dest_dir, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    shutil.move(path, tmp)
+    if replace:
+        dest = os.path.join(dest_dir, os.path.basename(path))
+    else:
+        # O_EXCL reserves the name, so two jobs promoting invoice.pdf at
+        # the same moment cannot pick the same one
+        while True:
+            dest = unique_path(dest_dir, os.path.basename(path))
+            try:
+                os.close(os.open(dest, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                continue
+    os.replace(tmp, dest)
+    return dest
+
+
+@contextmanager
+def job_workspace(cfg, job_id, root=None):
+    """Creates the job's scratch directory and removes it when the block exits."""
+    timeout = float(workspace_cfg(cfg).get("timeout_seconds") or 0)
+    root = root or scratch_root(cfg)
+    os.makedirs(root, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=f"{PREFIX}{job_id}-", dir=root)
+    now = time.time()
+    workspace = Workspace(path, job_id, now + timeout if timeout else None)
+    with open(os.path.join(path, OWNER_FILE), "w", encoding="utf-8") as f:
+        json.dump(
+            {"job_id": job_id, "host": socket.gethostname(), "pid": os.getpid(),
+             "created_at": now, "deadline": workspace.deadline},
+            f,
+        )
+    try:
+        yield workspace
+    finally:
+        workspace.remove()
+
+
+# --------------------------------------------------
+# SWEEP
+# --------------------------------------------------
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _dir_bytes(path):
+    total = 0
+    for dirpath, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def list_workspaces(cfg):
+    """Scratch directories under the tmpfs and disk roots, with their owner and state."""
+    host = socket.gethostname()
+    entries = []
+    for root in dict.fromkeys([TMPFS, disk_root(cfg)]):
+        if not os.path.isdir(root):
+            continue
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if not name.startswith(PREFIX) or not os.path.isdir(path):
+                continue
+            try:
+                with open(os.path.join(path, OWNER_FILE), "r", encoding="utf-8") as f:
+                    owner = json.load(f)
+            except (OSError, ValueError):
+                owner = {"created_at": os.path.getmtime(path)}
+            state = "active"
+            if owner.get("host") == host and owner.get("pid") and not _alive(owner["pid"]):
+                state = "orphaned"
+            elif owner.get("deadline") and time.time() > owner["deadline"]:
+                state = "expired"
+            elif "pid" not in owner and time.time() - owner["created_at"] > 3600:
+                state = "orphaned"  # unreadable owner file, more than an hour old
+            entries.append({
+                "path": path,
+                "job_id": owner.get("job_id"),
+                "age_seconds": round(time.time() - owner["created_at"]),
+                "bytes": _dir_bytes(path),
+                "state": state,
+            })
+    return entries
+
+
+def sweep(cfg):
+    """Removes orphaned and expired scratch directories; returns the removed entries."""
+    removed = []
+    for entry in list_workspaces(cfg):
+        if entry["state"] == "active":
+            continue
+        shutil.rmtree(entry["path"], ignore_errors=True)
+        WORKSPACES_REMOVED.inc(reason=entry["state"])
+        print(f"   > Removed {entry['state']} scratch of job {entry['job_id']} ({entry['bytes']} bytes)")
+        removed.append(entry)
+    return removed
+
+
+async def sweep_loop(cfg):
+    """Runs sweep() in the executor every workspace.sweep_interval_seconds."""
+    loop = asyncio.get_running_loop()
+    interval = float(workspace_cfg(cfg).get("sweep_interval_seconds") or 60)
+    while True:
+        try:
+            await loop.run_in_executor(None, sweep, cfg)
+        except Exception as e:
+            print(f"   ! Warning: Scratch sweep failed: {e}")
+        await asyncio.sleep(interval)
+
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+def main(argv=None):
+    from scripts.run_pipeline import load_config
+
+    parser = argparse.ArgumentParser(description="Per-job scratch workspaces.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="scratch directories with their job, age, size and state")
+    sub.add_parser("sweep", help="remove orphaned and expired scratch directories now")
+    args = parser.parse_args(argv)
+
+    cfg = load_config()
+    print(f"--- Scratch root: {scratch_root(cfg)} ---")
+    if args.command == "list":
+        entries = list_workspaces(cfg)
+        for e in entries:
+            print(f"{e['state']:<9} {e['job_id'] or '-':<34} {e['age_seconds']:>7}s {e['bytes']:>12} B  {e['path']}")
+        if not entries:
+            print("No scratch directories.")
+    elif args.command == "sweep":
+        removed = sweep(cfg)
+        print(f"✅ Removed {len(removed)} scratch director{'y' if len(removed) == 1 else 'ies'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
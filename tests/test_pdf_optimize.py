@@ -0,0 +1,237 @@
+import zlib
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from scripts import pdf_optimize
+from scripts.pdf_optimize import Ref, optimize_pdf, optimized_for_upload, read_objects
+
+# --------------------------------------------------
+# ROUND TRIPS OF scripts/pdf_optimize.py
+# --------------------------------------------------
+# The PDFs are built here: a Pillow scan (JPEG), a raw Flate scan with a
+# classic xref table, the same scan with its page tree inside a compressed
+# object stream (PDF 1.5 xref stream), and files that must come back
+# untouched.
+
+A4 = b"[0 0 595 842]"
+CONTENT = b"BT /F1 12 Tf 72 720 Td (INVOICE 123) Tj ET q 595 0 0 842 0 0 cm /Im1 Do Q"
+
+
+def noise(size, mode="L"):
+    image = Image.effect_noise(size, 40).convert(mode)
+    return image.resize((size[0] // 4, size[1] // 4)).resize(size)  # scan-like grain
+
+
+def stream_obj(entries, data):
+    return b"<<" + entries + b" /Length %d>>\nstream\n" % len(data) + data + b"\nendstream"
+
+
+def page_objects(image_obj):
+    """Catalog, page tree, page, font and content; the image is object 4."""
+    return {
+        1: b"<</Type /Catalog /Pages 2 0 R>>",
+        2: b"<</Type /Pages /Kids [3 0 R] /Count 1>>",
+        3: b"<</Type /Page /Parent 2 0 R /MediaBox " + A4 + b" /Contents 6 0 R"
+           b" /Resources <</Font <</F1 5 0 R>> /XObject <</Im1 4 0 R>>>>>>",
+        4: image_obj,
+        5: b"<</Type /Font /Subtype /Type1 /BaseFont /Helvetica>>",
+        6: stream_obj(b"", CONTENT),
+    }
+
+
+def flate_image(image):
+    colour = b"/DeviceGray" if image.mode == "L" else b"/DeviceRGB"
+    return stream_obj(
+        b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8"
+        b" /Filter /FlateDecode" % (image.width, image.height, colour),
+        zlib.compress(image.tobytes()),
+    )
+
+
+def build_pdf(objects, trailer=b""):
+    """Classic file: objects in order, xref table, trailer."""
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = {}
+    for num in sorted(objects):
+        offsets[num] = out.tell()
+        out.write(b"%d 0 obj\n" % num + objects[num] + b"\nendobj\n")
+    xref = out.tell()
+    size = max(objects) + 1
+    out.write(b"xref\n0 %d\n0000000000 65535 f\r\n" % size)
+    for num in range(1, size):
+        out.write(b"%010d 00000 n\r\n" % offsets[num])
+    out.write(b"trailer\n<</Size %d /Root 1 0 R%s>>\nstartxref\n%d\n%%%%EOF\n" % (size, trailer, xref))
+    return out.getvalue()
+
+
+def build_pdf_with_object_stream(objects, packed):
+    """PDF 1.5 file: the `packed` objects inside one object stream, xref stream at the end."""
+    stm_num, xref_num = max(objects) + 1, max(objects) + 2
+    header, bodies = [], b""
+    for num in packed:
+        header.append(b"%d %d" % (num, len(bodies)))
+        bodies += objects[num] + b"\n"
+    header = b" ".join(header) + b"\n"
+    loose = {num: body for num, body in objects.items() if num not in packed}
+    loose[stm_num] = stream_obj(
+        b"/Type /ObjStm /N %d /First %d /Filter /FlateDecode" % (len(packed), len(header)),
+        zlib.compress(header + bodies),
+    )
+
+    out = BytesIO()
+    out.write(b"%PDF-1.5\n")
+    entries = {0: (0, 0, 65535)}
+    for index, num in enumerate(packed):
+        entries[num] = (2, stm_num, index)
+    for num in sorted(loose):
+        entries[num] = (1, out.tell(), 0)
+        out.write(b"%d 0 obj\n" % num + loose[num] + b"\nendobj\n")
+    entries[xref_num] = (1, out.tell(), 0)
+    rows = b"".join(
+        bytes([kind]) + field.to_bytes(4, "big") + extra.to_bytes(2, "big")
+        for kind, field, extra in (entries[num] for num in range(xref_num + 1))
+    )
+    out.write(b"%d 0 obj\n" % xref_num + stream_obj(
+        b"/Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Filter /FlateDecode" % (xref_num + 1),
+        zlib.compress(rows),
+    ) + b"\nendobj\n")
+    out.write(b"startxref\n%d\n%%%%EOF\n" % entries[xref_num][1])
+    return out.getvalue()
+
+
+def resolve(objects, value):
+    while isinstance(value, Ref):
+        value = objects[value.num].value
+    return value
+
+
+def page_image(objects, trailer):
+    """The first page's XObject, following the tree from the trailer's Root."""
+    catalog = resolve(objects, trailer["Root"])
+    pages = resolve(objects, catalog["Pages"])
+    page = resolve(objects, pages["Kids"][0])
+    xobjects = resolve(objects, resolve(objects, page["Resources"])["XObject"])
+    return objects[next(iter(xobjects.values())).num]
+
+
+def assert_round_trip(original, result, expected_width):
+    """Same objects, same non-image content, a smaller JPEG that decodes at the expected size."""
+    before, _ = read_objects(original)
+    after, trailer = read_objects(result)
+    assert set(after) == set(before)
+    image = page_image(after, trailer)
+    for num, obj in before.items():
+        if num != image.num:
+            assert after[num].stream == obj.stream
+            assert after[num].body.strip() == obj.body.strip()
+    assert image.value["Filter"] == "DCTDecode"
+    assert image.value["Width"] == expected_width
+    decoded = Image.open(BytesIO(image.stream))
+    assert decoded.size == (image.value["Width"], image.value["Height"])
+    assert image.value["Length"] == len(image.stream)
+
+
+# ---------- Image PDFs ----------
+def test_pillow_scan_is_resampled():
+    scan = noise((2480, 3508), "RGB")  # A4 at 300 DPI
+    buffer = BytesIO()
+    scan.save(buffer, "PDF", resolution=300, quality=95)
+    data = buffer.getvalue()
+
+    result, stats = optimize_pdf(data, target_dpi=150)
+
+    assert stats == {"images": 1, "resampled": 1, "original": len(data), "optimized": len(result)}
+    assert len(result) < len(data)
+    assert_round_trip(data, result, expected_width=1240)
+
+
+def test_flate_scan_is_resampled_and_text_kept():
+    data = build_pdf(page_objects(flate_image(noise((1654, 2339)))))  # A4 at 200 DPI
+
+    result, stats = optimize_pdf(data, target_dpi=100)
+
+    assert stats["resampled"] == 1
+    assert_round_trip(data, result, expected_width=827)
+    assert CONTENT in result
+
+
+def test_object_stream_pdf_is_resampled():
+    objects = page_objects(flate_image(noise((1654, 2339))))
+    data = build_pdf_with_object_stream(objects, packed=[1, 2, 3, 5])
+    before, trailer = read_objects(data)
+    assert {1, 2, 3, 5} <= set(before) and trailer["Root"].num == 1
+
+    result, stats = optimize_pdf(data, target_dpi=100)
+
+    assert stats["resampled"] == 1
+    assert_round_trip(data, result, expected_width=827)
+    # Rewritten as a classic file: the object and xref streams are gone
+    assert b"/ObjStm" not in result and b"/XRef" not in result
+    assert b"\nxref\n" in result
+
+
+# ---------- Pass-through ----------
+def test_text_only_pdf_is_returned_unchanged():
+    objects = page_objects(b"<<>>")
+    data = build_pdf(objects)
+
+    result, stats = optimize_pdf(data)
+
+    assert result is data
+    assert stats["images"] == 0 and stats["optimized"] == len(data)
+
+
+def test_small_and_low_resolution_images_are_left_alone():
+    logo = build_pdf(page_objects(flate_image(noise((300, 200)))))
+    low_dpi = build_pdf(page_objects(flate_image(noise((1240, 1754)))))  # 150 DPI
+
+    for data in (logo, low_dpi):
+        result, stats = optimize_pdf(data, target_dpi=150)
+        assert result is data
+        assert stats["images"] == 1 and stats["resampled"] == 0
+
+
+def test_encrypted_pdf_is_returned_unchanged():
+    data = build_pdf(page_objects(flate_image(noise((1654, 2339)))), trailer=b" /Encrypt <</Filter /Standard>>")
+
+    result, stats = optimize_pdf(data, target_dpi=100)
+
+    assert result is data and stats["resampled"] == 0
+
+
+def test_unreadable_object_is_not_dropped():
+    objects = page_objects(flate_image(noise((1654, 2339))))
+    objects[7] = b"<</Broken (unterminated"
+    data = build_pdf(objects)
+
+    with pytest.raises(ValueError, match="object 7"):
+        optimize_pdf(data, target_dpi=100)
+
+
+def test_upload_falls_back_to_the_original(tmp_path, monkeypatch):
+    objects = page_objects(flate_image(noise((1654, 2339))))
+    objects[7] = b"<</Broken (unterminated"
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(build_pdf(objects))
+    scan = tmp_path / "scan.pdf"
+    scan.write_bytes(build_pdf(page_objects(flate_image(noise((1654, 2339))))))
+
+    monkeypatch.setattr(pdf_optimize, "_settings", {"enabled": True, "target_dpi": 100, "min_file_kb": 0})
+    with optimized_for_upload(str(broken), str(scan)) as uploads:
+        assert uploads[0] == str(broken)
+        assert uploads[1] != str(scan)
+        with open(uploads[1], "rb") as f:
+            assert_round_trip(scan.read_bytes(), f.read(), expected_width=827)
+
+
+def test_disabled_by_default(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_optimize, "_settings", None)
+    assert pdf_optimize.optimize_settings().get("enabled") is False
+
+    scan = tmp_path / "scan.pdf"
+    scan.write_bytes(build_pdf(page_objects(flate_image(noise((1654, 2339))))))
+    with optimized_for_upload(str(scan)) as uploads:
+        assert uploads == (str(scan),)
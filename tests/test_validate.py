@@ -0,0 +1,52 @@
+from scripts.validate import has_errors, validate_extraction
+
+# --------------------------------------------------
+# CHECKS OF scripts/validate.py
+# --------------------------------------------------
+
+
+def extraction(header=None, barang=None):
+    return {
+        "HEADER": header or [["CIF", "BRUTO", "NETTO"], [1000, 120, 100]],
+        "BARANG": barang or [["KODE SATUAN", "NETTO", "CIF"], ["KGM", 60, 600], ["KGM", 40, 400]],
+    }
+
+
+def messages(issues, severity):
+    return [i["message"] for i in issues if i["severity"] == severity]
+
+
+def test_clean_extraction_has_no_issues():
+    assert validate_extraction(extraction()) == []
+
+
+def test_european_numbers_are_parsed_with_a_warning():
+    issues = validate_extraction(extraction(header=[["CIF", "NETTO"], ["1.000,00", "100"]]))
+
+    assert not has_errors(issues)
+    assert messages(issues, "warning") == [
+        "HEADER CIF: numbers returned as text (parsed with comma as decimal separator)",
+        "HEADER NETTO: numbers returned as text (parsed with comma as decimal separator)",
+    ]
+
+
+def test_totals_mismatch_is_an_error():
+    issues = validate_extraction(extraction(header=[["CIF", "NETTO"], [1000, 150]]))
+
+    assert messages(issues, "error") == ["BARANG NETTO sums to 100.00 but HEADER NETTO is 150.00"]
+
+
+def test_repeated_checked_column_is_reported():
+    issues = validate_extraction({"HEADER": [["CIF", "NETTO", "NETTO"], ["1", "2", "3"]], "BARANG": [["NETTO"], ["2"]]})
+
+    duplicate = [i for i in issues if "only the first is checked" in i["message"]]
+    assert [(i["severity"], i["sheet"], i["column"]) for i in duplicate] == [("warning", "HEADER", "NETTO")]
+    # The first NETTO (2) is the one compared with BARANG
+    assert not has_errors(issues)
+
+
+def test_unit_codes():
+    issues = validate_extraction(extraction(barang=[["KODE SATUAN", "NETTO", "CIF"], ["", 60, 600], ["BOX", 40, 400]]))
+
+    assert messages(issues, "warning") == ["BARANG KODE SATUAN missing"]
+    assert messages(issues, "error") == ["BARANG KODE SATUAN outside ['KGM', 'MTR', 'RO', 'ST']: 'BOX'"]